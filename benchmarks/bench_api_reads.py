@@ -0,0 +1,144 @@
+"""p50/p99 latency of GET /users/{steamid}/top at 500 concurrent clients.
+
+Run with ``PYTHONPATH=src python benchmarks/bench_api_reads.py``.
+Compares the old blocking ``def`` handler on FastAPI's threadpool with the
+async handler on the DB thread pool and on the async engine (aiosqlite
+unless ``--url`` points elsewhere).
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import tempfile
+import time
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI, Request
+
+from nextgame.api.app import create_app
+from nextgame.config import Settings
+from nextgame.storage.db import DB, Game, Ownership, User
+
+STEAMID = "76561190000000000"
+
+
+def seed(url: str, games: int):
+    db = DB(url)
+    db.create_all()
+    with db.session() as s:
+        user = User(steamid=STEAMID)
+        s.add(user)
+        s.flush()
+        s.add_all(Game(appid=i, name=f"Game {i}") for i in range(1, games + 1))
+        s.flush()
+        s.add_all(
+            Ownership(user_id=user.id, appid=i, playtime_forever=i * 7 % 5000, playtime_2weeks=i % 13)
+            for i in range(1, games + 1)
+        )
+        s.commit()
+    db.dispose()
+
+
+def legacy_app(settings: Settings) -> FastAPI:
+    # the pre-async handler: blocking ORM work in a sync def route
+    app = create_app(settings)
+
+    def get_db(request: Request) -> DB:
+        return request.app.state.db
+
+    @app.get("/legacy/users/{steamid}/top")
+    def top(steamid: str, limit: int = 10, db: DB = Depends(get_db)):
+        with db.session() as s:
+            user = s.query(User).filter_by(steamid=steamid).one()
+            rows = (
+                s.query(Ownership, Game)
+                .join(Game, Game.appid == Ownership.appid)
+                .filter(Ownership.user_id == user.id)
+                .order_by(Ownership.playtime_forever.desc())
+                .limit(limit)
+                .all()
+            )
+            return [{"appid": g.appid, "name": g.name, "playtime_forever": o.playtime_forever} for o, g in rows]
+
+    return app
+
+
+def _run_server(settings: Settings, sock: socket.socket):
+    server = uvicorn.Server(uvicorn.Config(legacy_app(settings), log_level="warning", backlog=4096,
+                                           timeout_keep_alive=60))
+    server.run(sockets=[sock])
+
+
+def serve(settings: Settings) -> tuple[multiprocessing.Process, str]:
+    # separate process so the load generator does not share the server's GIL
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(4096)
+    port = sock.getsockname()[1]
+    proc = multiprocessing.get_context("fork").Process(target=_run_server, args=(settings, sock), daemon=True)
+    proc.start()
+    sock.close()
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(500):
+        try:
+            httpx.get(f"{base_url}/health").raise_for_status()
+            break
+        except httpx.HTTPError:
+            time.sleep(0.02)
+    return proc, base_url
+
+
+async def load(base_url: str, path: str, clients: int, requests_per_client: int) -> list[float]:
+    latencies: list[float] = []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def worker():
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                (await client.get(path)).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    return latencies
+
+
+def report(label: str, latencies: list[float], elapsed: float):
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{label:<22} p50 {q[49] * 1000:7.1f} ms   p99 {q[98] * 1000:7.1f} ms   {len(latencies) / elapsed:7.0f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=4, help="requests per client")
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--url", default=None)
+    args = parser.parse_args()
+
+    url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    seed(url, args.games)
+
+    variants = [
+        ("sync def (legacy)", False, f"/legacy/users/{STEAMID}/top"),
+        ("async + thread pool", False, f"/users/{STEAMID}/top"),
+        ("async engine", True, f"/users/{STEAMID}/top"),
+    ]
+    for label, use_async, path in variants:
+        settings = Settings(database_url=url, db_async=use_async, sync_workers=0)
+        proc, base_url = serve(settings)
+        try:
+            start = time.perf_counter()
+            latencies = asyncio.run(load(base_url, path, args.clients, args.requests))
+            report(label, latencies, time.perf_counter() - start)
+        finally:
+            proc.terminate()
+            proc.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Cold-start time and import cost of every ``nextgame`` CLI command.
+
+Run with ``PYTHONPATH=src python benchmarks/bench_cli_startup.py``.
+Each command is started ``--runs`` times in a fresh interpreter as
+``python -m nextgame <command> --help`` (the CLI callback runs, the command
+body does not), then the commands that need neither Steam nor OpenAI run end
+to end against a throwaway SQLite file. ``-X importtime`` output of one extra
+run gives the module count and the slowest top-level imports.
+"""
+from __future__ import annotations
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = [
+    "init-db", "migrate", "login-url", "refresh-profiles", "worker", "sync-all", "import-catalog", "build-similarity",
+    "precompute-recommendations", "compact-deltas", "compact-snapshots", "serve-api",
+]
+# commands that can run offline, in an order that leaves the database valid for the next one
+OFFLINE_RUNS = [
+    ["login-url", "--return-to", "http://localhost/auth"],
+    ["init-db"],
+    ["migrate"],
+    ["compact-deltas"],
+    ["compact-snapshots", "--dry-run"],
+]
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def run(argv: list[str], env: dict, importtime: bool = False) -> subprocess.CompletedProcess:
+    flags = ["-X", "importtime"] if importtime else []
+    return subprocess.run(
+        [sys.executable, *flags, "-m", "nextgame", *argv], env=env, capture_output=True, text=True, check=True
+    )
+
+
+def cold_start(argv: list[str], env: dict, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run(argv, env)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def import_profile(argv: list[str], env: dict, top: int) -> tuple[int, list[tuple[int, str]]]:
+    modules = 0
+    roots = []
+    for line in run(argv, env, importtime=True).stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        modules += 1
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # direct imports of the entry point are indented by a single space
+        if indent == 1:
+            roots.append((cumulative, name))
+    return modules, sorted(roots, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=4, help="Slowest top-level imports shown per command")
+    parser.add_argument("commands", nargs="*", default=COMMANDS)
+    args = parser.parse_args()
+
+    tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp.name}"}
+    cases = [(command, [command, "--help"]) for command in args.commands]
+    cases += [(f"{argv[0]} (run)", argv) for argv in OFFLINE_RUNS]
+    try:
+        baseline = cold_start(["--help"], env, args.runs)
+        print(f"{'nextgame --help':<26} {baseline * 1000:8.1f} ms")
+        for label, argv in cases:
+            elapsed = cold_start(argv, env, args.runs)
+            modules, roots = import_profile(argv, env, args.top)
+            slowest = ", ".join(f"{name} {us / 1000:.0f}ms" for us, name in roots)
+            print(f"{label:<26} {elapsed * 1000:8.1f} ms  {modules:5d} modules  {slowest}")
+    finally:
+        os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
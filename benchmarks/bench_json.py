@@ -0,0 +1,117 @@
+"""stdlib json against the orjson paths on a 5k-game GetOwnedGames payload.
+
+Run with ``PYTHONPATH=src python benchmarks/bench_json.py``.
+Covers decoding the Steam response, the snapshot payload encode/decode, the
+library content hash and serialising a cached top-games body (the only API
+path that encodes by hand; response_model routes already go through
+pydantic's serializer). Also checks
+that both encoders produce the same bytes for this int/string payload, so
+switching backends does not churn snapshot deltas, and that the library hash
+is unchanged.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import random
+import time
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from pydantic_core import to_json
+
+from nextgame import fastjson
+from nextgame.api.routes import GameOut
+from nextgame.storage.upsert import games_content_hash
+
+
+def synthetic_payload(n: int, seed: int = 0) -> dict:
+    rnd = random.Random(seed)
+    games = [
+        {
+            "appid": 10 + i,
+            "name": rnd.choice(["Game", "Jeu", "Spiel", "ゲーム", "Игра"]) + f" {i}: Édition™",
+            "playtime_forever": rnd.randint(0, 50_000),
+            "img_icon_url": f"{rnd.getrandbits(160):040x}",
+            "has_community_visible_stats": rnd.random() < 0.5,
+            "playtime_windows_forever": rnd.randint(0, 50_000),
+            "playtime_mac_forever": 0,
+            "playtime_linux_forever": 0,
+            "playtime_deck_forever": 0,
+            "rtime_last_played": rnd.randint(1_300_000_000, 1_760_000_000),
+            "playtime_disconnected": 0,
+            **({"playtime_2weeks": rnd.randint(1, 600)} if rnd.random() < 0.1 else {}),
+        }
+        for i in range(n)
+    ]
+    return {"response": {"game_count": n, "games": games}}
+
+
+def stdlib_dumps(value) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def stdlib_hash(games: list[dict]) -> str:
+    rows = sorted(
+        (int(g["appid"]), (g.get("name"), int(g.get("playtime_forever", 0)), int(g.get("playtime_2weeks", 0))))
+        for g in games
+    )
+    digest = hashlib.sha256(b"complete")
+    digest.update(stdlib_dumps(rows))
+    return digest.hexdigest()
+
+
+def bench(label: str, fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    per_call = (time.perf_counter() - start) / repeat
+    print(f"  {label:<44} {per_call * 1000:8.2f} ms")
+    return per_call
+
+
+def compare(title: str, old, new, repeat: int, new_label: str = ""):
+    print(title)
+    before = bench("stdlib", old, repeat)
+    after = bench(new_label or ("orjson" if fastjson.available() else "fastjson (stdlib fallback)"), new, repeat)
+    print(f"  {'speedup':<44} {before / after:8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    payload = synthetic_payload(args.games)
+    body = stdlib_dumps(payload)
+    games = payload["response"]["games"]
+    top = [
+        GameOut(
+            appid=g["appid"], name=g["name"], playtime_forever=g["playtime_forever"],
+            playtime_2weeks=g.get("playtime_2weeks", 0),
+        )
+        for g in games
+    ]
+    print(f"{args.games} games, {len(body) / 1024:.0f} KiB body, orjson={'yes' if fastjson.available() else 'no'}")
+
+    assert fastjson.dumps(payload) == body, "encoders disagree; snapshot deltas would churn"
+    assert games_content_hash(games, True) == stdlib_hash(games), "library hash changed"
+
+    response = httpx.Response(200, content=body, headers={"Content-Type": "application/json"})
+    compare("decode Steam response", response.json, lambda: fastjson.loads(response.content), args.repeat)
+    compare("encode snapshot payload", lambda: stdlib_dumps(payload), lambda: fastjson.dumps(payload), args.repeat)
+    compare("decode snapshot payload", lambda: json.loads(body), lambda: fastjson.loads(body), args.repeat)
+    compare("library content hash", lambda: stdlib_hash(games), lambda: games_content_hash(games, True), args.repeat)
+    compare(
+        f"serialise {len(top)} GameOut for the read cache",
+        lambda: stdlib_dumps(jsonable_encoder(top)),
+        lambda: to_json(top),
+        args.repeat,
+        new_label="pydantic_core.to_json",
+    )
+
+
+if __name__ == "__main__":
+    main()
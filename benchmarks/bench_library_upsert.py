@@ -0,0 +1,75 @@
+"""Sync a synthetic 5k-game library through the bulk upsert path.
+
+Run with ``PYTHONPATH=src python benchmarks/bench_library_upsert.py``.
+Uses a throwaway SQLite file unless ``--url`` points at MySQL.
+"""
+from __future__ import annotations
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from nextgame.storage.db import DB, User
+from nextgame.storage.upsert import upsert_owned_games
+
+
+def synthetic_library(n: int, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    return [
+        {
+            "appid": 10 + i,
+            "name": f"Game {i}",
+            "playtime_forever": rnd.randint(0, 50_000),
+            "playtime_2weeks": rnd.choice([0, 0, 0, rnd.randint(1, 600)]),
+        }
+        for i in range(n)
+    ]
+
+
+def run(db: DB, user_id: int, games: list[dict], label: str):
+    statements = 0
+
+    def count(*_):
+        nonlocal statements
+        statements += 1
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    start = time.perf_counter()
+    with db.session() as s:
+        summary = upsert_owned_games(s, user_id, games)
+        s.commit()
+    elapsed = time.perf_counter() - start
+    event.remove(db.engine, "before_cursor_execute", count)
+    print(f"{label:<24} {elapsed * 1000:9.1f} ms  {statements:4d} statements  {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=5000)
+    parser.add_argument("--url", default=None)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    url = args.url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    db = DB(url)
+    db.create_all()
+    with db.session() as s:
+        user = User(steamid="76561190000000000")
+        s.add(user)
+        s.commit()
+        user_id = user.id
+
+    games = synthetic_library(args.games)
+    run(db, user_id, games, "initial sync")
+    run(db, user_id, games, "unchanged re-sync")
+    rnd = random.Random(1)
+    for g in rnd.sample(games, len(games) // 10):
+        g["playtime_forever"] += rnd.randint(1, 120)
+    run(db, user_id, games, "10% playtime changed")
+
+
+if __name__ == "__main__":
+    main()
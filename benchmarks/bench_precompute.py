@@ -0,0 +1,93 @@
+"""``precompute-recommendations`` throughput and resume against the local fake OpenAI server.
+
+Run with ``PYTHONPATH=src:benchmarks python benchmarks/bench_precompute.py``.
+Stops a first run part way, resumes it from the checkpoint, checks that a
+second pass finds nothing to do and that the request path then answers
+without a completion.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import tempfile
+
+from fake_openai import FakeOpenAI, serve_in_thread
+from nextgame.config import Settings
+from nextgame.jobs.precompute import precompute_recommendations
+from nextgame.recommend.cache import RecommendationCache
+from nextgame.recommend.rankings import refresh_ranking
+from nextgame.recommend.recommender import close_async_openai, recommend_games_async
+from nextgame.storage.db import DB, Game, Ownership, User
+
+
+def seed(db: DB, users: int, games: int):
+    db.create_all()
+    with db.session() as s:
+        s.add_all(Game(appid=i, name=f"Game {i}") for i in range(1, games + 1))
+        for u in range(users):
+            user = User(steamid=str(76561190000000000 + u))
+            s.add(user)
+            s.flush()
+            s.add_all(
+                Ownership(user_id=user.id, appid=i, playtime_forever=(i * (u + 3)) % 9000)
+                for i in range(1, games + 1)
+            )
+            s.flush()
+            refresh_ranking(s, user.id)
+        s.commit()
+
+
+async def run(db: DB, settings: Settings, fake: FakeOpenAI, users: int, concurrency: int, checkpoint: str):
+    cache = RecommendationCache(lru_size=0)
+
+    def report(progress):
+        print(f"  {progress.describe()}")
+
+    first = await precompute_recommendations(
+        db, settings, cache, concurrency=concurrency, limit=users // 2, checkpoint=checkpoint, report=report,
+    )
+    print(f"first run (stopped)    {first.synced:5d} users  {first.elapsed:6.2f} s  "
+          f"checkpoint at user {first.position}")
+
+    resumed = await precompute_recommendations(
+        db, settings, cache, concurrency=concurrency, checkpoint=checkpoint, report=report,
+    )
+    done = resumed.synced - resumed.resumed
+    print(f"resumed run            {done:5d} users  {resumed.elapsed:6.2f} s  "
+          f"{done / max(resumed.elapsed, 1e-9):.1f} users/s")
+    assert fake.requests == users, f"{fake.requests} completions for {users} users"
+    assert not os.path.exists(checkpoint), "a finished scan leaves no checkpoint"
+
+    again = await precompute_recommendations(db, settings, cache, concurrency=concurrency, checkpoint=checkpoint)
+    print(f"second pass            {again.synced:5d} users  {again.elapsed:6.2f} s")
+    assert fake.requests == users
+
+    result = await recommend_games_async(db, str(76561190000000000), settings, cache)
+    assert result.get("cached") and fake.requests == users, "request path called the model"
+    print("request path           served from the precomputed entry")
+    await close_async_openai()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency)
+    server, base_url = serve_in_thread(fake)
+    tmp = tempfile.mkdtemp()
+    db = DB(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    seed(db, users=args.users, games=args.games)
+    settings = Settings(database_url=db.engine_url, openai_api_key="fake", openai_base_url=base_url)
+    print(f"{args.users} users, concurrency {args.concurrency}, {args.latency}s per completion")
+    try:
+        asyncio.run(run(db, settings, fake, args.users, args.concurrency, os.path.join(tmp, "checkpoint.json")))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Recommendation latency against the local fake OpenAI server.
+
+Run with ``PYTHONPATH=src:benchmarks python benchmarks/bench_recommendations.py``.
+Measures full-response latency, streamed time to first item, and how many
+completions 50 concurrent requests for one user trigger.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fake_openai import FakeOpenAI, serve_in_thread
+from nextgame.config import Settings
+from nextgame.recommend.cache import RecommendationCache
+from nextgame.recommend.recommender import close_async_openai, recommend_games_async, stream_recommendations
+from nextgame.storage.db import DB, Game, Ownership, User
+
+
+def seed(db: DB, users: int, games: int):
+    db.create_all()
+    with db.session() as s:
+        s.add_all(Game(appid=i, name=f"Game {i}") for i in range(1, games + 1))
+        for u in range(users):
+            user = User(steamid=str(76561190000000000 + u))
+            s.add(user)
+            s.flush()
+            s.add_all(
+                Ownership(user_id=user.id, appid=i, playtime_forever=(i * (u + 3)) % 9000)
+                for i in range(1, games + 1)
+            )
+        s.commit()
+
+
+async def run(db: DB, settings: Settings, fake: FakeOpenAI):
+    steamids = [str(76561190000000000 + u) for u in range(3)]
+
+    start = time.perf_counter()
+    await recommend_games_async(db, steamids[0], settings, RecommendationCache())
+    print(f"full response          {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    start = time.perf_counter()
+    first = None
+    async for event in stream_recommendations(db, steamids[1], settings, RecommendationCache()):
+        if first is None and event["event"] == "item":
+            first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    print(f"stream first item      {first * 1000:8.1f} ms   (complete {total * 1000:.1f} ms)")
+
+    before = fake.requests
+    cache = RecommendationCache(lru_size=0)
+    start = time.perf_counter()
+    await asyncio.gather(*(recommend_games_async(db, steamids[2], settings, cache) for _ in range(50)))
+    print(f"50 concurrent, 1 user  {(time.perf_counter() - start) * 1000:8.1f} ms   "
+          f"{fake.requests - before} completion(s)")
+    await close_async_openai()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency)
+    server, base_url = serve_in_thread(fake)
+    db = DB(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    seed(db, users=3, games=200)
+    settings = Settings(database_url=db.engine_url, openai_api_key="fake", openai_base_url=base_url)
+    try:
+        asyncio.run(run(db, settings, fake))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Requests/second against a local mock Steam API: per-call vs pooled client.
+
+Run with ``PYTHONPATH=src python benchmarks/bench_steam_client.py``.
+The client is given an unbounded rate limiter so the numbers reflect
+connection handling only.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from nextgame.steam.client import SteamAPIClient
+from nextgame.steam.ratelimit import RateLimiter
+
+PAYLOAD = b'{"response": {"players": [{"steamid": "76561190000000000", "personaname": "bench"}]}}'
+
+
+async def mock_steam(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": PAYLOAD})
+
+
+def start_server() -> tuple[uvicorn.Server, str]:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(mock_steam, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def per_call(base_url: str, requests: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            async with httpx.AsyncClient(base_url=base_url) as client:
+                (await client.get("/ISteamUser/GetPlayerSummaries/v2", params={"key": "x"})).raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+async def pooled(base_url: str, requests: int, concurrency: int) -> float:
+    api = SteamAPIClient("x", base_url=base_url, max_connections=concurrency,
+                         max_keepalive_connections=concurrency, max_concurrency=concurrency,
+                         rate_limiter=RateLimiter(rate=1e9, burst=1e9))
+    async with api:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(api.get_player_summaries(["1"]) for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+    for r in responses:
+        r.raise_for_status()
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    server, base_url = start_server()
+    try:
+        before = asyncio.run(per_call(base_url, args.requests, args.concurrency))
+        after = asyncio.run(pooled(base_url, args.requests, args.concurrency))
+    finally:
+        server.should_exit = True
+    print(f"client per call : {before:8.0f} req/s")
+    print(f"pooled client   : {after:8.0f} req/s  ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
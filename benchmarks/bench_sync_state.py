@@ -0,0 +1,111 @@
+"""Conditional-header lookup against a large snapshots table.
+
+Run with ``PYTHONPATH=src python benchmarks/bench_sync_state.py``.
+Builds ``--rows`` snapshots (default 1M) in a throwaway SQLite file unless
+``--url`` points at MySQL, then times three ways to find a user's ETag:
+the old newest-snapshot query with only the user_id index, the same query
+with the (user_id, kind, id) index, and the sync_state primary-key fetch.
+"""
+from __future__ import annotations
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from nextgame.steam.fetch import conditional_headers
+from nextgame.storage.db import DB, Snapshot, User
+from nextgame.storage.migrations import backfill_sync_state
+
+KINDS = ("owned_games", "player_summaries")
+
+
+def populate(db: DB, rows: int, per_kind: int, payload_bytes: int, batch: int = 50_000):
+    users = max(1, rows // (per_kind * len(KINDS)))
+    blob = os.urandom(payload_bytes)
+    now = datetime.utcnow()
+    with db.session() as s:
+        s.execute(insert(User), [{"id": i + 1, "steamid": str(76561198000000000 + i)} for i in range(users)])
+        pending = []
+        # interleave users the way real syncs do, so a user's rows are spread across the table
+        for round_ in range(per_kind):
+            for user_id in range(1, users + 1):
+                for kind in KINDS:
+                    pending.append({
+                        "user_id": user_id, "kind": kind, "etag": f'"{user_id}-{kind}-{round_}"',
+                        "codec": "zstd", "depth": 0, "raw_size": payload_bytes, "data": blob, "created_at": now,
+                    })
+                    if len(pending) >= batch:
+                        s.execute(insert(Snapshot), pending)
+                        pending = []
+        if pending:
+            s.execute(insert(Snapshot), pending)
+        s.commit()
+    with db.engine.begin() as conn:
+        backfill_sync_state(conn)
+    return users
+
+
+def legacy_lookup(s, user_id: int, kind: str) -> dict:
+    last_snap = s.query(Snapshot).filter_by(user_id=user_id, kind=kind).order_by(Snapshot.id.desc()).first()
+    return {"If-None-Match": last_snap.etag} if last_snap and last_snap.etag else {}
+
+
+def timed(db: DB, label: str, lookup, user_ids: list[int]):
+    with db.session() as s:
+        for user_id in user_ids[:200]:
+            lookup(s, user_id, "owned_games")
+        s.expunge_all()
+        start = time.perf_counter()
+        for user_id in user_ids:
+            lookup(s, user_id, "owned_games")
+            # drop the identity map so every lookup goes to the database
+            s.expunge_all()
+        elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed / len(user_ids) * 1e6:9.1f} us/lookup")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Database URL (default: temporary SQLite file)")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--per-kind", type=int, default=25, help="Snapshots per user and kind")
+    parser.add_argument("--payload-bytes", type=int, default=256)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    tmp = None
+    url = args.url
+    if not url:
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        url = f"sqlite:///{tmp.name}"
+    db = DB(url)
+    try:
+        db.create_all()
+        start = time.perf_counter()
+        users = populate(db, args.rows, args.per_kind, args.payload_bytes)
+        print(f"populated {args.rows} snapshots for {users} users in {time.perf_counter() - start:.1f}s")
+
+        rnd = random.Random(0)
+        user_ids = [rnd.randint(1, users) for _ in range(args.lookups)]
+        composite = next(ix for ix in Snapshot.__table__.indexes if ix.name == "ix_snapshots_user_kind_id")
+
+        composite.drop(db.engine)
+        timed(db, "newest snapshot, user_id index", legacy_lookup, user_ids)
+        composite.create(db.engine)
+        timed(db, "newest snapshot, composite index", legacy_lookup, user_ids)
+        timed(db, "sync_state primary key", conditional_headers, user_ids)
+
+        with db.session() as s:
+            assert conditional_headers(s, user_ids[0], "owned_games") == legacy_lookup(s, user_ids[0], "owned_games")
+    finally:
+        db.dispose()
+        if tmp:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Minimal OpenAI-compatible chat completions server for local runs.
+
+``python benchmarks/fake_openai.py --port 8765`` then point the app at it with
+``OPENAI_BASE_URL=http://127.0.0.1:8765/v1``. Each completion takes
+``--latency`` seconds, spread across the streamed chunks.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+import uuid
+
+import uvicorn
+
+ANSWER = [
+    {"appid": 620, "title": "Portal 2", "reason": "Puzzle co-op that rewards the time you put into Portal."},
+    {"appid": 413150, "title": "Stardew Valley", "reason": "Relaxed progression after long competitive sessions."},
+    {"appid": 1145360, "title": "Hades", "reason": "Tight runs that fit the short sessions you play lately."},
+    {"appid": 367520, "title": "Hollow Knight", "reason": "Deep exploration similar to your most played games."},
+    {"appid": 105600, "title": "Terraria", "reason": "Sandbox building with friends, matching your co-op time."},
+]
+
+
+class FakeOpenAI:
+    def __init__(self, latency: float = 1.0, chunks: int = 20):
+        self.latency = latency
+        self.chunks = chunks
+        self.requests = 0
+
+    def _text(self) -> str:
+        return "Here you go:\n" + json.dumps(ANSWER)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        request = json.loads(body or b"{}")
+        self.requests += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        text = self._text()
+
+        if not request.get("stream"):
+            await asyncio.sleep(self.latency)
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 80, "total_tokens": 180},
+            }
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        step = max(1, len(text) // self.chunks)
+        for i in range(0, len(text), step):
+            await asyncio.sleep(self.latency / self.chunks)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}],
+            }
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(),
+                        "more_body": True})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 80, "total_tokens": 180},
+            }
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(),
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b"data: [DONE]\n\n"})
+
+
+def serve_in_thread(app: FakeOpenAI) -> tuple[uvicorn.Server, str]:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0)
+    args = parser.parse_args()
+    uvicorn.run(FakeOpenAI(latency=args.latency), host="127.0.0.1", port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,51 @@
+import asyncio
 import logging
-from typing import Optional
+import os
+from datetime import timedelta
+from typing import TYPE_CHECKING, Optional
 import typer
 
-from .config import get_settings
-from .auth.openid import build_openid_redirect
-from .storage.db import DB
-from .api.app import create_app
-import uvicorn
+from .config import Settings, get_settings
+
+if TYPE_CHECKING:
+    from .storage.db import DB
+
+# subsystems (SQLAlchemy, httpx, FastAPI, OpenAI) are imported inside the commands that use them,
+# so `login-url` or `--help` do not pay for the whole application
 
 app = typer.Typer()
 
 logger = logging.getLogger("nextgame")
 
 
+class CliState:
+    """ctx.obj for every command; the DB engine is only built by commands that touch it."""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self._db: Optional["DB"] = None
+
+    @property
+    def db(self) -> "DB":
+        if self._db is None:
+            from .storage.db import DB
+
+            self._db = DB.from_settings(self.settings)
+        return self._db
+
+    def init_caches(self):
+        """Build the shared read and recommendation caches from these settings; call before syncing.
+
+        Sync paths invalidate through the shared caches, so with a Redis read
+        cache a worker has to talk to the same Redis the API serves from.
+        """
+        from .recommend.cache import get_recommendation_cache
+        from .storage.readcache import get_read_cache
+
+        get_read_cache(self.settings)
+        get_recommendation_cache(self.settings)
+
+
 def setup_logging(verbosity: int):
     level = logging.WARNING
     if verbosity == 1:
@@ -37,23 +70,261 @@ def main_callback(
         settings = get_settings(config_file)
     else:
         settings = get_settings()
-    ctx.obj = {"settings": settings, "db": DB(settings.database_url)}
+    ctx.obj = CliState(settings)
     setup_logging(verbose)
     logger.debug("Settings loaded: %s", settings.model_dump(exclude={"steam_api_key"}))
 
 
 @app.command()
 def init_db(ctx: typer.Context):
-    db: DB = ctx.obj["db"]
+    db = ctx.obj.db
     db.create_all()
     typer.echo("Database initialized.")
 
 
+@app.command()
+def migrate(ctx: typer.Context):
+    from .storage.migrations import migrate as run_migrations
+
+    applied = run_migrations(ctx.obj.db)
+    typer.echo(f"Applied: {', '.join(applied)}." if applied else "Database is up to date.")
+
+
 @app.command()
 def login_url(ctx: typer.Context, return_to: str = typer.Option(..., help="Return URL")):
+    from .auth.openid import build_openid_redirect
+
     url = build_openid_redirect(return_to)
     typer.echo(url)
 
+@app.command(name="refresh-profiles")
+def refresh_profiles_cmd(
+    ctx: typer.Context,
+    max_age_hours: float = typer.Option(24.0, "--max-age-hours", help="Refresh profiles older than this"),
+    limit: Optional[int] = typer.Option(None, "--limit", help="Refresh at most this many users"),
+):
+    from .steam.client import SteamAPIClient
+    from .steam.service import refresh_profiles
+
+    settings = ctx.obj.settings
+    if not settings.steam_api_key:
+        raise typer.BadParameter("STEAM_API_KEY missing")
+    db = ctx.obj.db
+    ctx.obj.init_caches()
+
+    async def run():
+        async with SteamAPIClient.from_settings(settings) as api:
+            return await refresh_profiles(db, api, max_age=timedelta(hours=max_age_hours), limit=limit)
+
+    summary = asyncio.run(run())
+    typer.echo(
+        f"Refreshed {summary['updated_users']}/{summary['users']} profiles "
+        f"in {summary['requests']} API calls ({summary['failed_batches']} failed batches)."
+    )
+
+
+@app.command()
+def worker(
+    ctx: typer.Context,
+    concurrency: int = typer.Option(4, "--concurrency", help="Number of concurrent sync workers"),
+):
+    from .jobs.worker import SyncWorkerPool
+    from .steam.client import SteamAPIClient
+
+    settings = ctx.obj.settings
+    if not settings.steam_api_key:
+        raise typer.BadParameter("STEAM_API_KEY missing")
+    db = ctx.obj.db
+    ctx.obj.init_caches()
+
+    async def run():
+        async with SteamAPIClient.from_settings(settings) as api:
+            pool = SyncWorkerPool(db, api, concurrency=concurrency, poll_interval=settings.sync_poll_interval)
+            await pool.run_forever()
+
+    typer.echo(f"Sync worker started with {concurrency} workers.")
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        typer.echo("Sync worker stopped.")
+
+
+@app.command(name="sync-all")
+def sync_all_cmd(
+    ctx: typer.Context,
+    steamids_file: Optional[str] = typer.Option(None, "--file", help="Steamids, one per line (default: users table)"),
+    concurrency: int = typer.Option(8, "--concurrency", help="Users synced at once"),
+    limit: Optional[int] = typer.Option(None, "--limit", help="Sync at most this many users"),
+    checkpoint: Optional[str] = typer.Option(
+        ".nextgame-sync-all.json", "--checkpoint", help="Progress file used to resume an interrupted run"
+    ),
+    restart: bool = typer.Option(False, "--restart", help="Ignore the checkpoint and start from the beginning"),
+    report_every: float = typer.Option(5.0, "--report-every", help="Seconds between progress lines"),
+):
+    from .jobs.bulk import sync_all
+    from .steam.client import SteamAPIClient
+
+    settings = ctx.obj.settings
+    if not settings.steam_api_key:
+        raise typer.BadParameter("STEAM_API_KEY missing")
+    if restart and checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    db = ctx.obj.db
+    ctx.obj.init_caches()
+
+    async def run():
+        async with SteamAPIClient.from_settings(settings) as api:
+            return await sync_all(
+                db,
+                api,
+                steamids_file=steamids_file,
+                concurrency=concurrency,
+                limit=limit,
+                checkpoint=checkpoint,
+                report=lambda progress: typer.echo(progress.describe()),
+                report_every=report_every,
+            )
+
+    try:
+        progress = asyncio.run(run())
+    except KeyboardInterrupt:
+        typer.echo(f"Interrupted; progress saved to {checkpoint}.")
+        raise typer.Exit(130)
+    typer.echo(f"Done in {progress.elapsed:.1f}s: {progress.describe()}.")
+
+
+@app.command(name="precompute-recommendations")
+def precompute_recommendations_cmd(
+    ctx: typer.Context,
+    concurrency: int = typer.Option(8, "--concurrency", help="Completions in flight at once"),
+    limit: Optional[int] = typer.Option(None, "--limit", help="Complete at most this many users"),
+    refresh_within: float = typer.Option(
+        1.0, "--refresh-within", help="Also redo stored recommendations expiring within this many hours"
+    ),
+    checkpoint: Optional[str] = typer.Option(
+        ".nextgame-precompute.json", "--checkpoint", help="Progress file used to resume an interrupted run"
+    ),
+    restart: bool = typer.Option(False, "--restart", help="Ignore the checkpoint and start from the beginning"),
+    report_every: float = typer.Option(5.0, "--report-every", help="Seconds between progress lines"),
+):
+    from .jobs.precompute import precompute_recommendations
+    from .recommend.cache import get_recommendation_cache
+    from .recommend.recommender import close_async_openai
+
+    settings = ctx.obj.settings
+    if not settings.openai_api_key:
+        raise typer.BadParameter("OPENAI_API_KEY missing")
+    if restart and checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    db = ctx.obj.db
+    ctx.obj.init_caches()
+
+    async def run():
+        try:
+            return await precompute_recommendations(
+                db,
+                settings,
+                get_recommendation_cache(settings),
+                concurrency=concurrency,
+                limit=limit,
+                refresh_within=refresh_within * 3600,
+                checkpoint=checkpoint,
+                report=lambda progress: typer.echo(progress.describe()),
+                report_every=report_every,
+            )
+        finally:
+            await close_async_openai()
+
+    try:
+        progress = asyncio.run(run())
+    except KeyboardInterrupt:
+        typer.echo(f"Interrupted; progress saved to {checkpoint}.")
+        raise typer.Exit(130)
+    typer.echo(f"Done in {progress.elapsed:.1f}s: {progress.describe()}.")
+
+
+@app.command(name="build-similarity")
+def build_similarity_cmd(
+    ctx: typer.Context,
+    out: Optional[str] = typer.Option(None, "--out", help="Artifact directory (default: SIMILARITY_MODEL_PATH)"),
+    neighbors: int = typer.Option(50, "--neighbors", help="Neighbours kept per game"),
+    min_owners: int = typer.Option(2, "--min-owners", help="Ignore games with fewer owners"),
+):
+    from .recommend.similarity import build_similarity
+
+    settings = ctx.obj.settings
+    meta = build_similarity(ctx.obj.db, out or settings.similarity_model_path, neighbors, min_owners)
+    typer.echo(f"Built similarity model: {meta['items']} games from {meta['ownerships']} ownerships.")
+
+
+@app.command(name="import-catalog")
+def import_catalog_cmd(
+    ctx: typer.Context,
+    app_list: Optional[str] = typer.Option(None, "--file", help="Saved GetAppList response (default: fetch from Steam)"),
+    batch: int = typer.Option(5000, "--batch", help="Apps upserted per transaction"),
+    index: bool = typer.Option(True, "--index/--no-index", help="Rebuild the catalog name index afterwards"),
+    out: Optional[str] = typer.Option(None, "--out", help="Name index directory (default: CATALOG_INDEX_PATH)"),
+):
+    from .recommend.names import build_name_index
+    from .steam.catalog import file_chunks, import_catalog
+
+    settings = ctx.obj.settings
+    db = ctx.obj.db
+
+    async def run():
+        if app_list:
+            return await import_catalog(db, file_chunks(app_list), batch=batch)
+        from .steam.client import SteamAPIClient
+
+        async with SteamAPIClient.from_settings(settings) as api:
+            return await import_catalog(db, api.stream_app_list(), batch=batch)
+
+    totals = asyncio.run(run())
+    typer.echo(f"Imported {totals['apps']} apps ({totals['unnamed']} unnamed) in {totals['batches']} batches.")
+    if index:
+        meta = build_name_index(db, out or settings.catalog_index_path)
+        typer.echo(f"Built name index: {meta['names']} names, {meta['trigrams']} trigrams.")
+
+
+@app.command(name="compact-deltas")
+def compact_deltas_cmd(
+    ctx: typer.Context,
+    batch: int = typer.Option(10_000, "--batch", help="Deltas folded per transaction"),
+    prune: bool = typer.Option(True, "--prune/--no-prune", help="Delete deltas once folded"),
+):
+    from .storage.deltas import compact_deltas
+
+    totals = compact_deltas(ctx.obj.db, batch=batch, prune=prune)
+    typer.echo(
+        f"Folded {totals['deltas']} deltas into {totals['games']} game and {totals['pairs']} pair aggregates; "
+        f"pruned {totals['pruned']}."
+    )
+
+
+@app.command(name="compact-snapshots")
+def compact_snapshots_cmd(
+    ctx: typer.Context,
+    keep_all_days: Optional[int] = typer.Option(None, "--keep-all-days", help="Keep every snapshot this many days"),
+    keep_daily_days: Optional[int] = typer.Option(None, "--keep-daily-days", help="Keep one per day until this age"),
+    max_age_days: Optional[int] = typer.Option(None, "--max-age-days", help="Drop snapshots older than this"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Report what would be deleted"),
+):
+    from .storage.snapshots import SnapshotRetention, compact_snapshots, snapshot_storage_stats
+
+    retention = SnapshotRetention.from_settings(ctx.obj.settings)
+    if keep_all_days is not None:
+        retention.keep_all = timedelta(days=keep_all_days)
+    if keep_daily_days is not None:
+        retention.keep_daily = timedelta(days=keep_daily_days)
+    if max_age_days is not None:
+        retention.max_age = timedelta(days=max_age_days) if max_age_days else None
+    totals = compact_snapshots(ctx.obj.db, retention, dry_run=dry_run)
+    verb = "Would delete" if dry_run else "Deleted"
+    typer.echo(f"{verb} {totals['deleted']} snapshots, kept {totals['kept']} across {totals['groups']} histories.")
+    stats = snapshot_storage_stats(ctx.obj.db)
+    typer.echo(f"Snapshot storage: {stats['stored_bytes']} bytes for {stats['raw_bytes']} bytes of payload.")
+
+
 @app.command(name="serve-api")
 def serve_api(
     ctx: typer.Context,
@@ -61,8 +332,10 @@ def serve_api(
     port: int = typer.Option(8000, "--port"),
     reload: bool = typer.Option(False, "--reload", help="Enable auto-reload (dev only)"),
 ):
+    import uvicorn
+    from .api.app import create_app
 
-    app_instance = create_app()
+    app_instance = create_app(ctx.obj.settings)
     uvicorn.run(app_instance, host=host, port=port, reload=reload)
 
 if __name__ == "__main__":
@@ -1,9 +1,75 @@
 from __future__ import annotations
+from contextlib import asynccontextmanager
+from typing import Optional
+
 from fastapi import FastAPI
+
+from .. import metrics
+from ..config import get_settings, Settings
+from ..storage.db import DB
+from ..storage.readcache import get_read_cache
+from ..steam.client import SteamAPIClient
+from ..jobs.worker import SyncWorkerPool
+from ..recommend.cache import get_recommendation_cache
+from ..recommend.recommender import close_async_openai
+from ..recommend.names import load_name_index
+from ..recommend.similarity import load_similarity_model
 from .routes import router
 
 
-def create_app() -> FastAPI:
-    app = FastAPI(title="NextGame API", version="0.1.0")
+def _collect(app: FastAPI):
+    """Scrape-time gauges and counters from the caches, the DB pool and the sync workers."""
+    for prefix, stats, size_key in (
+        ("nextgame_read_cache", get_read_cache().stats(), "entries"),
+        ("nextgame_recommendation_cache", get_recommendation_cache().stats(), "lru_size"),
+    ):
+        for name, value in stats.items():
+            if value is None:
+                continue
+            if name == size_key:
+                yield f"{prefix}_{name}", "gauge", {}, value
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}_{name}_total", "counter", {}, value
+    for name, value in app.state.db.pool_status().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"nextgame_db_pool_{name}", "gauge", {}, value
+    if app.state.workers is not None:
+        yield "nextgame_sync_queue_wait_seconds_max", "gauge", {}, app.state.workers.metrics.max_wait_seconds
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.settings = settings or get_settings()
+        metrics.configure(app.state.settings.metrics_enabled)
+        app.state.db = DB.from_settings(app.state.settings)
+        app.state.steam = SteamAPIClient.from_settings(app.state.settings)
+        get_recommendation_cache(app.state.settings)
+        get_read_cache(app.state.settings)
+        app.state.similarity = load_similarity_model(app.state.settings.similarity_model_path)
+        # loaded now so the first recommendation does not pay for it
+        load_name_index(app.state.settings.catalog_index_path)
+        app.state.workers = None
+        if app.state.settings.sync_workers > 0 and app.state.settings.steam_api_key:
+            app.state.workers = SyncWorkerPool(
+                app.state.db,
+                app.state.steam,
+                concurrency=app.state.settings.sync_workers,
+                poll_interval=app.state.settings.sync_poll_interval,
+            )
+            app.state.workers.start()
+        metrics.REGISTRY.add_collector("app", lambda: _collect(app))
+        try:
+            yield
+        finally:
+            metrics.REGISTRY.remove_collector("app")
+            if app.state.workers is not None:
+                await app.state.workers.stop()
+            await app.state.steam.aclose()
+            await close_async_openai()
+            await app.state.db.adispose()
+
+    app = FastAPI(title="NextGame API", version="0.1.0", lifespan=lifespan)
     app.include_router(router)
+    app.add_middleware(metrics.MetricsMiddleware)
     return app
@@ -1,13 +1,24 @@
 from __future__ import annotations
-from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional, List, Tuple
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from pydantic_core import to_json
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 
-from ..config import get_settings, Settings
-from ..storage.db import DB, User, Ownership, Game
-from ..steam.library import update_user_library
-from ..steam.service import update_user_profile
-from ..recommend.recommender import recommend_games
+from .. import fastjson, metrics
+from ..config import Settings
+from ..storage.db import DB, Game, User
+from ..storage.history import load_points, played_between
+from ..storage.readcache import CachedBody, ReadCache, get_read_cache
+from ..steam.service import refresh_profiles
+from ..jobs.queue import enqueue_sync, get_job, queue_stats
+from ..recommend.cache import get_recommendation_cache
+from ..recommend.rankings import load_ranking, top_games
+from ..recommend.recommender import recommend_games_async, recommend_hybrid, stream_recommendations
+from ..recommend.similarity import recommend_local
 from ..steam.client import SteamAPIClient
 
 class UserOut(BaseModel):
@@ -23,23 +34,47 @@ class GameOut(BaseModel):
     playtime_2weeks: int
 
 
+class HistoryGameOut(BaseModel):
+    appid: int
+    name: Optional[str]
+    minutes_played: int
+    # (sampled at, playtime_forever) changes inside the window
+    points: List[Tuple[datetime, int]]
+
+
+class HistoryOut(BaseModel):
+    days: int
+    games: List[HistoryGameOut]
+
+
+class SyncJobOut(BaseModel):
+    job_id: int
+    steamid: str
+    status: str
+    deduplicated: bool = False
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+
 class RecommendationsOut(BaseModel):
     items: List[dict]
     status: str
+    cached: bool = False
+    engine: str = "llm"
 
 router = APIRouter()
 
 
-def get_settings_dep() -> Settings:
-    return get_settings()
+def get_settings_dep(request: Request) -> Settings:
+    return request.app.state.settings
+
+
+def get_db(request: Request) -> DB:
+    return request.app.state.db
 
 
-def get_db(settings: Settings = Depends(get_settings_dep)):
-    db = DB(settings.database_url)
-    try:
-        yield db
-    finally:
-        pass
+def get_steam(request: Request) -> SteamAPIClient:
+    return request.app.state.steam
 
 
 @router.get("/health")
@@ -47,55 +82,203 @@ def health():
     return {"status": "ok"}
 
 
-@router.post("/users/{steamid}/sync", response_model=dict)
-async def sync_user(steamid: str, db: DB = Depends(get_db), settings: Settings = Depends(get_settings_dep)):
+@router.get("/health/db")
+def health_db(db: DB = Depends(get_db)):
+    return db.pool_status()
+
+
+@router.get("/health/cache")
+def health_cache():
+    return {"read": get_read_cache().stats(), "recommendations": get_recommendation_cache().stats()}
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    if not metrics.enabled():
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.post("/users/{steamid}/sync", response_model=SyncJobOut, status_code=202)
+async def sync_user(
+    steamid: str,
+    request: Request,
+    db: DB = Depends(get_db),
+    settings: Settings = Depends(get_settings_dep),
+):
     if not settings.steam_api_key:
         raise HTTPException(400, "STEAM_API_KEY missing")
-    api_key = settings.steam_api_key
-    api = SteamAPIClient(api_key)
-    profile_summary = await update_user_profile(db, api, steamid)
-    library_summary = await update_user_library(db, api, steamid)
-    return {"profile": profile_summary, "library": library_summary}
+    job, created = await db.run_in_thread(enqueue_sync, db, steamid)
+    workers = getattr(request.app.state, "workers", None)
+    if created and workers is not None:
+        workers.notify()
+    return SyncJobOut(job_id=job.id, steamid=job.steamid, status=job.status, deduplicated=not created)
+
+
+@router.get("/jobs/stats", response_model=dict)
+def sync_job_stats(request: Request, db: DB = Depends(get_db)):
+    workers = getattr(request.app.state, "workers", None)
+    return workers.stats() if workers is not None else queue_stats(db)
+
+
+@router.get("/jobs/{job_id}", response_model=SyncJobOut)
+def sync_job_status(job_id: int, db: DB = Depends(get_db)):
+    job = get_job(db, job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return SyncJobOut(job_id=job.id, steamid=job.steamid, status=job.status, result=job.result, error=job.error)
+
+
+@router.post("/profiles/refresh", response_model=dict)
+async def refresh_stale_profiles(
+    max_age_hours: float = Query(24.0, gt=0),
+    limit: Optional[int] = Query(None, ge=1),
+    db: DB = Depends(get_db),
+    api: SteamAPIClient = Depends(get_steam),
+    settings: Settings = Depends(get_settings_dep),
+):
+    if not settings.steam_api_key:
+        raise HTTPException(400, "STEAM_API_KEY missing")
+    return await refresh_profiles(db, api, max_age=timedelta(hours=max_age_hours), limit=limit)
+
+
+def _load_user(s: Session, steamid: str) -> Optional[UserOut]:
+    u = s.query(User).filter_by(steamid=steamid).one_or_none()
+    if not u:
+        return None
+    return UserOut(steamid=u.steamid, persona_name=u.persona_name, avatar=u.avatar)
+
+
+def _load_top_games(s: Session, steamid: str, limit: int) -> Optional[List[GameOut]]:
+    user = s.query(User).filter_by(steamid=steamid).one_or_none()
+    if not user:
+        return None
+    return [
+        GameOut(appid=appid, name=name, playtime_forever=forever, playtime_2weeks=recent)
+        for appid, name, forever, recent in top_games(s, load_ranking(s, user.id), limit)
+    ]
+
+
+def _load_history(s: Session, steamid: str, days: int, limit: int) -> Optional[HistoryOut]:
+    user = s.query(User).filter_by(steamid=steamid).one_or_none()
+    if not user:
+        return None
+    until = datetime.utcnow()
+    since = until - timedelta(days=days)
+    series = load_points(s, user.id, since)
+    played = sorted(
+        ((played_between(points, since, until), appid) for appid, points in series.items()),
+        key=lambda p: (-p[0], p[1]),
+    )
+    top = [(minutes, appid) for minutes, appid in played[:limit] if minutes]
+    names = dict(s.execute(select(Game.appid, Game.name).where(Game.appid.in_([appid for _, appid in top]))).all())
+    return HistoryOut(days=days, games=[
+        HistoryGameOut(
+            appid=appid,
+            name=names.get(appid),
+            minutes_played=minutes,
+            points=[point for point in series[appid] if point[0] >= since],
+        )
+        for minutes, appid in top
+    ])
+
+
+def _cached_response(request: Request, cached: CachedBody) -> Response:
+    headers = {"ETag": cached.etag, "Cache-Control": "private, no-cache"}
+    if cached.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
+
+
+async def _cache_call(db: DB, cache: ReadCache, fn, *args):
+    # a Redis round trip blocks, so it takes a DB thread like the query it stands in for
+    if cache.blocking:
+        return await db.run_in_thread(fn, *args)
+    return fn(*args)
+
+
+async def _read_through(db: DB, steamid: str, field: str, load, *args) -> Optional[CachedBody]:
+    cache = get_read_cache()
+    cached = await _cache_call(db, cache, cache.get, steamid, field)
+    if cached is not None:
+        return cached
+    generation = cache.generation()
+    value = await db.read(load, steamid, *args)
+    if value is None:
+        return None
+    # pydantic's serializer writes the models straight to bytes, skipping jsonable_encoder
+    body = to_json(value)
+    return await _cache_call(db, cache, cache.put, steamid, field, body, generation)
 
 
 @router.get("/users/{steamid}", response_model=UserOut)
-def get_user(steamid: str, db: DB = Depends(get_db)):
-    with db.session() as s:
-        u = s.query(User).filter_by(steamid=steamid).one_or_none()
-        if not u:
-            raise HTTPException(404, "User not found")
-        return UserOut(steamid=u.steamid, persona_name=u.persona_name, avatar=u.avatar)
+async def get_user(steamid: str, request: Request, db: DB = Depends(get_db)):
+    cached = await _read_through(db, steamid, "user", _load_user)
+    if cached is None:
+        raise HTTPException(404, "User not found")
+    return _cached_response(request, cached)
 
 
 @router.get("/users/{steamid}/top", response_model=List[GameOut])
-def user_top_games(steamid: str, limit: int = Query(10, ge=1, le=100), db: DB = Depends(get_db)):
-    with db.session() as s:
-        user = s.query(User).filter_by(steamid=steamid).one_or_none()
-        if not user:
-            raise HTTPException(404, "User not found")
-        rows = (
-            s.query(Ownership, Game)
-            .join(Game, Game.appid == Ownership.appid)
-            .filter(Ownership.user_id == user.id)
-            .order_by(Ownership.playtime_forever.desc())
-            .limit(limit)
-            .all()
-        )
-        return [
-            GameOut(
-                appid=g.appid,
-                name=g.name,
-                playtime_forever=o.playtime_forever,
-                playtime_2weeks=o.playtime_2weeks,
-            )
-            for (o, g) in rows
-        ]
+async def user_top_games(
+    steamid: str, request: Request, limit: int = Query(10, ge=1, le=100), db: DB = Depends(get_db)
+):
+    cached = await _read_through(db, steamid, f"top:{limit}", _load_top_games, limit)
+    if cached is None:
+        raise HTTPException(404, "User not found")
+    return _cached_response(request, cached)
+
+
+@router.get("/users/{steamid}/history", response_model=HistoryOut)
+async def user_history(
+    steamid: str,
+    request: Request,
+    days: int = Query(90, ge=1, le=3650),
+    limit: int = Query(20, ge=1, le=100),
+    db: DB = Depends(get_db),
+):
+    cached = await _read_through(db, steamid, f"history:{days}:{limit}", _load_history, days, limit)
+    if cached is None:
+        raise HTTPException(404, "User not found")
+    return _cached_response(request, cached)
 
 
 @router.get("/users/{steamid}/recommendations", response_model=RecommendationsOut)
-def user_recommendations(steamid: str, db: DB = Depends(get_db)):
-    result = recommend_games(db, steamid)
+async def user_recommendations(
+    steamid: str,
+    request: Request,
+    engine: Optional[str] = Query(None, pattern="^(llm|local|hybrid)$"),
+    db: DB = Depends(get_db),
+    settings: Settings = Depends(get_settings_dep),
+):
+    engine = engine or settings.recommender_engine
+    if engine == "llm":
+        result = await recommend_games_async(db, steamid, settings)
+    else:
+        model = getattr(request.app.state, "similarity", None)
+        if model is None:
+            raise HTTPException(503, "similarity model not built; run 'nextgame build-similarity'")
+        if engine == "local":
+            result = await db.read(recommend_local, model, steamid)
+        else:
+            result = await recommend_hybrid(db, steamid, settings, model)
     if "error" in result:
         raise HTTPException(400, result["error"])
     parsed = result.get("parsed", {})
-    return RecommendationsOut(items=parsed.get("items", []), status=parsed.get("status", "unknown"))
+    return RecommendationsOut(
+        items=parsed.get("items", []),
+        status=parsed.get("status", "unknown"),
+        cached=result.get("cached", False),
+        engine=result.get("engine", engine),
+    )
+
+
+@router.get("/users/{steamid}/recommendations/stream")
+async def user_recommendations_stream(
+    steamid: str, db: DB = Depends(get_db), settings: Settings = Depends(get_settings_dep)
+):
+    async def lines():
+        async for event in stream_recommendations(db, steamid, settings):
+            yield fastjson.dumps(event) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
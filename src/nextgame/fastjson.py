@@ -0,0 +1,57 @@
+"""Compact JSON encode/decode through orjson when installed, the stdlib otherwise.
+
+The two encoders agree on dicts, lists, strings, ints, bools and null, but
+not on every float (``1e16`` vs ``1e+16``), so ``dumps`` output is only
+stable within one backend. The fallback writes NaN and Infinity as null
+like orjson does rather than emitting invalid JSON. Anything hashed goes
+through ``canonical``, which always uses the stdlib.
+"""
+from __future__ import annotations
+import json
+import math
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def available() -> bool:
+    return orjson is not None
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _finite(value: Any) -> Any:
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    return value
+
+
+def canonical(value: Any) -> bytes:
+    """Backend-independent encoding for hashing; rejects NaN and Infinity."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    try:
+        return canonical(value)
+    except ValueError:
+        # only non-finite floats get here; a second pass is cheaper than checking every payload
+        return canonical(_finite(value))
+
+
+def dumps_str(value: Any) -> str:
+    """For APIs that want text, e.g. SQLAlchemy's json_serializer."""
+    return dumps(value).decode("utf-8")
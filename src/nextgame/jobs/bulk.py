@@ -0,0 +1,213 @@
+"""``nextgame sync-all``: sync every user (or a list of steamids) outside the job queue.
+
+Steamids are streamed with their position in the source (user id, or line
+number for a file). Workers finish out of order, so the checkpoint stores the
+highest position below which everything is done; a resumed run only repeats
+the users that were in flight.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..storage.db import DB, User
+from ..steam.client import SteamAPIClient
+from ..steam.sync import sync_user
+
+logger = logging.getLogger(__name__)
+
+USERS_SOURCE = "users"
+USER_PAGE = 1000
+
+
+@dataclass
+class BulkProgress:
+    source: str
+    position: int = 0
+    synced: int = 0
+    failed: int = 0
+    requests: int = 0
+    # users counted by the checkpoint this run resumed from
+    resumed: int = 0
+    started: float = field(default_factory=time.perf_counter, repr=False)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def rates(self) -> Tuple[float, float]:
+        elapsed = max(self.elapsed, 1e-9)
+        return (self.synced + self.failed - self.resumed) / elapsed, self.requests / elapsed
+
+    def describe(self) -> str:
+        users_per_s, calls_per_s = self.rates()
+        return (
+            f"{self.synced + self.failed} users ({self.failed} failed), "
+            f"{users_per_s:.1f} users/s, {calls_per_s:.1f} API calls/s"
+        )
+
+
+def load_checkpoint(path: Optional[str], source: str) -> BulkProgress:
+    progress = BulkProgress(source)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+        # a checkpoint from another source means nothing for this run
+        if data.get("source") == source:
+            progress.position = data["position"]
+            progress.synced = data.get("synced", 0)
+            progress.failed = data.get("failed", 0)
+            progress.resumed = progress.synced + progress.failed
+    return progress
+
+
+def save_checkpoint(path: Optional[str], progress: BulkProgress):
+    if not path:
+        return
+    data = {
+        "source": progress.source,
+        "position": progress.position,
+        "synced": progress.synced,
+        "failed": progress.failed,
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _user_page(db: DB, after: int, limit: int) -> List[Tuple[int, str]]:
+    with db.session() as s:
+        rows = s.execute(select(User.id, User.steamid).where(User.id > after).order_by(User.id).limit(limit))
+        return [tuple(row) for row in rows]
+
+
+async def iter_users(db: DB, after: int = 0, page: int = USER_PAGE) -> AsyncIterator[Tuple[int, str]]:
+    while True:
+        rows = await db.run_in_thread(_user_page, db, after, page)
+        for row in rows:
+            yield row
+        if len(rows) < page:
+            return
+        after = rows[-1][0]
+
+
+def iter_file(path: str, after: int = 0) -> Iterator[Tuple[int, str]]:
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            steamid = line.strip()
+            if line_no > after and steamid and not steamid.startswith("#"):
+                yield line_no, steamid
+
+
+async def _aiter(items: Iterator[Tuple[int, str]]) -> AsyncIterator[Tuple[int, str]]:
+    for item in items:
+        yield item
+
+
+async def run_checkpointed(
+    items: AsyncIterator[Tuple[int, str]],
+    handle: Callable[[str], Awaitable[Optional[bool]]],
+    progress: BulkProgress,
+    *,
+    concurrency: int = 8,
+    limit: Optional[int] = None,
+    checkpoint: Optional[str] = None,
+    report: Optional[Callable[[BulkProgress], None]] = None,
+    report_every: float = 5.0,
+    action: str = "Sync",
+) -> BulkProgress:
+    """Run ``handle`` over (position, steamid) items with ``concurrency`` workers.
+
+    A handler that raises or returns False counts as failed; either way the
+    position is done and the checkpoint may move past it.
+    """
+    queue: "asyncio.Queue[Optional[Tuple[int, str]]]" = asyncio.Queue(maxsize=concurrency * 2)
+    in_flight: "deque[int]" = deque()
+    finished: set = set()
+
+    def advance(position: int):
+        # the watermark only moves past positions whose predecessors have all finished
+        finished.add(position)
+        while in_flight and in_flight[0] in finished:
+            progress.position = in_flight.popleft()
+            finished.discard(progress.position)
+
+    async def produce():
+        count = 0
+        async for position, steamid in items:
+            if limit is not None and count >= limit:
+                break
+            in_flight.append(position)
+            await queue.put((position, steamid))
+            count += 1
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work():
+        while (item := await queue.get()) is not None:
+            position, steamid = item
+            try:
+                ok = await handle(steamid)
+            except Exception:
+                logger.exception("%s of %s failed", action, steamid)
+                ok = False
+            if ok is False:
+                progress.failed += 1
+            else:
+                progress.synced += 1
+            advance(position)
+
+    async def tick():
+        while True:
+            await asyncio.sleep(report_every)
+            save_checkpoint(checkpoint, progress)
+            if report is not None:
+                report(progress)
+
+    ticker = asyncio.create_task(tick())
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+    finally:
+        ticker.cancel()
+        save_checkpoint(checkpoint, progress)
+    return progress
+
+
+async def sync_all(
+    db: DB,
+    api: SteamAPIClient,
+    *,
+    steamids_file: Optional[str] = None,
+    concurrency: int = 8,
+    limit: Optional[int] = None,
+    checkpoint: Optional[str] = None,
+    report: Optional[Callable[[BulkProgress], None]] = None,
+    report_every: float = 5.0,
+) -> BulkProgress:
+    """Sync profile and library for every steamid in the source; Steam calls share ``api``'s rate limit."""
+    source = os.path.abspath(steamids_file) if steamids_file else USERS_SOURCE
+    progress = load_checkpoint(checkpoint, source)
+    if steamids_file:
+        items = _aiter(iter_file(steamids_file, progress.position))
+    else:
+        items = iter_users(db, progress.position)
+    requests_before = api.requests
+
+    async def handle(steamid: str):
+        try:
+            await sync_user(db, api, steamid)
+        finally:
+            progress.requests = api.requests - requests_before
+
+    return await run_checkpointed(
+        items, handle, progress,
+        concurrency=concurrency, limit=limit, checkpoint=checkpoint, report=report, report_every=report_every,
+    )
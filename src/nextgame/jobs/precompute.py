@@ -0,0 +1,124 @@
+"""``nextgame precompute-recommendations``: store recommendations before users ask for them.
+
+A user needs a completion when their recommendation_cache row is missing,
+was made for another library fingerprint, or expires soon. Candidates are
+scanned by user id a page at a time, and their prompts are built in the same
+pass. The answers land in the table ``user_recommendations`` already reads.
+Users drop out of the candidate set once stored, so a rerun only repeats
+what was in flight, and the checkpoint saves rescanning users already passed.
+A scan that reaches the last user removes the checkpoint, so the next
+scheduled run starts over.
+"""
+from __future__ import annotations
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..config import Settings
+from ..recommend.cache import RecommendationCache, fingerprint_from_key
+from ..recommend.rankings import load_ranking, load_trend, prompt_games
+from ..recommend.recommender import MODEL, PromptJob, build_prompt, complete_job
+from ..storage.db import DB, LibraryRanking, RecommendationCacheEntry, User
+from .bulk import USER_PAGE, BulkProgress, load_checkpoint, run_checkpointed
+
+logger = logging.getLogger(__name__)
+
+SOURCE = "precompute"
+
+
+def _candidate_page(
+    db: DB, after: int, limit: int, stale_before: datetime
+) -> Tuple[List[Tuple[int, str, PromptJob]], Optional[int]]:
+    """Prompt jobs for the users in the next page that need one, and the last user id scanned."""
+    jobs: List[Tuple[int, str, PromptJob]] = []
+    last_id = None
+    with db.session() as s:
+        rows = s.execute(
+            select(User, LibraryRanking, RecommendationCacheEntry.fingerprint, RecommendationCacheEntry.created_at)
+            .outerjoin(LibraryRanking, LibraryRanking.user_id == User.id)
+            .outerjoin(RecommendationCacheEntry, RecommendationCacheEntry.user_id == User.id)
+            .where(User.id > after)
+            .order_by(User.id)
+            .limit(limit)
+        ).all()
+        for user, ranking, stored_fingerprint, created_at in rows:
+            last_id = user.id
+            # users synced before rankings existed get one computed on the fly
+            ranking = ranking or load_ranking(s, user.id)
+            if not ranking.game_count:
+                continue
+            trend = load_trend(s, user.id)
+            fingerprint = fingerprint_from_key(ranking.library_key, MODEL, trend)
+            if stored_fingerprint == fingerprint and created_at >= stale_before:
+                continue
+            prompt = build_prompt(user, prompt_games(s, ranking, trend))
+            jobs.append((user.id, user.steamid, PromptJob(user_id=user.id, fingerprint=fingerprint, prompt=prompt)))
+    return jobs, last_id
+
+
+async def iter_candidates(
+    db: DB, jobs: Dict[str, PromptJob], stale_before: datetime, after: int = 0, page: int = USER_PAGE,
+    on_exhausted: Optional[Callable[[], None]] = None,
+) -> AsyncIterator[Tuple[int, str]]:
+    """Yield (user id, steamid) of users needing a completion, leaving each prompt in ``jobs``."""
+    while True:
+        found, last_id = await db.run_in_thread(_candidate_page, db, after, page, stale_before)
+        for user_id, steamid, job in found:
+            jobs[steamid] = job
+            yield user_id, steamid
+        if last_id is None:
+            if on_exhausted is not None:
+                on_exhausted()
+            return
+        after = last_id
+
+
+async def precompute_recommendations(
+    db: DB,
+    settings: Settings,
+    cache: RecommendationCache,
+    *,
+    concurrency: int = 8,
+    limit: Optional[int] = None,
+    refresh_within: float = 3600.0,
+    checkpoint: Optional[str] = None,
+    report: Optional[Callable[[BulkProgress], None]] = None,
+    report_every: float = 5.0,
+) -> BulkProgress:
+    """Complete and store recommendations for every user whose stored one is missing, outdated or expiring.
+
+    ``refresh_within`` is in seconds; entries that expire within that window
+    are redone too. At most ``concurrency`` completions are in flight.
+    """
+    progress = load_checkpoint(checkpoint, SOURCE)
+    stale_before = datetime.utcnow() - timedelta(seconds=max(0.0, cache.ttl - refresh_within))
+    jobs: Dict[str, PromptJob] = {}
+
+    async def handle(steamid: str) -> bool:
+        try:
+            result = await complete_job(db, steamid, jobs.pop(steamid), settings, cache, operation="precompute")
+        finally:
+            progress.requests += 1
+        status = result["parsed"]["status"]
+        if status != "ok":
+            logger.warning("Unusable completion for %s: %s", steamid, status)
+        return status == "ok"
+
+    scanned = []
+    await run_checkpointed(
+        iter_candidates(db, jobs, stale_before, progress.position, on_exhausted=lambda: scanned.append(True)),
+        handle,
+        progress,
+        concurrency=concurrency,
+        limit=limit,
+        checkpoint=checkpoint,
+        report=report,
+        report_every=report_every,
+        action="Precompute",
+    )
+    if scanned and checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return progress
@@ -0,0 +1,141 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from ..storage.db import DB, SyncJob, SyncState, User
+
+def _last_synced_at(s, steamid: str) -> Optional[datetime]:
+    return s.scalar(
+        select(SyncState.synced_at)
+        .join(User, User.id == SyncState.user_id)
+        .where(User.steamid == steamid, SyncState.kind == "owned_games")
+    )
+
+
+def enqueue_sync(db: DB, steamid: str) -> Tuple[SyncJob, bool]:
+    """Queue a sync for steamid; returns (job, created) and reuses an active job."""
+    with db.session() as s:
+        existing = s.scalars(select(SyncJob).where(SyncJob.dedupe_key == steamid)).first()
+        if existing:
+            return existing, False
+        job = SyncJob(
+            steamid=steamid,
+            dedupe_key=steamid,
+            status="queued",
+            last_synced_at=_last_synced_at(s, steamid),
+            created_at=datetime.utcnow(),
+        )
+        s.add(job)
+        try:
+            s.commit()
+        except IntegrityError:
+            # lost the race against a concurrent enqueue of the same steamid
+            s.rollback()
+            existing = s.scalars(select(SyncJob).where(SyncJob.dedupe_key == steamid)).first()
+            if existing is None:
+                raise
+            return existing, False
+        return job, True
+
+
+def claim_next(db: DB, worker: str) -> Optional[SyncJob]:
+    with db.session() as s:
+        while True:
+            job_id = s.scalar(
+                select(SyncJob.id)
+                .where(SyncJob.status == "queued")
+                # never-synced users first, then the stalest; portable stand-in for NULLS FIRST
+                .order_by(SyncJob.last_synced_at.is_not(None), SyncJob.last_synced_at, SyncJob.id)
+                .limit(1)
+            )
+            if job_id is None:
+                return None
+            now = datetime.utcnow()
+            # compare-and-set so two workers never run the same job
+            claimed = s.execute(
+                update(SyncJob)
+                .where(SyncJob.id == job_id, SyncJob.status == "queued")
+                .values(
+                    status="running",
+                    worker=worker,
+                    started_at=now,
+                    heartbeat_at=now,
+                    attempts=SyncJob.attempts + 1,
+                )
+            ).rowcount
+            s.commit()
+            if claimed:
+                return s.get(SyncJob, job_id, populate_existing=True)
+
+
+def _owned_by(job_id: int, worker: str):
+    return (SyncJob.id == job_id, SyncJob.worker == worker, SyncJob.status == "running")
+
+
+def touch_job(db: DB, job_id: int, worker: str) -> bool:
+    """Refresh the heartbeat of a running job; False once the job is no longer this worker's."""
+    with db.session() as s:
+        touched = s.execute(
+            update(SyncJob).where(*_owned_by(job_id, worker)).values(heartbeat_at=datetime.utcnow())
+        ).rowcount
+        s.commit()
+        return bool(touched)
+
+
+def finish_job(
+    db: DB, job_id: int, worker: str, *, result: Optional[dict] = None, error: Optional[str] = None
+) -> bool:
+    """Record the outcome; False if the job was requeued and is no longer this worker's to finish."""
+    with db.session() as s:
+        finished = s.execute(
+            update(SyncJob)
+            .where(*_owned_by(job_id, worker))
+            .values(
+                status="failed" if error else "done",
+                dedupe_key=None,
+                result=result,
+                error=error[:1024] if error else None,
+                finished_at=datetime.utcnow(),
+            )
+        ).rowcount
+        s.commit()
+        return bool(finished)
+
+
+def requeue_stale_running(db: DB, older_than: timedelta) -> int:
+    """Put jobs whose worker stopped heartbeating back in the queue."""
+    cutoff = datetime.utcnow() - older_than
+    with db.session() as s:
+        count = s.execute(
+            update(SyncJob)
+            .where(SyncJob.status == "running", SyncJob.heartbeat_at < cutoff)
+            .values(status="queued", worker=None, started_at=None, heartbeat_at=None)
+        ).rowcount
+        s.commit()
+        return count
+
+
+def get_job(db: DB, job_id: int) -> Optional[SyncJob]:
+    with db.session() as s:
+        return s.get(SyncJob, job_id)
+
+
+def queue_stats(db: DB) -> dict:
+    now = datetime.utcnow()
+    with db.session() as s:
+        counts = dict(
+            s.execute(
+                select(SyncJob.status, func.count())
+                .where(SyncJob.status.in_(("queued", "running")))
+                .group_by(SyncJob.status)
+            ).all()
+        )
+        oldest = s.scalar(select(func.min(SyncJob.created_at)).where(SyncJob.status == "queued"))
+    return {
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "oldest_queued_age_s": round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
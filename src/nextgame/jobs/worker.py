@@ -0,0 +1,149 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from typing import List
+
+from .. import metrics
+from ..storage.db import DB
+from ..steam.client import SteamAPIClient
+from ..steam.sync import sync_user
+from .queue import claim_next, finish_job, queue_stats, requeue_stale_running, touch_job
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerMetrics:
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds_total = 0.0
+        self.run_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait: float, run: float, ok: bool):
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+        self.wait_seconds_total += wait
+        self.run_seconds_total += run
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        if metrics.enabled():
+            metrics.SYNC_JOBS.inc("done" if ok else "failed")
+
+    def as_dict(self) -> dict:
+        processed = self.completed + self.failed
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_s": round(self.wait_seconds_total / processed, 3) if processed else 0.0,
+            "avg_run_s": round(self.run_seconds_total / processed, 3) if processed else 0.0,
+            "max_wait_s": round(self.max_wait_seconds, 3),
+        }
+
+
+class SyncWorkerPool:
+    def __init__(
+        self,
+        db: DB,
+        api: SteamAPIClient,
+        concurrency: int = 2,
+        poll_interval: float = 1.0,
+        stale_after: timedelta = timedelta(minutes=2),
+        requeue_every: float = 60.0,
+        heartbeat_every: float = 30.0,
+    ):
+        self.db = db
+        self.api = api
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.requeue_every = requeue_every
+        self.heartbeat_every = heartbeat_every
+        self._next_requeue = 0.0
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.metrics = WorkerMetrics()
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def _heartbeat(self, job):
+        while True:
+            await asyncio.sleep(self.heartbeat_every)
+            if not await self.db.run_in_thread(touch_job, self.db, job.id, job.worker):
+                logger.warning("Sync job %s for %s was requeued while running", job.id, job.steamid)
+                return
+
+    async def _finish(self, job, **outcome):
+        if not await self.db.run_in_thread(finish_job, self.db, job.id, job.worker, **outcome):
+            logger.warning("Dropped the outcome of sync job %s: %s no longer owns it", job.id, job.worker)
+
+    async def _run_job(self, job):
+        started = time.perf_counter()
+        wait = (job.started_at - job.created_at).total_seconds() if job.started_at and job.created_at else 0.0
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            result = await sync_user(self.db, self.api, job.steamid)
+        except Exception as exc:
+            logger.exception("Sync job %s for %s failed", job.id, job.steamid)
+            await self._finish(job, error=f"{type(exc).__name__}: {exc}")
+            self.metrics.record(wait, time.perf_counter() - started, ok=False)
+        else:
+            await self._finish(job, result=result)
+            self.metrics.record(wait, time.perf_counter() - started, ok=True)
+        finally:
+            heartbeat.cancel()
+
+    async def _requeue_stale(self):
+        """Reclaim jobs of workers that died mid-sync, at most every requeue_every seconds.
+
+        A dead worker's job keeps its dedupe_key, so until it is requeued every
+        enqueue_sync for that steamid returns it instead of a new job.
+        """
+        now = time.monotonic()
+        if now < self._next_requeue:
+            return
+        self._next_requeue = now + self.requeue_every
+        requeued = await self.db.run_in_thread(requeue_stale_running, self.db, self.stale_after)
+        if requeued:
+            logger.info("Requeued %d jobs whose worker stopped heartbeating", requeued)
+
+    async def _loop(self, index: int):
+        worker = f"{self.name}/{index}"
+        while not self._stopping.is_set():
+            await self._requeue_stale()
+            job = await self.db.run_in_thread(claim_next, self.db, worker)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_job(job)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._loop(i)) for i in range(self.concurrency)]
+
+    async def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_forever(self):
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    def stats(self) -> dict:
+        return {"workers": self.concurrency, **queue_stats(self.db), **self.metrics.as_dict()}
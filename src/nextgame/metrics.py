@@ -0,0 +1,248 @@
+"""Process-local counters and histograms rendered in the Prometheus text format.
+
+Everything is off until ``configure(True)``; instrumented call sites check
+``REGISTRY.enabled`` first, so a disabled process pays one attribute lookup.
+"""
+from __future__ import annotations
+import bisect
+import contextvars
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {value:g}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # per label set: [bucket counts..., sum, count]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _labels(self.label_names, labels, 'le="%g"' % bound)
+                yield f"{self.name}_bucket{le} {cumulative:g}"
+            le = _labels(self.label_names, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {series[-1]:g}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]:g}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]:g}"
+
+
+Collector = Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]
+
+
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self._metrics: List = []
+        self._collectors: Dict[str, Collector] = {}
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, collector: Collector):
+        """``collector`` yields (metric, type, labels, value) read at scrape time, e.g. cache stats."""
+        self._collectors[name] = collector
+
+    def remove_collector(self, name: str):
+        self._collectors.pop(name, None)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            samples = list(metric.samples())
+            if samples:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(samples)
+        seen = set()
+        for collector in list(self._collectors.values()):
+            for name, kind, labels, value in collector():
+                if name not in seen:
+                    lines.append(f"# TYPE {name} {kind}")
+                    seen.add(name)
+                lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STEAM_REQUEST_SECONDS = REGISTRY.histogram(
+    "nextgame_steam_request_seconds", "Steam Web API request latency", ["endpoint", "status"]
+)
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "nextgame_steam_rate_limit_wait_seconds", "Time spent waiting on the Steam rate limiter"
+)
+SYNC_OUTCOMES = REGISTRY.counter(
+    "nextgame_sync_outcomes_total", "Persisted sync results by kind", ["kind", "outcome"]
+)
+SYNC_JOBS = REGISTRY.counter("nextgame_sync_jobs_total", "Finished sync jobs", ["outcome"])
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "nextgame_llm_request_seconds", "Chat completion latency", ["operation"]
+)
+LLM_TOKENS = REGISTRY.counter("nextgame_llm_tokens_total", "Tokens reported by the LLM API", ["operation", "type"])
+DB_QUERY_SECONDS = REGISTRY.histogram("nextgame_db_query_seconds", "Duration of single SQL statements", buckets=DB_BUCKETS)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "nextgame_http_request_seconds", "API request latency", ["method", "route", "status"]
+)
+HTTP_REQUEST_DB_QUERIES = REGISTRY.histogram(
+    "nextgame_http_request_db_queries", "SQL statements per API request", ["route"], buckets=COUNT_BUCKETS
+)
+HTTP_REQUEST_DB_SECONDS = REGISTRY.histogram(
+    "nextgame_http_request_db_seconds", "Time in SQL statements per API request", ["route"]
+)
+
+
+def configure(enabled: bool):
+    REGISTRY.enabled = enabled
+
+
+def enabled() -> bool:
+    return REGISTRY.enabled
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+# set per API request by MetricsMiddleware; DB.run_in_thread copies the context into its workers
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "nextgame_request_stats", default=None
+)
+
+
+def instrument_engine(engine: Engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        elapsed = time.perf_counter() - started
+        DB_QUERY_SECONDS.observe(elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+
+def record_sync(kind: str, summary: dict):
+    if REGISTRY.enabled:
+        status = summary.get("status")
+        SYNC_OUTCOMES.inc(kind, status if status in ("not_modified", "unchanged") else "updated")
+
+
+def record_completion(operation: str, started: float, response=None):
+    """``response`` is the completion (or the stream chunk) carrying ``usage``, when there is one."""
+    if not REGISTRY.enabled:
+        return
+    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, operation)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(operation, "prompt", amount=getattr(usage, "prompt_tokens", 0) or 0)
+        LLM_TOKENS.inc(operation, "completion", amount=getattr(usage, "completion_tokens", 0) or 0)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware so streaming responses and contextvars pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not REGISTRY.enabled:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            # the route template keeps label cardinality bounded
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], path, str(status["code"]))
+            HTTP_REQUEST_DB_QUERIES.observe(stats.queries, path)
+            HTTP_REQUEST_DB_SECONDS.observe(stats.db_seconds, path)
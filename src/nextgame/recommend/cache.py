@@ -0,0 +1,136 @@
+from __future__ import annotations
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple, TYPE_CHECKING
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from ..storage.db import RecommendationCacheEntry
+
+if TYPE_CHECKING:
+    from ..config import Settings
+
+# bump when build_prompt or the model changes so old answers are not reused
+PROMPT_VERSION = "2"
+PLAYTIME_BUCKETS = (0, 60, 300, 1200, 3000, 6000, 12000, 30000)
+
+
+def playtime_bucket(minutes: int) -> int:
+    bucket = 0
+    for i, bound in enumerate(PLAYTIME_BUCKETS):
+        if minutes > bound:
+            bucket = i + 1
+    return bucket
+
+
+def library_key(owned: Iterable[Tuple[int, int, int]]) -> str:
+    """Hash of (appid, playtime_forever, playtime_2weeks) rows with playtimes bucketed."""
+    h = hashlib.sha256()
+    for appid, forever, recent in sorted(
+        (appid, playtime_bucket(forever or 0), playtime_bucket(recent or 0)) for appid, forever, recent in owned
+    ):
+        h.update(f"|{appid}:{forever}:{recent}".encode())
+    return h.hexdigest()
+
+
+def fingerprint_from_key(key: str, model: str, trend: Optional[Dict[int, int]] = None) -> str:
+    """``trend`` (recent minutes per appid) is bucketed too, so the fingerprint moves as play starts and stops."""
+    if trend:
+        key += "|" + ",".join(f"{appid}:{playtime_bucket(minutes)}" for appid, minutes in sorted(trend.items()))
+    return hashlib.sha256(f"{PROMPT_VERSION}|{model}|{key}".encode()).hexdigest()
+
+
+class RecommendationCache:
+    """In-process TTL LRU in front of the recommendation_cache table.
+
+    The LRU is keyed by steamid so a hit needs no DB round trip; the table is
+    keyed by user and checked against the library fingerprint.
+    """
+
+    def __init__(self, ttl: float = 86400.0, lru_size: int = 256, lru_ttl: float = 300.0):
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.lru_ttl = lru_ttl
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls, settings: "Settings") -> "RecommendationCache":
+        return cls(
+            ttl=settings.recommendation_cache_ttl,
+            lru_size=settings.recommendation_lru_size,
+            lru_ttl=settings.recommendation_lru_ttl,
+        )
+
+    def get_local(self, steamid: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._lru.get(steamid)
+            if entry is None:
+                return None
+            expires, result = entry
+            if expires < time.monotonic():
+                del self._lru[steamid]
+                return None
+            self._lru.move_to_end(steamid)
+            self.hits += 1
+            return result
+
+    def put_local(self, steamid: str, result: dict):
+        if self.lru_size <= 0:
+            return
+        with self._lock:
+            self._lru[steamid] = (time.monotonic() + self.lru_ttl, result)
+            self._lru.move_to_end(steamid)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get_stored(self, s: Session, user_id: int, fingerprint: str) -> Optional[dict]:
+        entry = s.get(RecommendationCacheEntry, user_id)
+        if entry is None or entry.fingerprint != fingerprint:
+            self.misses += 1
+            return None
+        if entry.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        return entry.payload
+
+    def store(self, s: Session, user_id: int, fingerprint: str, payload: dict):
+        entry = s.get(RecommendationCacheEntry, user_id)
+        if entry is None:
+            entry = RecommendationCacheEntry(user_id=user_id)
+            s.add(entry)
+        entry.fingerprint = fingerprint
+        entry.payload = payload
+        entry.created_at = datetime.utcnow()
+
+    def invalidate(self, s: Session, user_id: int, steamid: str):
+        s.execute(delete(RecommendationCacheEntry).where(RecommendationCacheEntry.user_id == user_id))
+        with self._lock:
+            self._lru.pop(steamid, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._lru)
+        return {"lru_size": size, "hits": self.hits, "db_hits": self.db_hits, "misses": self.misses}
+
+
+_shared: Optional[RecommendationCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_recommendation_cache(settings: Optional["Settings"] = None) -> RecommendationCache:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            from ..config import get_settings
+
+            _shared = RecommendationCache.from_settings(settings or get_settings())
+        return _shared
@@ -0,0 +1,246 @@
+"""Resolve free-text game titles (e.g. from the LLM) to appids without scanning the games table.
+
+``build_name_index`` writes the catalog names normalised and sorted, for
+exact and prefix lookups by bisection, plus a trigram -> names posting list
+in CSR form for fuzzy matches. ``NameIndex`` loads it memory-mapped.
+"""
+from __future__ import annotations
+import bisect
+import itertools
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from ..storage.db import DB, Game
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_VERSION = 1
+FUZZY_THRESHOLD = 0.75
+# trigrams such as "the" match most of the catalog and say little about the title
+MAX_POSTING = 20_000
+FUZZY_CANDIDATES = 16
+# shorter prefixes are unique too often by accident
+MIN_PREFIX = 4
+_NOISE = re.compile(r"[™®©]")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_title(title: str) -> str:
+    text = unicodedata.normalize("NFKC", _NOISE.sub("", title)).casefold()
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _trigram_key(gram: str) -> int:
+    # three code points (21 bits each) packed into one int64
+    a, b, c = (ord(ch) for ch in gram)
+    return (a << 42) | (b << 21) | c
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("the catalog name index needs numpy installed")
+
+
+def build_name_index(db: DB, out_dir: str, batch: int = 50_000) -> dict:
+    _require_numpy()
+    entries: List[Tuple[str, int]] = []
+    with db.session() as s:
+        result = s.execute(
+            select(Game.appid, Game.name).where(Game.name.is_not(None)).execution_options(yield_per=batch)
+        )
+        for appid, name in result:
+            normalized = normalize_title(name)
+            if normalized:
+                entries.append((normalized, appid))
+    entries.sort()
+
+    postings: Dict[str, List[int]] = {}
+    sizes = np.empty(len(entries), dtype=np.int32)
+    for i, (normalized, _) in enumerate(entries):
+        grams = trigrams(normalized)
+        sizes[i] = len(grams)
+        for gram in grams:
+            postings.setdefault(gram, []).append(i)
+    ordered = sorted(postings, key=_trigram_key)
+    unique_keys = np.asarray([_trigram_key(gram) for gram in ordered], dtype=np.int64)
+    offsets = np.zeros(len(ordered) + 1, dtype=np.int64)
+    np.cumsum([len(postings[gram]) for gram in ordered], out=offsets[1:])
+    flat = np.fromiter(
+        itertools.chain.from_iterable(postings[gram] for gram in ordered), dtype=np.int32, count=int(offsets[-1])
+    )
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "names.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(normalized for normalized, _ in entries))
+    np.save(os.path.join(out_dir, "appids.npy"), np.asarray([appid for _, appid in entries], dtype=np.int64))
+    np.save(os.path.join(out_dir, "trigram_keys.npy"), unique_keys)
+    np.save(os.path.join(out_dir, "trigram_offsets.npy"), offsets)
+    np.save(os.path.join(out_dir, "trigram_postings.npy"), flat)
+    np.save(os.path.join(out_dir, "trigram_sizes.npy"), sizes)
+    meta = {"version": ARTIFACT_VERSION, "names": len(entries), "trigrams": int(len(unique_keys))}
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+class NameIndex:
+    def __init__(self, path: str):
+        _require_numpy()
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != ARTIFACT_VERSION:
+            raise RuntimeError(f"unsupported name index version {self.meta.get('version')}")
+        with open(os.path.join(path, "names.txt"), encoding="utf-8") as f:
+            self.names = f.read().split("\n") if self.meta["names"] else []
+        self.appids = np.load(os.path.join(path, "appids.npy"), mmap_mode="r")
+        self.keys = np.load(os.path.join(path, "trigram_keys.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "trigram_offsets.npy"), mmap_mode="r")
+        self.postings = np.load(os.path.join(path, "trigram_postings.npy"), mmap_mode="r")
+        self.sizes = np.load(os.path.join(path, "trigram_sizes.npy"), mmap_mode="r")
+        # appid -> rows, built on the first check of a given appid
+        self._by_appid: Optional[np.ndarray] = None
+        self._sorted_appids: Optional[np.ndarray] = None
+
+    def exact(self, title: str) -> Optional[int]:
+        return self._exact(normalize_title(title))
+
+    def _exact(self, normalized: str) -> Optional[int]:
+        i = bisect.bisect_left(self.names, normalized)
+        # duplicates are adjacent and sorted by appid, so this is the oldest app with the name
+        if i < len(self.names) and self.names[i] == normalized:
+            return int(self.appids[i])
+        return None
+
+    def prefix(self, text: str, limit: int = 10) -> List[Tuple[int, str]]:
+        return self._prefix(normalize_title(text), limit)
+
+    def _prefix(self, normalized: str, limit: int) -> List[Tuple[int, str]]:
+        start = bisect.bisect_left(self.names, normalized)
+        found = []
+        for i in range(start, min(start + limit, len(self.names))):
+            if not self.names[i].startswith(normalized):
+                break
+            found.append((int(self.appids[i]), self.names[i]))
+        return found
+
+    def fuzzy(self, title: str, threshold: float = FUZZY_THRESHOLD) -> Optional[Tuple[int, float]]:
+        """Best (appid, Dice similarity) over trigrams, if it reaches ``threshold``."""
+        return self._fuzzy(normalize_title(title), threshold)
+
+    def _fuzzy(self, normalized: str, threshold: float) -> Optional[Tuple[int, float]]:
+        grams = trigrams(normalized)
+        slices = []
+        for gram in grams:
+            pos = int(np.searchsorted(self.keys, _trigram_key(gram)))
+            if pos < len(self.keys) and self.keys[pos] == _trigram_key(gram):
+                start, end = int(self.offsets[pos]), int(self.offsets[pos + 1])
+                if end - start <= MAX_POSTING:
+                    slices.append(self.postings[start:end])
+        if not slices:
+            return None
+        rows, counts = np.unique(np.concatenate(slices), return_counts=True)
+        # Dice over the trigrams looked up; skipped common ones are re-checked on the shortlist
+        dice = 2 * counts / (len(grams) + np.asarray(self.sizes[rows]))
+        top = rows[np.argsort(-dice, kind="stable")[:FUZZY_CANDIDATES]]
+        best: Optional[Tuple[int, float]] = None
+        for row in top:
+            candidate = trigrams(self.names[row])
+            score = 2 * len(grams & candidate) / (len(grams) + len(candidate))
+            if score >= threshold and (best is None or score > best[1]):
+                best = (int(self.appids[row]), score)
+        return best
+
+    def names_of(self, appid: int) -> List[str]:
+        if self._by_appid is None:
+            self._by_appid = np.argsort(self.appids, kind="stable")
+            self._sorted_appids = np.asarray(self.appids)[self._by_appid]
+        start = int(np.searchsorted(self._sorted_appids, appid, side="left"))
+        end = int(np.searchsorted(self._sorted_appids, appid, side="right"))
+        return [self.names[row] for row in self._by_appid[start:end]]
+
+    def matches(self, appid: int, title: str) -> bool:
+        """Whether ``title`` names catalog app ``appid``.
+
+        Its exact name always does; a prefix or close fuzzy match of it only
+        when no other app has the title as its exact name.
+        """
+        normalized = normalize_title(title)
+        names = self.names_of(appid)
+        if not normalized or not names:
+            return False
+        if normalized in names:
+            return True
+        if self._exact(normalized) is not None:
+            return False
+        grams = trigrams(normalized)
+        for name in names:
+            if len(normalized) >= MIN_PREFIX and name.startswith(normalized):
+                return True
+            candidate = trigrams(name)
+            if 2 * len(grams & candidate) / (len(grams) + len(candidate)) >= FUZZY_THRESHOLD:
+                return True
+        return False
+
+    def resolve(self, title: str) -> Optional[int]:
+        """Exact name, else a unique name starting with the title, else the best fuzzy match."""
+        normalized = normalize_title(title)
+        if not normalized:
+            return None
+        appid = self._exact(normalized)
+        if appid is not None:
+            return appid
+        if len(normalized) >= MIN_PREFIX:
+            matches = self._prefix(normalized, 2)
+            if len(matches) == 1:
+                return matches[0][0]
+        best = self._fuzzy(normalized, FUZZY_THRESHOLD)
+        return best[0] if best else None
+
+
+def resolve_appids(items: Iterable[dict], index: Optional[NameIndex]) -> int:
+    """Point each recommendation at the catalog appid for its title; returns how many changed.
+
+    A given appid is kept when the catalog knows it under that title; only a
+    missing, unknown or mismatched one is looked up by name.
+    """
+    if index is None:
+        return 0
+    changed = 0
+    for item in items:
+        title = item.get("title") or ""
+        given = item.get("appid")
+        if given is not None and index.matches(given, title):
+            continue
+        appid = index.resolve(title)
+        if appid is not None and appid != item.get("appid"):
+            item["appid"] = appid
+            changed += 1
+    return changed
+
+
+_indexes: Dict[str, NameIndex] = {}
+
+
+def load_name_index(path: str) -> Optional[NameIndex]:
+    if path not in _indexes:
+        if np is None or not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        _indexes[path] = NameIndex(path)
+        logger.info("Loaded catalog name index from %s (%s names)", path, _indexes[path].meta["names"])
+    return _indexes[path]
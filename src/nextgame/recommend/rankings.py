@@ -0,0 +1,111 @@
+from __future__ import annotations
+import heapq
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..storage.db import Game, LibraryRanking, Ownership
+from ..storage.history import minutes_played
+from ..storage.upsert import IN_CHUNK, chunks, upsert_rows
+from .cache import library_key
+
+# /users/{steamid}/top allows up to 100
+TOP_GAMES = 100
+PROMPT_GAMES = 40
+TREND_DAYS = 90
+
+# appid, playtime_forever, playtime_2weeks; names are read from games so catalog imports show up
+Entry = Tuple[int, int, int]
+
+
+def _entry(row: list) -> Entry:
+    # rows stored before names left the projection are [appid, name, forever, recent, ...]
+    if isinstance(row[1], int):
+        return row[0], row[1], row[2]
+    return row[0], row[2], row[3]
+
+
+def _library(s: Session, user_id: int) -> List[Entry]:
+    return [
+        tuple(row)
+        for row in s.execute(
+            select(Ownership.appid, Ownership.playtime_forever, Ownership.playtime_2weeks)
+            .where(Ownership.user_id == user_id)
+            .order_by(Ownership.id)
+        )
+    ]
+
+
+def game_names(s: Session, appids: List[int]) -> Dict[int, Optional[str]]:
+    return dict(s.execute(select(Game.appid, Game.name).where(Game.appid.in_(appids))).all())
+
+
+def load_trend(s: Session, user_id: int) -> Dict[int, int]:
+    """Minutes played per appid over the last TREND_DAYS, read when a prompt is built so it never goes stale."""
+    return minutes_played(s, user_id, datetime.utcnow() - timedelta(days=TREND_DAYS))
+
+
+def rank_library(user_id: int, entries: List[Entry]) -> LibraryRanking:
+    """Build the projection without touching the session; nsmallest keeps sorted()'s tie order."""
+    return LibraryRanking(
+        user_id=user_id,
+        game_count=len(entries),
+        library_key=library_key(entries),
+        by_total=[list(e) for e in heapq.nsmallest(TOP_GAMES, entries, key=lambda e: -e[1])],
+        # the order build_prompt has always used; prompt_games puts recently played games first
+        for_prompt=[list(e) for e in heapq.nsmallest(PROMPT_GAMES, entries, key=lambda e: (e[2], -e[1]))],
+        updated_at=datetime.utcnow(),
+    )
+
+
+def top_games(s: Session, ranking: LibraryRanking, limit: int) -> List[list]:
+    """The ``limit`` most played games as [appid, name, playtime_forever, playtime_2weeks] rows."""
+    entries = [_entry(row) for row in ranking.by_total[:limit]]
+    names = game_names(s, [e[0] for e in entries])
+    return [[appid, names.get(appid), forever, recent] for appid, forever, recent in entries]
+
+
+def prompt_games(s: Session, ranking: LibraryRanking, trend: Dict[int, int]) -> List[list]:
+    """for_prompt re-ranked by ``trend``: [appid, name, playtime_forever, playtime_2weeks, trend minutes] rows.
+
+    for_prompt holds the best PROMPT_GAMES without trend, so only trending
+    games outside it are read.
+    """
+    entries: Dict[int, Entry] = {row[0]: _entry(row) for row in ranking.for_prompt}
+    missing = [appid for appid in trend if appid not in entries]
+    for chunk in chunks(missing, IN_CHUNK):
+        for row in s.execute(
+            select(Ownership.appid, Ownership.playtime_forever, Ownership.playtime_2weeks)
+            .where(Ownership.user_id == ranking.user_id, Ownership.appid.in_(chunk))
+        ):
+            entries[row[0]] = tuple(row)
+    ranked = heapq.nsmallest(PROMPT_GAMES, entries.values(), key=lambda e: (-trend.get(e[0], 0), e[2], -e[1]))
+    names = game_names(s, [e[0] for e in ranked])
+    return [[appid, names.get(appid), forever, recent, trend.get(appid, 0)] for appid, forever, recent in ranked]
+
+
+def refresh_ranking(s: Session, user_id: int) -> LibraryRanking:
+    """Recompute and store the user's projection; called by the sync path after ownerships change."""
+    ranking = rank_library(user_id, _library(s, user_id))
+    row = {
+        "user_id": user_id,
+        "game_count": ranking.game_count,
+        "library_key": ranking.library_key,
+        "by_total": ranking.by_total,
+        "for_prompt": ranking.for_prompt,
+        "updated_at": ranking.updated_at,
+    }
+    upsert_rows(s, LibraryRanking, [row], ["user_id"], {
+        col: (lambda new, t, col=col: getattr(new, col)) for col in row if col != "user_id"
+    })
+    return ranking
+
+
+def load_ranking(s: Session, user_id: int) -> LibraryRanking:
+    """Stored projection, or one computed on the fly for users not synced since it was added."""
+    ranking = s.get(LibraryRanking, user_id)
+    if ranking is None:
+        ranking = rank_library(user_id, _library(s, user_id))
+    return ranking
@@ -1,12 +1,24 @@
 from __future__ import annotations
-from typing import Dict, List
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+import asyncio
 import json
+import time
 
 from pydantic import BaseModel, ValidationError, Field
+from sqlalchemy.orm import Session
 
-from ..config import get_settings
-from ..storage.db import DB, User, Ownership, Game, Snapshot
-from openai import OpenAI
+from .. import metrics
+from ..config import Settings
+from ..storage.db import DB, User
+from ..storage.snapshots import add_snapshot
+from .cache import RecommendationCache, fingerprint_from_key, get_recommendation_cache
+from .names import load_name_index, resolve_appids
+from .rankings import load_ranking, load_trend, prompt_games
+from .similarity import SimilarityModel, recommend_local
+from openai import AsyncOpenAI
+
+MODEL = "gpt-4o-mini"
 
 
 class Recommendation(BaseModel):
@@ -14,17 +26,14 @@ class Recommendation(BaseModel):
     title: str = Field(..., min_length=1)
     reason: str = Field(..., min_length=1)
 
-def build_prompt(user: User, owned: List[Ownership], games: Dict[int, Game]) -> str:
-    candidates = sorted(
-        owned,
-        key=lambda o: (o.playtime_2weeks, -o.playtime_forever),
-    )[:40]
+def build_prompt(user: User, ranked: List[list]) -> str:
+    """``ranked`` is rankings.prompt_games: [appid, name, playtime_forever, playtime_2weeks, trend] rows."""
     lines: List[str] = []
-    for o in candidates:
-        g = games.get(o.appid)
-        title = (g.name if g and g.name else f"App {o.appid}")
+    for appid, name, forever, recent, trend in ranked:
+        title = name or f"App {appid}"
+        last_90 = f", last 90 days {trend} min" if trend else ""
         lines.append(
-            f"- {title} (appid {o.appid}, total {o.playtime_forever} min, recent {o.playtime_2weeks} min)"
+            f"- {title} (appid {appid}, total {forever} min, recent {recent} min{last_90})"
         )
     prompt = (
         "The user owns these Steam games. Recommend exactly 5 games to play next with a brief rationale, "
@@ -55,6 +64,64 @@ def _extract_json_array(text: str) -> str | None:
     return None
 
 
+def to_recommendation(entry: dict) -> Recommendation:
+    return Recommendation(
+        appid=int(entry.get("appid")),
+        title=str(entry.get("title")),
+        reason=str(entry.get("reason")),
+    )
+
+
+class ArrayItemStream:
+    """Incrementally pull complete objects out of a streamed top-level JSON array."""
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.obj_start: Optional[int] = None
+        self.done = False
+
+    def feed(self, chunk: str) -> List[dict]:
+        self.buf += chunk
+        found: List[dict] = []
+        while self.pos < len(self.buf) and not self.done:
+            ch = self.buf[self.pos]
+            if self.depth == 0:
+                # skip any prose before the array opens
+                if ch == "[":
+                    self.depth = 1
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "[{":
+                self.depth += 1
+                if ch == "{" and self.depth == 2:
+                    self.obj_start = self.pos
+            elif ch in "]}":
+                self.depth -= 1
+                if ch == "}" and self.depth == 1 and self.obj_start is not None:
+                    try:
+                        obj = json.loads(self.buf[self.obj_start:self.pos + 1])
+                    except json.JSONDecodeError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        found.append(obj)
+                    self.obj_start = None
+                elif self.depth == 0:
+                    self.done = True
+            self.pos += 1
+        return found
+
+
 def parse_recommendations(raw: str) -> dict:
     json_fragment = _extract_json_array(raw)
     if not json_fragment:
@@ -72,13 +139,8 @@ def parse_recommendations(raw: str) -> dict:
             errors.append(f"Item {i} not an object")
             continue
         try:
-            rec = Recommendation(
-                appid=int(entry.get("appid")),
-                title=str(entry.get("title")),
-                reason=str(entry.get("reason")),
-            )
-            items.append(rec)
-        except (ValueError, ValidationError) as exc:
+            items.append(to_recommendation(entry))
+        except (TypeError, ValueError, ValidationError) as exc:
             errors.append(f"Item {i} validation failed: {exc}")
     if not items:
         return {"status": "parse_error", "errors": errors or ["No valid items"], "items": []}
@@ -86,37 +148,205 @@ def parse_recommendations(raw: str) -> dict:
     return {"status": "ok", "items": [r.model_dump() for r in items], "errors": errors}
 
 
-def recommend_games(db: DB, steamid: str) -> dict:
-    settings = get_settings()
-    if not settings.openai_api_key:
-        return {"error": "OPENAI_API_KEY missing"}
+@dataclass
+class PromptJob:
+    user_id: int
+    fingerprint: str
+    prompt: str
+
+
+def _messages(prompt: str) -> List[dict]:
+    return [
+        {"role": "system", "content": "You are a concise game recommendation assistant."},
+        {"role": "user", "content": prompt},
+    ]
+
 
+def prepare_recommendation(s: Session, steamid: str, cache: RecommendationCache) -> Union[dict, PromptJob]:
+    """Return a finished result (error or cache hit) or the prompt to send."""
+    user = s.query(User).filter_by(steamid=steamid).one_or_none()
+    if not user:
+        return {"error": "user not found"}
+
+    ranking = load_ranking(s, user.id)
+    if not ranking.game_count:
+        return {"error": "no ownership data"}
+
+    trend = load_trend(s, user.id)
+    fingerprint = fingerprint_from_key(ranking.library_key, MODEL, trend)
+    stored = cache.get_stored(s, user.id, fingerprint)
+    if stored is not None:
+        result = {"status": "ok", **stored}
+        cache.put_local(steamid, result)
+        return {**result, "cached": True}
+
+    prompt = build_prompt(user, prompt_games(s, ranking, trend))
+    return PromptJob(user_id=user.id, fingerprint=fingerprint, prompt=prompt)
+
+
+def store_recommendation(
+    db: DB, steamid: str, job: PromptJob, content: str, settings: Settings, cache: RecommendationCache
+) -> dict:
+    parsed = parse_recommendations(content)
+    resolve_appids(parsed["items"], load_name_index(settings.catalog_index_path))
     with db.session() as s:
-        user = s.query(User).filter_by(steamid=steamid).one_or_none()
-        if not user:
-            return {"error": "user not found"}
-
-        owned: List[Ownership] = s.query(Ownership).filter_by(user_id=user.id).all()
-        if not owned:
-            return {"error": "no ownership data"}
-
-        game_ids = [o.appid for o in owned]
-        games = {g.appid: g for g in s.query(Game).filter(Game.appid.in_(game_ids)).all()}
-
-        prompt = build_prompt(user, owned, games)
-        client = OpenAI(api_key=settings.openai_api_key) 
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a concise game recommendation assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.7,
-        )
-        content = completion.choices[0].message.content or ""
-        parsed = parse_recommendations(content)
-        snap = Snapshot(user_id=user.id, kind="recommendations", payload={"raw": content, "parsed": parsed})
-        s.add(snap)
+        add_snapshot(s, job.user_id, "recommendations", {"raw": content, "parsed": parsed})
+        if parsed["status"] == "ok":
+            cache.store(s, job.user_id, job.fingerprint, {"raw": content, "parsed": parsed})
         s.commit()
 
-        return {"status": "ok", "raw": content, "parsed": parsed}
+    result = {"status": "ok", "raw": content, "parsed": parsed}
+    if parsed["status"] == "ok":
+        cache.put_local(steamid, result)
+    return result
+
+
+_async_clients: Dict[Tuple[str, Optional[str]], AsyncOpenAI] = {}
+_inflight: Dict[str, "asyncio.Future[dict]"] = {}
+
+
+def get_async_openai(settings: Settings) -> AsyncOpenAI:
+    key = (settings.openai_api_key or "", settings.openai_base_url)
+    client = _async_clients.get(key)
+    if client is None:
+        client = _async_clients[key] = AsyncOpenAI(
+            api_key=settings.openai_api_key, base_url=settings.openai_base_url
+        )
+    return client
+
+
+async def close_async_openai():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.close()
+
+
+async def _recommend_uncoalesced(
+    db: DB, steamid: str, settings: Settings, cache: RecommendationCache
+) -> dict:
+    job = await db.read(prepare_recommendation, steamid, cache)
+    if isinstance(job, dict):
+        return job
+    return await complete_job(db, steamid, job, settings, cache)
+
+
+async def complete_job(
+    db: DB, steamid: str, job: PromptJob, settings: Settings, cache: RecommendationCache,
+    operation: str = "recommend",
+) -> dict:
+    """Send a prepared prompt and store the answer like a served request would."""
+    started = time.perf_counter()
+    completion = await get_async_openai(settings).chat.completions.create(
+        model=MODEL, messages=_messages(job.prompt), temperature=0.7
+    )
+    metrics.record_completion(operation, started, completion)
+    content = completion.choices[0].message.content or ""
+    return await db.run_in_thread(store_recommendation, db, steamid, job, content, settings, cache)
+
+
+async def recommend_games_async(
+    db: DB, steamid: str, settings: Settings, cache: Optional[RecommendationCache] = None
+) -> dict:
+    cache = cache or get_recommendation_cache(settings)
+    cached = cache.get_local(steamid)
+    if cached is not None:
+        return {**cached, "cached": True}
+    if not settings.openai_api_key:
+        return {"error": "OPENAI_API_KEY missing"}
+
+    # concurrent requests for the same user share one completion
+    pending = _inflight.get(steamid)
+    if pending is None:
+        pending = asyncio.ensure_future(_recommend_uncoalesced(db, steamid, settings, cache))
+        _inflight[steamid] = pending
+        pending.add_done_callback(lambda _: _inflight.pop(steamid, None))
+    return await asyncio.shield(pending)
+
+
+async def stream_recommendations(
+    db: DB, steamid: str, settings: Settings, cache: Optional[RecommendationCache] = None
+) -> AsyncIterator[dict]:
+    """Yield validated items as soon as they are complete, then a final status event."""
+    cache = cache or get_recommendation_cache(settings)
+    cached = cache.get_local(steamid)
+    if cached is None:
+        if not settings.openai_api_key:
+            yield {"event": "error", "error": "OPENAI_API_KEY missing"}
+            return
+        job = await db.read(prepare_recommendation, steamid, cache)
+        if isinstance(job, dict) and "error" in job:
+            yield {"event": "error", "error": job["error"]}
+            return
+        cached = job if isinstance(job, dict) else None
+
+    if cached is not None:
+        for item in cached["parsed"].get("items", []):
+            yield {"event": "item", "item": item}
+        yield {"event": "done", "status": cached["parsed"].get("status", "unknown"), "cached": True}
+        return
+
+    started = time.perf_counter()
+    usage_chunk = None
+    stream = await get_async_openai(settings).chat.completions.create(
+        model=MODEL, messages=_messages(job.prompt), temperature=0.7, stream=True,
+        # without it the stream carries no usage chunk and token counts stay empty
+        stream_options={"include_usage": True},
+    )
+    parser = ArrayItemStream()
+    names = load_name_index(settings.catalog_index_path)
+    chunks: List[str] = []
+    sent = 0
+    async for event in stream:
+        if getattr(event, "usage", None) is not None:
+            usage_chunk = event
+        if not event.choices:
+            continue
+        delta = event.choices[0].delta.content or ""
+        chunks.append(delta)
+        for entry in parser.feed(delta):
+            if sent >= 5:
+                break
+            try:
+                item = to_recommendation(entry).model_dump()
+            except (TypeError, ValueError, ValidationError):
+                continue
+            resolve_appids([item], names)
+            sent += 1
+            yield {"event": "item", "item": item}
+    metrics.record_completion("stream", started, usage_chunk)
+
+    result = await db.run_in_thread(
+        store_recommendation, db, steamid, job, "".join(chunks), settings, cache
+    )
+    yield {"event": "done", "status": result["parsed"]["status"], "cached": False}
+
+
+def build_explain_prompt(items: List[dict]) -> str:
+    lines = [f"- {it['title']} (appid {it['appid']}): {it['reason']}" for it in items]
+    return (
+        "These games were picked for a player from what similar players spend time on. "
+        "Write one short, specific reason per game for why this player would enjoy it.\n"
+        + "\n".join(lines)
+        + "\nReturn strict JSON array: [{\"appid\":123,\"title\":\"...\",\"reason\":\"...\"}]."
+    )
+
+
+async def recommend_hybrid(db: DB, steamid: str, settings: Settings, model: SimilarityModel) -> dict:
+    """Local model picks the games; the LLM only rewrites the reasons when configured."""
+    local = await db.read(recommend_local, model, steamid)
+    if "error" in local or not settings.openai_api_key:
+        return local
+    items = local["parsed"]["items"]
+    if not items:
+        return local
+    started = time.perf_counter()
+    completion = await get_async_openai(settings).chat.completions.create(
+        model=MODEL, messages=_messages(build_explain_prompt(items)), temperature=0.7
+    )
+    metrics.record_completion("explain", started, completion)
+    explained = parse_recommendations(completion.choices[0].message.content or "")
+    reasons = {it["appid"]: it["reason"] for it in explained["items"]}
+    for it in items:
+        it["reason"] = reasons.get(it["appid"], it["reason"])
+    return {**local, "engine": "hybrid"}
@@ -0,0 +1,225 @@
+from __future__ import annotations
+import json
+import logging
+import math
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..storage.db import DB, Game, Ownership, User
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_VERSION = 1
+RECENT_WEIGHT = 2.0
+OWNED_BASELINE = 0.1
+MAX_SEED_ITEMS = 50
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("the local recommender needs numpy and scipy installed")
+
+
+def playtime_weight(playtime_forever: int, playtime_2weeks: int) -> float:
+    # log-scaled hours so a 2,000-hour game does not drown out everything else
+    return (
+        OWNED_BASELINE
+        + math.log1p((playtime_forever or 0) / 60.0)
+        + RECENT_WEIGHT * math.log1p((playtime_2weeks or 0) / 60.0)
+    )
+
+
+def build_similarity(db: DB, out_dir: str, neighbors: int = 50, min_owners: int = 2, batch: int = 50_000) -> dict:
+    """Build a top-K item-item cosine model from every ownership row."""
+    _require_numpy()
+    from scipy import sparse
+
+    rows: List[int] = []
+    cols: List[int] = []
+    vals: List[float] = []
+    user_index: Dict[int, int] = {}
+    item_index: Dict[int, int] = {}
+    with db.session() as s:
+        result = s.execute(
+            select(Ownership.user_id, Ownership.appid, Ownership.playtime_forever, Ownership.playtime_2weeks)
+            .execution_options(yield_per=batch)
+        )
+        for user_id, appid, forever, recent in result:
+            rows.append(user_index.setdefault(user_id, len(user_index)))
+            cols.append(item_index.setdefault(appid, len(item_index)))
+            vals.append(playtime_weight(forever, recent))
+
+    if not vals:
+        raise RuntimeError("no ownership rows to build a model from")
+
+    matrix = sparse.csr_matrix(
+        (np.asarray(vals, dtype=np.float32), (np.asarray(rows), np.asarray(cols))),
+        shape=(len(user_index), len(item_index)),
+    )
+    owners = np.diff(matrix.tocsc().indptr)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = (matrix @ sparse.diags(1.0 / norms)).tocsc()
+    sim = (normalized.T @ normalized).tocsr()
+    sim.setdiag(0)
+    sim.eliminate_zeros()
+
+    n_items = len(item_index)
+    nbr = np.full((n_items, neighbors), -1, dtype=np.int32)
+    score = np.zeros((n_items, neighbors), dtype=np.float32)
+    rare = owners < min_owners
+    for i in range(n_items):
+        start, end = sim.indptr[i], sim.indptr[i + 1]
+        idx = sim.indices[start:end]
+        val = sim.data[start:end]
+        keep = ~rare[idx]
+        idx, val = idx[keep], val[keep]
+        if len(idx) > neighbors:
+            top = np.argpartition(-val, neighbors)[:neighbors]
+            idx, val = idx[top], val[top]
+        order = np.argsort(-val)
+        nbr[i, :len(order)] = idx[order]
+        score[i, :len(order)] = val[order]
+
+    appids = np.empty(n_items, dtype=np.int64)
+    for appid, i in item_index.items():
+        appids[i] = appid
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "appids.npy"), appids)
+    np.save(os.path.join(out_dir, "neighbors.npy"), nbr)
+    np.save(os.path.join(out_dir, "scores.npy"), score)
+    np.save(os.path.join(out_dir, "owners.npy"), owners.astype(np.int32))
+    meta = {
+        "version": ARTIFACT_VERSION,
+        "items": n_items,
+        "users": len(user_index),
+        "ownerships": len(vals),
+        "neighbors": neighbors,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+class SimilarityModel:
+    """Memory-mapped top-K neighbour lists produced by build_similarity."""
+
+    def __init__(self, path: str):
+        _require_numpy()
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != ARTIFACT_VERSION:
+            raise RuntimeError(f"unsupported similarity artifact version {self.meta.get('version')}")
+        self.path = path
+        self.appids = np.load(os.path.join(path, "appids.npy"), mmap_mode="r")
+        self.neighbors = np.load(os.path.join(path, "neighbors.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(path, "scores.npy"), mmap_mode="r")
+        self.owners = np.load(os.path.join(path, "owners.npy"), mmap_mode="r")
+        self._index = {int(a): i for i, a in enumerate(self.appids)}
+
+    def recommend(
+        self, owned: Sequence[Tuple[int, float]], n: int = 5
+    ) -> List[Tuple[int, float, Optional[int]]]:
+        """Return (appid, score, strongest owned appid) for the top-n unowned games."""
+        seeds = sorted(
+            ((self._index[a], w) for a, w in owned if a in self._index),
+            key=lambda t: -t[1],
+        )[:MAX_SEED_ITEMS]
+        if not seeds:
+            return self.popular(exclude={a for a, _ in owned}, n=n)
+
+        seed_idx = np.fromiter((i for i, _ in seeds), dtype=np.int64, count=len(seeds))
+        seed_w = np.fromiter((w for _, w in seeds), dtype=np.float32, count=len(seeds))
+        cand = np.asarray(self.neighbors[seed_idx])
+        contrib = np.asarray(self.scores[seed_idx]) * seed_w[:, None]
+        valid = cand >= 0
+        flat_cand = cand[valid]
+        flat_contrib = contrib[valid]
+        seed_of = np.broadcast_to(np.arange(len(seeds))[:, None], cand.shape)[valid]
+
+        uniq, inverse = np.unique(flat_cand, return_inverse=True)
+        totals = np.bincount(inverse, weights=flat_contrib)
+        owned_idx = np.fromiter((self._index.get(a, -1) for a, _ in owned), dtype=np.int64)
+        totals[np.isin(uniq, owned_idx)] = -1.0
+
+        k = min(n, int((totals > 0).sum()))
+        if k == 0:
+            return self.popular(exclude={a for a, _ in owned}, n=n)
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+
+        picks = []
+        for t in top:
+            mask = inverse == t
+            best_seed = seed_of[mask][np.argmax(flat_contrib[mask])]
+            picks.append((int(self.appids[uniq[t]]), float(totals[t]), int(self.appids[seed_idx[best_seed]])))
+        return picks
+
+    def popular(self, exclude: set, n: int = 5) -> List[Tuple[int, float, Optional[int]]]:
+        order = np.argsort(-np.asarray(self.owners))
+        picks = []
+        for i in order:
+            appid = int(self.appids[i])
+            if appid in exclude:
+                continue
+            picks.append((appid, float(self.owners[i]), None))
+            if len(picks) >= n:
+                break
+        return picks
+
+
+def _reason(seed_name: Optional[str]) -> str:
+    if seed_name:
+        return f"Players who spend time in {seed_name} tend to play this too."
+    return "Popular with players across the NextGame userbase."
+
+
+def recommend_local(s: Session, model: SimilarityModel, steamid: str, n: int = 5) -> dict:
+    user = s.query(User).filter_by(steamid=steamid).one_or_none()
+    if not user:
+        return {"error": "user not found"}
+    owned = s.execute(
+        select(Ownership.appid, Ownership.playtime_forever, Ownership.playtime_2weeks)
+        .where(Ownership.user_id == user.id)
+    ).all()
+    if not owned:
+        return {"error": "no ownership data"}
+
+    picks = model.recommend([(appid, playtime_weight(f, r)) for appid, f, r in owned], n=n)
+    wanted = {a for a, _, _ in picks} | {seed for _, _, seed in picks if seed is not None}
+    names = dict(s.execute(select(Game.appid, Game.name).where(Game.appid.in_(wanted))).all())
+    items = [
+        {
+            "appid": appid,
+            "title": names.get(appid) or f"App {appid}",
+            "reason": _reason(names.get(seed) if seed is not None else None),
+            "score": round(score, 4),
+        }
+        for appid, score, seed in picks
+    ]
+    parsed = {"status": "ok" if items else "parse_error", "items": items, "errors": []}
+    return {"status": "ok", "raw": None, "parsed": parsed, "engine": "local"}
+
+
+_model: Optional[SimilarityModel] = None
+_model_path: Optional[str] = None
+
+
+def load_similarity_model(path: str) -> Optional[SimilarityModel]:
+    global _model, _model_path
+    if _model is not None and _model_path == path:
+        return _model
+    if np is None or not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    _model, _model_path = SimilarityModel(path), path
+    logger.info("Loaded similarity model from %s (%s items)", path, _model.meta["items"])
+    return _model
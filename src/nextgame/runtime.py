@@ -0,0 +1,54 @@
+from __future__ import annotations
+import asyncio
+import atexit
+import threading
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _LoopThread:
+    """One long-lived event loop in a daemon thread for blocking callers.
+
+    Pooled async clients stay bound to this loop, so repeated blocking calls
+    reuse connections instead of paying for a new loop each time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="nextgame-loop", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def stop(self):
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+                self._loop = None
+                self._thread = None
+
+
+_portal = _LoopThread()
+atexit.register(_portal.stop)
+
+
+def run_sync(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    loop = _portal.loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_sync() cannot be called from the background loop itself")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
@@ -0,0 +1,125 @@
+"""Import the Steam app catalog (appid -> name) into the games table.
+
+The app list is ~200k entries in one JSON document, so it is parsed as it
+streams in and written in batches instead of being loaded whole.
+"""
+from __future__ import annotations
+import codecs
+import json
+import logging
+import re
+from typing import AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import func
+
+from ..storage.db import DB, Game
+from ..storage.upsert import upsert_rows
+
+logger = logging.getLogger(__name__)
+
+CATALOG_BATCH = 5000
+FILE_CHUNK = 1 << 16
+# one app entry is ~60 bytes; anything this large unparsed means the input is not an app list
+MAX_PENDING = 1 << 20
+_APPS_ARRAY = re.compile(r'"apps"\s*:\s*\[')
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+class AppListStream:
+    """Incrementally yield the objects of the ``"apps"`` array of an app-list response.
+
+    Accepts ISteamApps/GetAppList ({"applist": {"apps": [...]}}) and
+    IStoreService/GetAppList pages ({"response": {"apps": [...]}}). Only the
+    unparsed tail is kept between chunks.
+    """
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buf = ""
+        self.in_array = False
+        self.done = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[dict]:
+        self.buf += self._text.decode(chunk, final)
+        found: List[dict] = []
+        if not self.in_array:
+            match = _APPS_ARRAY.search(self.buf)
+            if match is None:
+                # keep enough to match a key split across chunks
+                self.buf = self.buf[-64:]
+                if final:
+                    raise ValueError('no "apps" array in the app list')
+                return found
+            self.buf = self.buf[match.end():]
+            self.in_array = True
+
+        buf, pos = self.buf, 0
+        while not self.done:
+            pos = _SEPARATORS.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                self.done = True
+                break
+            try:
+                app, pos = self._json.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # the entry is cut off at the chunk boundary
+                break
+            if isinstance(app, dict):
+                found.append(app)
+        self.buf = "" if self.done else buf[pos:]
+        if len(self.buf) > MAX_PENDING:
+            raise ValueError("unparseable app list entry")
+        if final and not self.done:
+            raise ValueError("app list ended before the apps array closed")
+        return found
+
+
+async def file_chunks(path: str, size: int = FILE_CHUNK) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+def _write_batch(db: DB, apps: Dict[int, Optional[str]]) -> int:
+    rows = [{"appid": appid, "name": name} for appid, name in apps.items()]
+    with db.session() as s:
+        # rankings join names from games when read, so only cached /top bodies lag, for READ_CACHE_TTL
+        # an unnamed catalog entry must not blank a name learned from a library sync
+        upsert_rows(s, Game, rows, ["appid"], {"name": lambda new, table: func.coalesce(new.name, table.c.name)})
+        s.commit()
+    return len(rows)
+
+
+async def import_catalog(db: DB, chunks: AsyncIterator[bytes], batch: int = CATALOG_BATCH) -> dict:
+    """Upsert every app in the streamed app list; memory is bounded by ``batch`` entries."""
+    parser = AppListStream()
+    totals = {"apps": 0, "unnamed": 0, "batches": 0}
+    pending: Dict[int, Optional[str]] = {}
+
+    async def flush():
+        if pending:
+            totals["apps"] += await db.run_in_thread(_write_batch, db, dict(pending))
+            totals["batches"] += 1
+            pending.clear()
+
+    async def consume(apps: List[dict]):
+        for app in apps:
+            try:
+                appid = int(app["appid"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            name = (app.get("name") or "").strip()[:255] or None
+            totals["unnamed"] += name is None
+            pending[appid] = name
+            if len(pending) >= batch:
+                await flush()
+
+    async for chunk in chunks:
+        await consume(parser.feed(chunk))
+    await consume(parser.feed(b"", final=True))
+    await flush()
+    logger.info("Imported %d catalog apps in %d batches", totals["apps"], totals["batches"])
+    return totals
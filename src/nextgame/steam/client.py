@@ -1,34 +1,135 @@
 from __future__ import annotations
 import asyncio
+import logging
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, TYPE_CHECKING
 
 import httpx
 
+from .. import metrics
+from .ratelimit import RateLimiter, RETRY_STATUSES, get_rate_limiter
+
+if TYPE_CHECKING:
+    from ..config import Settings
+
 STEAM_API_BASE = "https://api.steampowered.com"
 
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
 
 class SteamAPIClient:
-    def __init__(self, api_key: str, timeout: float = 10.0):
+    def __init__(
+        self,
+        api_key: str,
+        timeout: float = 10.0,
+        *,
+        base_url: str = STEAM_API_BASE,
+        http2: bool = False,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        max_concurrency: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 3,
+    ):
         self.api_key = api_key
         self.timeout = timeout
-        self._last_request: float = 0.0
+        self.base_url = base_url
+        if http2 and not _http2_available():
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._concurrency = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self._client: Optional[httpx.AsyncClient] = None
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.max_retries = max_retries
         self._backoff: float = 0.0
+        # Steam calls sent, retries included
+        self.requests = 0
+
+    @classmethod
+    def from_settings(cls, settings: "Settings") -> "SteamAPIClient":
+        return cls(
+            settings.steam_api_key or "",
+            timeout=settings.steam_timeout,
+            http2=settings.steam_http2,
+            max_connections=settings.steam_max_connections,
+            max_keepalive_connections=settings.steam_max_keepalive,
+            keepalive_expiry=settings.steam_keepalive_expiry,
+            max_concurrency=settings.steam_max_concurrency,
+            rate_limiter=get_rate_limiter(settings),
+            max_retries=settings.steam_max_retries,
+        )
 
-    async def _throttle(self):
-        # throttle between requests
-        now = time.time()
-        delta = now - self._last_request
-        if delta < 0.2:
-            await asyncio.sleep(0.2 - delta)
-        self._last_request = time.time()
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "SteamAPIClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _throttle(self) -> float:
+        return await self.rate_limiter.acquire()
+
+    async def _send(self, url: str, params: Dict[str, Any], headers: Optional[Dict[str, str]]) -> httpx.Response:
+        if self._concurrency is None:
+            return await self.client.get(url, params=params, headers=headers)
+        async with self._concurrency:
+            return await self.client.get(url, params=params, headers=headers)
 
     async def _get(self, path: str, params: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> httpx.Response:
-        await self._throttle()
-        url = f"{STEAM_API_BASE}/{path}"
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            resp = await client.get(url, params=params, headers=headers)
-        return resp
+        url = f"/{path.lstrip('/')}"
+        attempt = 0
+        while True:
+            waited = await self._throttle()
+            self.requests += 1
+            if not metrics.enabled():
+                resp = await self._send(url, params, headers)
+            else:
+                metrics.RATE_LIMIT_WAIT_SECONDS.observe(waited)
+                started = time.perf_counter()
+                status = "error"
+                try:
+                    resp = await self._send(url, params, headers)
+                    status = str(resp.status_code)
+                finally:
+                    metrics.STEAM_REQUEST_SECONDS.observe(time.perf_counter() - started, path, status)
+            # the limiter blocks every caller for the backoff, not just this one
+            self._backoff = await self.rate_limiter.record_response(
+                resp.status_code, resp.headers.get("Retry-After")
+            )
+            if resp.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                return resp
+            attempt += 1
+            logger.info("Retrying %s (attempt %d/%d)", path, attempt, self.max_retries)
 
     async def get_player_summaries(self, steamids: List[str], *, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
         params = {"key": self.api_key, "steamids": ",".join(steamids)}
@@ -49,3 +150,13 @@ class SteamAPIClient:
             "include_played_free_games": int(include_played_free_games),
         }
         return await self._get("IPlayerService/GetOwnedGames/v1", params, headers)
+
+    async def stream_app_list(self) -> AsyncIterator[bytes]:
+        """Raw body chunks of the full app list, for parsing without holding the ~10 MB body."""
+        await self._throttle()
+        self.requests += 1
+        async with self.client.stream("GET", "/ISteamApps/GetAppList/v2") as resp:
+            await self.rate_limiter.record_response(resp.status_code, resp.headers.get("Retry-After"))
+            resp.raise_for_status()
+            async for chunk in resp.aiter_bytes():
+                yield chunk
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from .. import fastjson, metrics
+from ..storage.db import DB, User, Snapshot, SyncState
+from ..storage.snapshots import add_snapshot
+
+
+@dataclass
+class Fetched:
+    kind: str
+    status_code: int
+    payload: Optional[dict] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status_code == 304
+
+    @classmethod
+    def from_response(cls, kind: str, resp: httpx.Response) -> "Fetched":
+        if resp.status_code == 304:
+            return cls(kind=kind, status_code=304)
+        resp.raise_for_status()
+        return cls(
+            kind=kind,
+            status_code=resp.status_code,
+            payload=fastjson.loads(resp.content),
+            etag=resp.headers.get("ETag"),
+            last_modified=resp.headers.get("Last-Modified"),
+        )
+
+    def snapshot(self, s: Session, user_id: int, content_hash: Optional[str] = None) -> Snapshot:
+        return add_snapshot(
+            s, user_id, self.kind, self.payload,
+            etag=self.etag, last_modified=self.last_modified, content_hash=content_hash,
+        )
+
+    def touch_state(self, s: Session, user_id: int):
+        """Record a sync that returned nothing new without writing a snapshot."""
+        s.execute(
+            update(SyncState)
+            .where(SyncState.user_id == user_id, SyncState.kind == self.kind)
+            .values(etag=self.etag, last_modified=self.last_modified, synced_at=datetime.utcnow())
+        )
+
+
+def get_or_create_user(s: Session, steamid: str) -> User:
+    user = s.query(User).filter_by(steamid=steamid).one_or_none()
+    if not user:
+        user = User(steamid=steamid)
+        s.add(user)
+        s.flush()
+    return user
+
+
+def conditional_headers(s: Session, user_id: int, kind: str) -> Dict[str, str]:
+    state: Optional[SyncState] = s.get(SyncState, (user_id, kind))
+    headers = {}
+    if state:
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+    return headers
+
+
+PersistStep = Tuple[Callable[[Session, User, Fetched], dict], Fetched]
+
+
+def load_conditional_headers(db: DB, steamid: str, *kinds: str) -> List[Dict[str, str]]:
+    with db.session() as s:
+        user = get_or_create_user(s, steamid)
+        headers = [conditional_headers(s, user.id, kind) for kind in kinds]
+        s.commit()
+    return headers
+
+
+def persist_fetched(db: DB, steamid: str, *steps: PersistStep) -> List[dict]:
+    with db.session() as s:
+        user = get_or_create_user(s, steamid)
+        summaries = [persist(s, user, fetched) for persist, fetched in steps]
+        s.commit()
+    for (_, fetched), summary in zip(steps, summaries):
+        metrics.record_sync(fetched.kind, summary)
+    return summaries
@@ -1,98 +1,55 @@
 from __future__ import annotations
-from typing import Optional
-from datetime import datetime
+from typing import Dict, Optional
 
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 
 from .client import SteamAPIClient
-from ..storage.db import DB, User, Game, Ownership, Snapshot
+from .fetch import Fetched, load_conditional_headers, persist_fetched
+from ..storage.db import DB, LibraryRanking, SyncState, User
+from ..storage.upsert import games_content_hash, upsert_owned_games
+from ..recommend.cache import get_recommendation_cache
+from ..recommend.rankings import refresh_ranking
+from ..storage.readcache import get_read_cache
 
+KIND = "owned_games"
 
-async def update_user_library(db: DB, api: SteamAPIClient, steamid: str) -> dict:
-    with db.session() as s: 
-        user = s.query(User).filter_by(steamid=steamid).one_or_none()
-        if not user:
-            user = User(steamid=steamid)
-            s.add(user)
-            s.flush()
 
-        # headers from last snapshot
-        last_snap: Optional[Snapshot] = (
-            s.query(Snapshot)
-            .filter_by(user_id=user.id, kind="owned_games")
-            .order_by(Snapshot.id.desc())
-            .first()
-        )
-        headers = {}
-        if last_snap:
-            if last_snap.etag:
-                headers["If-None-Match"] = last_snap.etag
-            if last_snap.last_modified:
-                headers["If-Modified-Since"] = last_snap.last_modified
+async def fetch_owned_games(api: SteamAPIClient, steamid: str, headers: Optional[Dict[str, str]] = None) -> Fetched:
+    resp = await api.get_owned_games(steamid, headers=headers or {})
+    return Fetched.from_response(KIND, resp)
 
-    # request
-    resp = await api.get_owned_games(steamid, headers=headers)
 
-    if resp.status_code == 304:
+def persist_owned_games(s: Session, user: User, fetched: Fetched) -> dict:
+    if fetched.not_modified:
         return {"status": "not_modified"}
+    response = fetched.payload.get("response", {})
+    games = response.get("games", []) or []
+    # private profiles return an empty response; only a counted list is the full library
+    complete = "game_count" in response
+    content_hash = games_content_hash(games, complete)
+    state = s.get(SyncState, (user.id, KIND))
+    if state is not None and state.content_hash == content_hash:
+        # Steam often answers 200 without honouring If-None-Match
+        fetched.touch_state(s, user.id)
+        return {"status": "unchanged", "games": len(games)}
+    fetched.snapshot(s, user.id, content_hash)
+    summary = upsert_owned_games(s, user.id, games, complete=complete)
+    changed = any(summary[key] for key in ("upserted_ownerships", "changed_ownerships", "removed_ownerships"))
+    if changed:
+        previous_key = s.scalar(select(LibraryRanking.library_key).where(LibraryRanking.user_id == user.id))
+        ranking = refresh_ranking(s, user.id)
+        # playtime that stays inside its bucket leaves the stored recommendation valid
+        if ranking.library_key != previous_key:
+            get_recommendation_cache().invalidate(s, user.id, user.steamid)
+    # the ranking has no names, but cached /top responses do
+    if changed or summary["renamed_games"]:
+        get_read_cache().invalidate_after_commit(s, user.steamid)
+    return summary
 
-    resp.raise_for_status()
-    owned = resp.json()
-
-    etag = resp.headers.get("ETag")
-    last_modified = resp.headers.get("Last-Modified")
-
-    response = owned.get("response", {})
-    games = response.get("games", [])
-
-    summary = {"games": len(games), "upserted_games": 0, "upserted_ownerships": 0}
-
-    with db.session() as s: 
-        user = s.query(User).filter_by(steamid=steamid).one_or_none()
-        
-        if not user:
-            return
-
-        snap = Snapshot(
-            user_id=user.id, kind="owned_games", payload=owned, etag=etag, last_modified=last_modified
-        )
-        s.add(snap)
-
-        for g in games:
-            appid = int(g.get("appid"))
-            name = g.get("name")
-            playtime_forever = int(g.get("playtime_forever", 0))
-            playtime_2weeks = int(g.get("playtime_2weeks", 0))
-
-            game = s.get(Game, appid)
-            if not game:
-                game = Game(appid=appid, name=name, last_updated=datetime.utcnow())
-                s.add(game)
-                summary["upserted_games"] += 1
-            else:
-                if name and game.name != name:
-                    game.name = name
-                game.last_updated = datetime.utcnow()
-
-            own = (
-                s.query(Ownership)
-                .filter(Ownership.user_id == user.id, Ownership.appid == appid)
-                .one_or_none()
-            )
-            if not own:
-                own = Ownership(
-                    user_id=user.id,
-                    appid=appid,
-                    playtime_forever=playtime_forever,
-                    playtime_2weeks=playtime_2weeks,
-                    last_updated=datetime.utcnow(),
-                )
-                s.add(own)
-                summary["upserted_ownerships"] += 1
-            else:
-                own.playtime_forever = playtime_forever
-                own.playtime_2weeks = playtime_2weeks
-                own.last_updated = datetime.utcnow()
-
-        s.commit()
 
+async def update_user_library(db: DB, api: SteamAPIClient, steamid: str) -> dict:
+    (headers,) = await db.run_in_thread(load_conditional_headers, db, steamid, KIND)
+    fetched = await fetch_owned_games(api, steamid, headers)
+    (summary,) = await db.run_in_thread(persist_fetched, db, steamid, (persist_owned_games, fetched))
     return summary
@@ -0,0 +1,228 @@
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..config import Settings
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclass
+class BucketState:
+    tokens: float
+    daily_tokens: float
+    updated: float
+    blocked_until: float = 0.0
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = time.time() if now is None else now
+    return max(0.0, when.timestamp() - now)
+
+
+class RateLimiter:
+    """Token bucket with an optional daily quota, shared by every Steam call.
+
+    ``acquire`` reserves a token up front and returns how long the caller has
+    to sleep, so waiters are served in arrival order without busy polling.
+    """
+
+    def __init__(
+        self,
+        rate: float = 5.0,
+        burst: float = 5.0,
+        daily_quota: Optional[int] = None,
+        *,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._state: Optional[BucketState] = None
+
+    def _clock(self) -> float:
+        return time.monotonic()
+
+    def _initial_state(self, now: float) -> BucketState:
+        return BucketState(
+            tokens=self.burst,
+            daily_tokens=float(self.daily_quota or 0),
+            updated=now,
+        )
+
+    def _reserve(self, state: BucketState, now: float) -> float:
+        # nothing refills while blocked, so reservations queue up behind the block at 1/rate
+        start = max(now, state.blocked_until)
+        elapsed = max(0.0, start - state.updated)
+        state.updated = max(state.updated, start)
+        state.tokens = min(self.burst, state.tokens + elapsed * self.rate) - 1
+        wait = -state.tokens / self.rate if state.tokens < 0 else 0.0
+        if self.daily_quota:
+            daily_rate = self.daily_quota / SECONDS_PER_DAY
+            state.daily_tokens = min(
+                float(self.daily_quota), state.daily_tokens + elapsed * daily_rate
+            ) - 1
+            if state.daily_tokens < 0:
+                wait = max(wait, -state.daily_tokens / daily_rate)
+        return (start - now) + wait
+
+    def _block(self, state: BucketState, now: float, delay: float):
+        # drain the bucket and stop refilling until the block ends, so callers don't all fire at once
+        state.tokens = min(state.tokens, 0.0)
+        state.blocked_until = max(state.blocked_until, now + delay)
+        state.updated = max(state.updated, state.blocked_until)
+
+    def _with_state(self, fn) -> float:
+        with self._lock:
+            now = self._clock()
+            if self._state is None:
+                self._state = self._initial_state(now)
+            return fn(self._state, now)
+
+    async def _update_state(self, fn) -> float:
+        """Run ``fn(state, now)`` against the bucket from the event loop."""
+        return self._with_state(fn)
+
+    async def acquire(self) -> float:
+        wait = await self._update_state(self._reserve)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def backoff_delay(self, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        delay = self.backoff_base * (2 ** min(self._failures - 1, 16))
+        return min(self.backoff_max, delay * random.uniform(1.0, 1.5))
+
+    def _count_response(self, status_code: int, retry_after: Optional[str]) -> Optional[float]:
+        """Track the failure streak; returns the backoff a retryable status earns, None otherwise."""
+        with self._lock:
+            if status_code not in RETRY_STATUSES:
+                self._failures = 0
+                return None
+            self._failures += 1
+            return self.backoff_delay(parse_retry_after(retry_after))
+
+    async def record_response(self, status_code: int, retry_after: Optional[str] = None) -> float:
+        """Feed a response status back; returns the backoff applied to all callers."""
+        delay = self._count_response(status_code, retry_after)
+        if delay is None:
+            return 0.0
+        await self._update_state(lambda state, now: self._block(state, now, delay))
+        logger.warning("Steam API returned %s; backing off %.1fs", status_code, delay)
+        return delay
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """RateLimiter whose bucket lives in a local SQLite file, shared by all workers."""
+
+    def __init__(self, path: str, *args, name: str = "steam", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.name = name
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "name TEXT PRIMARY KEY, tokens REAL, daily_tokens REAL, "
+                "updated REAL, blocked_until REAL)"
+            )
+        finally:
+            conn.close()
+
+    def _clock(self) -> float:
+        # wall clock so that separate processes agree on elapsed time
+        return time.time()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+
+    def _with_state(self, fn) -> float:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = self._clock()
+            row = conn.execute(
+                "SELECT tokens, daily_tokens, updated, blocked_until FROM rate_buckets WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+            state = BucketState(*row) if row else self._initial_state(now)
+            result = fn(state, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?, ?, ?)",
+                (self.name, state.tokens, state.daily_tokens, state.updated, state.blocked_until),
+            )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    async def _update_state(self, fn) -> float:
+        # BEGIN IMMEDIATE can wait on another process's lock, so keep it off the event loop
+        return await asyncio.to_thread(self._with_state, fn)
+
+
+_shared: Dict[Tuple, RateLimiter] = {}
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter(settings: Optional["Settings"] = None) -> RateLimiter:
+    if settings is None:
+        key: Tuple = ("default",)
+        factory = RateLimiter
+    else:
+        key = (
+            settings.steam_rate_per_second,
+            settings.steam_rate_burst,
+            settings.steam_daily_quota,
+            settings.steam_rate_limit_file,
+        )
+
+        def factory():
+            kwargs = dict(
+                rate=settings.steam_rate_per_second,
+                burst=settings.steam_rate_burst,
+                daily_quota=settings.steam_daily_quota,
+            )
+            if settings.steam_rate_limit_file:
+                return SQLiteRateLimiter(settings.steam_rate_limit_file, **kwargs)
+            return RateLimiter(**kwargs)
+
+    with _shared_lock:
+        limiter = _shared.get(key)
+        if limiter is None:
+            limiter = _shared[key] = factory()
+        return limiter
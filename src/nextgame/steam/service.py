@@ -1,169 +1,172 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
 import asyncio
+import logging
 
-from ..storage.db import DB, User, Snapshot, Game, Ownership
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from .. import fastjson
+from ..runtime import run_sync
+from ..storage.db import DB, User, SyncState
+from ..storage.readcache import get_read_cache
+from ..storage.snapshots import add_snapshots, snapshot_row
 from .client import SteamAPIClient
+from .fetch import Fetched, load_conditional_headers, persist_fetched
+from .library import fetch_owned_games, persist_owned_games
 
+KIND = "player_summaries"
+PLAYER_SUMMARIES_BATCH = 100
+
+logger = logging.getLogger(__name__)
+
+
+def _profile_fields(player: dict) -> dict:
+    persona_name = player.get("personaname")
+    avatar = (
+        player.get("avatarfull")
+        or player.get("avatarfull_url")
+        or player.get("avatar")
+    )
+    fields = {}
+    if persona_name is not None:
+        fields["persona_name"] = persona_name
+    if avatar is not None:
+        fields["avatar"] = avatar
+    return fields
 
-async def update_user_profile(db: DB, api: SteamAPIClient, steamid: str) -> dict:
-    # contitional headers from last snapshot
-    with db.session() as s:
-        user = s.query(User).filter_by(steamid=steamid).one_or_none()
-        if not user:
-            user = User(steamid=steamid)
-            s.add(user)
-            s.flush()
-
-        last_snap: Optional[Snapshot] = (
-            s.query(Snapshot)
-            .filter_by(user_id=user.id, kind="player_summaries")
-            .order_by(Snapshot.id.desc())
-            .first()
-        )
-        headers = {}
-        if last_snap:
-            if last_snap.etag:
-                headers["If-None-Match"] = last_snap.etag
-            if last_snap.last_modified:
-                headers["If-Modified-Since"] = last_snap.last_modified
-
-    resp = await api.get_player_summaries([steamid], headers=headers)
-
-    if resp.status_code == 304:
-        return {"status": "not_modified"}
 
-    resp.raise_for_status()
-    payload = resp.json()
-    etag = resp.headers.get("ETag")
-    last_modified = resp.headers.get("Last-Modified")
+async def fetch_player_summary(
+    api: SteamAPIClient, steamid: str, headers: Optional[Dict[str, str]] = None
+) -> Fetched:
+    resp = await api.get_player_summaries([steamid], headers=headers or {})
+    return Fetched.from_response(KIND, resp)
+
+
+def persist_player_summary(s: Session, user: User, fetched: Fetched) -> dict:
+    if fetched.not_modified:
+        return {"status": "not_modified"}
 
     # player details
     player: Optional[dict] = None
     try:
-        players = payload.get("response", {}).get("players", [])
+        players = fetched.payload.get("response", {}).get("players", [])
         if players:
             player = players[0]
     except Exception:
         player = None
 
-    with db.session() as s: 
-        user = s.query(User).filter_by(steamid=steamid).one_or_none()
-        if not user:
-            user = User(steamid=steamid)
-            s.add(user)
-            s.flush()
-
-        # store snapshot
-        snap = Snapshot(
-            user_id=user.id,
-            kind="player_summaries",
-            payload=payload,
-            etag=etag,
-            last_modified=last_modified,
-        )
-        s.add(snap)
-
-        # update user
-        if player:
-            persona_name = player.get("personaname")
-            avatar = (
-                player.get("avatarfull")
-                or player.get("avatarfull_url")
-                or player.get("avatar")
-            )
-            if persona_name is not None:
-                user.persona_name = persona_name
-            if avatar is not None:
-                user.avatar = avatar
-
-        s.commit()
+    fetched.snapshot(s, user.id)
+    if player:
+        changed = False
+        for field, value in _profile_fields(player).items():
+            changed = changed or getattr(user, field) != value
+            setattr(user, field, value)
+        if changed:
+            get_read_cache().invalidate_after_commit(s, user.steamid)
 
     return {"status": "ok", "updated_user": True if player else False}
 
 
-def sync_owned_games(db: DB, api: SteamAPIClient, steamid: str) -> dict:
-    # check if user exists
-    with db.session() as s: 
-        user = s.query(User).filter_by(steamid=steamid).one_or_none()
-        if not user:
-            user = User(steamid=steamid)
-            s.add(user)
-            s.flush()
-
-    # call Steam 
-    ps_resp = asyncio.run(api._get("ISteamUser/GetPlayerSummaries/v0002/", {"key": api.api_key, "steamids": steamid}))
-    og_resp = asyncio.run(
-        api._get(
-            "IPlayerService/GetOwnedGames/v0001/",
-            {"key": api.api_key, "steamid": steamid, "include_appinfo": 1, "include_played_free_games": 1},
-        )
-    )
-
-    ps_resp.raise_for_status()
-    og_resp.raise_for_status()
+async def update_user_profile(db: DB, api: SteamAPIClient, steamid: str) -> dict:
+    # conditional headers from last snapshot
+    (headers,) = await db.run_in_thread(load_conditional_headers, db, steamid, KIND)
+    fetched = await fetch_player_summary(api, steamid, headers)
+    (summary,) = await db.run_in_thread(persist_fetched, db, steamid, (persist_player_summary, fetched))
+    return summary
 
-    ps = ps_resp.json()
-    owned = og_resp.json()
 
-    player = None
-    try:
-        players = ps.get("response", {}).get("players", [])
-        if players:
-            player = players[0]
-    except Exception:
-        player = None
+async def sync_owned_games_async(db: DB, api: SteamAPIClient, steamid: str) -> dict:
+    profile, owned = await asyncio.gather(
+        fetch_player_summary(api, steamid),
+        fetch_owned_games(api, steamid),
+    )
+    await db.run_in_thread(
+        persist_fetched,
+        db,
+        steamid,
+        (persist_player_summary, profile),
+        (persist_owned_games, owned),
+    )
+    games = owned.payload.get("response", {}).get("games", []) or []
+    return {"status": "ok", "games_seen": len(games)}
 
-    games = owned.get("response", {}).get("games", []) or []
 
+def sync_owned_games(db: DB, api: SteamAPIClient, steamid: str) -> dict:
+    # blocking wrapper for scripts; runs on the shared background loop
+    return run_sync(sync_owned_games_async(db, api, steamid))
+
+
+def stale_profile_steamids(db: DB, max_age: timedelta, limit: Optional[int] = None) -> List[str]:
+    cutoff = datetime.utcnow() - max_age
+    stmt = (
+        select(User.steamid)
+        .outerjoin(SyncState, (SyncState.user_id == User.id) & (SyncState.kind == KIND))
+        .where((SyncState.synced_at.is_(None)) | (SyncState.synced_at < cutoff))
+        # never-synced users first, then the oldest
+        .order_by(SyncState.synced_at.is_not(None), SyncState.synced_at)
+    )
+    if limit:
+        stmt = stmt.limit(limit)
     with db.session() as s:
-        user = s.query(User).filter_by(steamid=steamid).one()
-
-        # Update user fields
-        if player:
-            persona_name = player.get("personaname")
-            avatar = (
-                player.get("avatarfull")
-                or player.get("avatarfull_url")
-                or player.get("avatar")
-            )
-            if persona_name is not None:
-                user.persona_name = persona_name
-            if avatar is not None:
-                user.avatar = avatar
-
-        # update games/owns
-        for g in games:
-            appid = int(g.get("appid"))
-            name = g.get("name")
-            playtime_forever = int(g.get("playtime_forever", 0))
-            playtime_2weeks = int(g.get("playtime_2weeks", 0))
-
-            game = s.get(Game, appid)
-            if not game:
-                game = Game(appid=appid, name=name)
-                s.add(game)
-            else:
-                if name and game.name != name:
-                    game.name = name
-
-            own = (
-                s.query(Ownership)
-                .filter(Ownership.user_id == user.id, Ownership.appid == appid)
-                .one_or_none()
-            )
-            if not own:
-                own = Ownership(
-                    user_id=user.id,
-                    appid=appid,
-                    playtime_forever=playtime_forever,
-                    playtime_2weeks=playtime_2weeks,
-                )
-                s.add(own)
-            else:
-                own.playtime_forever = playtime_forever
-                own.playtime_2weeks = playtime_2weeks
+        return list(s.scalars(stmt))
 
-        s.commit()
 
-    return {"status": "ok", "games_seen": len(games)}
+def _store_profiles(db: DB, players: Dict[str, dict]) -> int:
+    with db.session() as s:
+        ids = dict(s.execute(select(User.steamid, User.id).where(User.steamid.in_(list(players)))).all())
+        read_cache = get_read_cache()
+        user_rows = []
+        snapshot_rows = []
+        for steamid, player in players.items():
+            user_id = ids.get(steamid)
+            if user_id is None:
+                continue
+            fields = _profile_fields(player)
+            if fields:
+                user_rows.append({"id": user_id, **fields})
+                read_cache.invalidate_after_commit(s, steamid)
+            snapshot_rows.append(snapshot_row(s, user_id, KIND, {"response": {"players": [player]}}))
+        if user_rows:
+            s.execute(update(User), user_rows)
+        add_snapshots(s, snapshot_rows)
+        s.commit()
+    return len(snapshot_rows)
+
+
+async def refresh_profiles(
+    db: DB,
+    api: SteamAPIClient,
+    steamids: Optional[List[str]] = None,
+    *,
+    max_age: timedelta = timedelta(hours=24),
+    limit: Optional[int] = None,
+) -> dict:
+    if steamids is None:
+        steamids = await db.run_in_thread(stale_profile_steamids, db, max_age, limit)
+    steamids = list(dict.fromkeys(steamids))
+    summary = {"users": len(steamids), "requests": 0, "updated_users": 0, "missing": 0, "failed_batches": 0}
+    if not steamids:
+        return summary
+
+    batches = [steamids[i:i + PLAYER_SUMMARIES_BATCH] for i in range(0, len(steamids), PLAYER_SUMMARIES_BATCH)]
+    responses = await asyncio.gather(
+        *(api.get_player_summaries(batch) for batch in batches), return_exceptions=True
+    )
+    summary["requests"] = len(batches)
+
+    players: Dict[str, dict] = {}
+    for batch, resp in zip(batches, responses):
+        if isinstance(resp, Exception) or resp.status_code != 200:
+            logger.warning("Profile batch of %d failed: %s", len(batch), resp)
+            summary["failed_batches"] += 1
+            continue
+        for player in fastjson.loads(resp.content).get("response", {}).get("players", []) or []:
+            if player.get("steamid"):
+                players[str(player["steamid"])] = player
+
+    updated = await db.run_in_thread(_store_profiles, db, players)
+    summary["updated_users"] = updated
+    summary["missing"] = len(steamids) - len(players)
+    return summary
@@ -0,0 +1,29 @@
+from __future__ import annotations
+import asyncio
+
+from ..storage.db import DB
+from .client import SteamAPIClient
+from .fetch import load_conditional_headers, persist_fetched
+from . import library, service
+
+
+async def sync_user(db: DB, api: SteamAPIClient, steamid: str) -> dict:
+    profile_headers, library_headers = await db.run_in_thread(
+        load_conditional_headers, db, steamid, service.KIND, library.KIND
+    )
+
+    # both Steam calls are independent; the shared rate limiter still paces them
+    profile, owned = await asyncio.gather(
+        service.fetch_player_summary(api, steamid, profile_headers),
+        library.fetch_owned_games(api, steamid, library_headers),
+    )
+
+    profile_summary, library_summary = await db.run_in_thread(
+        persist_fetched,
+        db,
+        steamid,
+        (service.persist_player_summary, profile),
+        (library.persist_owned_games, owned),
+    )
+
+    return {"profile": profile_summary, "library": library_summary}
@@ -1,12 +1,49 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Optional
-from sqlalchemy import create_engine, Index, JSON, ForeignKey, String, func, text
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, TypeVar, TYPE_CHECKING
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from sqlalchemy import create_engine, event, Index, Integer, JSON, ForeignKey, LargeBinary, String, func, text
+from sqlalchemy.engine import Engine, URL, make_url
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy.dialects.mysql import BIGINT
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.mysql import BIGINT, LONGBLOB
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from datetime import datetime
 
+from .. import fastjson, metrics
+
+if TYPE_CHECKING:
+    from ..config import Settings
+
+T = TypeVar("T")
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+ASYNC_DRIVER_NAMES = {"aiomysql", "asyncmy", "aiosqlite", "asyncpg"}
+
+
+def async_engine_url(url: str) -> URL:
+    parsed = make_url(url)
+    if parsed.get_driver_name() in ASYNC_DRIVER_NAMES:
+        return parsed
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"no async driver known for {backend!r}; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend])
+
+
+# sqlite only autoincrements INTEGER PRIMARY KEY columns
+BigIntPK = BIGINT(unsigned=True).with_variant(Integer(), "sqlite")
+Blob = LargeBinary().with_variant(LONGBLOB(), "mysql")
+
 
 class Base(DeclarativeBase):
     pass
@@ -14,7 +51,7 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
-    id: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
     steamid: Mapped[str] = mapped_column(String(32), unique=True, index=True)
     persona_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     avatar: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
@@ -31,7 +68,7 @@ class Game(Base):
 
 class Ownership(Base):
     __tablename__ = "ownerships"
-    id: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BIGINT(unsigned=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
     appid: Mapped[int] = mapped_column(BIGINT(unsigned=True), ForeignKey("games.appid", ondelete="CASCADE"), index=True)
     playtime_forever: Mapped[int] = mapped_column(default=0)
@@ -48,24 +85,363 @@ class Ownership(Base):
 
 class Snapshot(Base):
     __tablename__ = "snapshots"
-    id: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BIGINT(unsigned=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
     kind: Mapped[str] = mapped_column(String(32))  # e.g., owned_games, player_summaries
     etag: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
     last_modified: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    # legacy uncompressed rows; new rows go through storage.snapshots into `data`
+    payload: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    codec: Mapped[Optional[str]] = mapped_column(String(8), nullable=True)
+    base_id: Mapped[Optional[int]] = mapped_column(BIGINT(unsigned=True), nullable=True)
+    keyframe_id: Mapped[Optional[int]] = mapped_column(BIGINT(unsigned=True), nullable=True)
+    depth: Mapped[int] = mapped_column(default=0)
+    raw_size: Mapped[int] = mapped_column(default=0)
+    data: Mapped[Optional[bytes]] = mapped_column(Blob, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=func.now(), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_snapshots_user_kind_id", "user_id", "kind", "id"),
+    )
+
+
+class SyncState(Base):
+    """Validators and time of the latest snapshot per user and kind, kept in step by storage.snapshots."""
+
+    __tablename__ = "sync_state"
+    user_id: Mapped[int] = mapped_column(
+        BIGINT(unsigned=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    kind: Mapped[str] = mapped_column(String(32), primary_key=True)
+    etag: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    last_modified: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    # hash of the parsed payload, so an unchanged 200 can skip the write path
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    synced_at: Mapped[datetime] = mapped_column(default=func.now(), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_sync_state_kind_synced", "kind", "synced_at"),
+    )
+
+
+class OwnershipDelta(Base):
+    __tablename__ = "ownership_deltas"
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BIGINT(unsigned=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    appid: Mapped[int] = mapped_column(BIGINT(unsigned=True))
+    change: Mapped[str] = mapped_column(String(8))  # added, removed, changed
+    old_playtime_forever: Mapped[int] = mapped_column(default=0)
+    new_playtime_forever: Mapped[int] = mapped_column(default=0)
+    old_playtime_2weeks: Mapped[int] = mapped_column(default=0)
+    new_playtime_2weeks: Mapped[int] = mapped_column(default=0)
+    # set once folded into game_stats/co_ownership; ids are assigned at insert but become
+    # visible at commit, so an id cursor could skip a delta of a slower transaction
+    folded: Mapped[bool] = mapped_column(default=False)
+    created_at: Mapped[datetime] = mapped_column(default=func.now(), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_ownership_deltas_folded_id", "folded", "id"),
+        # ids keep increasing after pruning, so a user's deltas stay in id order
+        {"sqlite_autoincrement": True},
+    )
+
+
+class GameStats(Base):
+    __tablename__ = "game_stats"
+    appid: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True)
+    owners: Mapped[int] = mapped_column(default=0)
+    total_playtime: Mapped[int] = mapped_column(BIGINT, default=0)
+    recent_playtime: Mapped[int] = mapped_column(BIGINT, default=0)
+
+
+class CoOwnership(Base):
+    __tablename__ = "co_ownership"
+    # stored once per pair with appid_a < appid_b
+    appid_a: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True)
+    appid_b: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True)
+    owners: Mapped[int] = mapped_column(default=0)
+
+
+class LibraryRanking(Base):
+    """Per-user games pre-ranked at sync time; entries are [appid, playtime_forever, playtime_2weeks].
+
+    Names are joined from games when the entries are read, see recommend.rankings.
+    """
+
+    __tablename__ = "library_rankings"
+    user_id: Mapped[int] = mapped_column(
+        BIGINT(unsigned=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    game_count: Mapped[int] = mapped_column(default=0)
+    # bucketed-playtime hash of the whole library, see recommend.cache.library_key
+    library_key: Mapped[str] = mapped_column(String(64))
+    by_total: Mapped[list] = mapped_column(JSON)
+    for_prompt: Mapped[list] = mapped_column(JSON)
+    updated_at: Mapped[datetime] = mapped_column(default=func.now(), server_default=func.now())
+
+
+class PlaytimeSeries(Base):
+    """playtime_forever samples of one owned game, see storage.history for the encoding."""
+
+    __tablename__ = "playtime_series"
+    user_id: Mapped[int] = mapped_column(
+        BIGINT(unsigned=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    appid: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True)
+    first_at: Mapped[datetime] = mapped_column()
+    first_minutes: Mapped[int] = mapped_column(BIGINT, default=0)
+    last_at: Mapped[datetime] = mapped_column()
+    last_minutes: Mapped[int] = mapped_column(BIGINT, default=0)
+    samples: Mapped[int] = mapped_column(default=1)
+    # varint (seconds, zigzag minutes) deltas of every sample after the first
+    data: Mapped[bytes] = mapped_column(Blob, default=b"")
+
+    __table_args__ = (
+        Index("ix_playtime_series_user_last", "user_id", "last_at"),
+    )
+
+
+class RecommendationCacheEntry(Base):
+    __tablename__ = "recommendation_cache"
+    user_id: Mapped[int] = mapped_column(
+        BIGINT(unsigned=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    fingerprint: Mapped[str] = mapped_column(String(64))
     payload: Mapped[dict] = mapped_column(JSON)
     created_at: Mapped[datetime] = mapped_column(default=func.now(), server_default=func.now())
 
 
+class SyncJob(Base):
+    __tablename__ = "sync_jobs"
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
+    steamid: Mapped[str] = mapped_column(String(32), index=True)
+    # set to the steamid while queued/running so the unique index rejects duplicates
+    dedupe_key: Mapped[Optional[str]] = mapped_column(String(32), unique=True, nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default="queued")  # queued, running, done, failed
+    # the user's last owned_games sync when queued, NULL if never synced; claims take the stalest first
+    last_synced_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    attempts: Mapped[int] = mapped_column(default=0)
+    worker: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    result: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(String(1024), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=func.now(), server_default=func.now())
+    started_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    # refreshed by the running worker; a stale heartbeat means the worker died
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+
+    __table_args__ = (
+        Index("ix_sync_jobs_claim", "status", "last_synced_at", "id"),
+    )
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.overflow_checkouts = 0
+        self.saturated_checkouts = 0
+        self.peak_checked_out = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+
+    def on_wait(self, seconds: float):
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def on_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def on_checkout(self, checked_out: int, size: int, limit: Optional[int]):
+        with self._lock:
+            self.checkouts += 1
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            if checked_out > size:
+                self.overflow_checkouts += 1
+            if limit is not None and checked_out >= limit:
+                self.saturated_checkouts += 1
+
+    def on_checkin(self):
+        with self._lock:
+            self.checkins += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "overflow_checkouts": self.overflow_checkouts,
+                "saturated_checkouts": self.saturated_checkouts,
+                "peak_checked_out": self.peak_checked_out,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "avg_wait_s": round(self.wait_seconds_total / self.waits, 6) if self.waits else 0.0,
+                "timeouts": self.timeouts,
+            }
+
+
+class _TimedPool:
+    """Pool mixin timing every wait for a connection (including a new connect) and counting pool timeouts."""
+
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.stats.on_timeout()
+            raise
+        finally:
+            self.stats.on_wait(time.perf_counter() - started)
+
+
+def _timed_pool(base: type, stats: PoolStats) -> type:
+    # one class per DB: engine.dispose() recreates the pool from its class, not this instance
+    return type(f"Timed{base.__name__}", (_TimedPool, base), {"stats": stats})
+
+
 @dataclass
 class DB:
     engine_url: str
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_pre_ping: bool = True
+    pool_recycle: int = 1800
+    use_async: bool = False
+    async_url: Optional[str] = None
+    stats: PoolStats = field(default_factory=PoolStats, repr=False)
 
     def __post_init__(self):
-        self.engine = create_engine(
-            self.engine_url,
-        )
+        self.engine = create_engine(self.engine_url, **self._engine_kwargs(make_url(self.engine_url)))
         self.SessionLocal = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._install_pool_listeners(self.engine)
+
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        if self.use_async:
+            from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+            url = async_engine_url(self.async_url or self.engine_url)
+            self.async_engine = create_async_engine(url, **self._engine_kwargs(url))
+            self.AsyncSessionLocal = async_sessionmaker(bind=self.async_engine, expire_on_commit=False)
+            self._install_pool_listeners(self.async_engine.sync_engine)
+        if metrics.enabled():
+            metrics.instrument_engine(self.engine)
+            if self.async_engine is not None:
+                metrics.instrument_engine(self.async_engine.sync_engine)
+
+    def _engine_kwargs(self, url: URL) -> dict:
+        kwargs = {
+            "pool_pre_ping": self.pool_pre_ping,
+            "pool_recycle": self.pool_recycle,
+            "json_serializer": fastjson.dumps_str,
+            "json_deserializer": fastjson.loads,
+        }
+        # sqlite in-memory databases use a singleton pool without sizing knobs
+        if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+            base = AsyncAdaptedQueuePool if url.get_driver_name() in ASYNC_DRIVER_NAMES else QueuePool
+            kwargs.update(
+                poolclass=_timed_pool(base, self.stats),
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+            )
+        return kwargs
+
+    @classmethod
+    def from_settings(cls, settings: "Settings") -> "DB":
+        return cls(
+            settings.database_url,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_pre_ping=settings.db_pool_pre_ping,
+            pool_recycle=settings.db_pool_recycle,
+            use_async=settings.db_async,
+            async_url=settings.async_database_url,
+        )
+
+    def _install_pool_listeners(self, engine: Engine):
+        limit = self.pool_size + self.max_overflow if self.max_overflow >= 0 else None
+
+        @event.listens_for(engine, "checkout")
+        def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+            pool = engine.pool
+            checked_out = pool.checkedout() if hasattr(pool, "checkedout") else 0
+            # SingletonThreadPool has a plain ``size`` attribute
+            size = pool.size() if callable(getattr(pool, "size", None)) else self.pool_size
+            self.stats.on_checkout(checked_out, size, limit)
+
+        @event.listens_for(engine, "checkin")
+        def _on_checkin(dbapi_conn, conn_record):
+            self.stats.on_checkin()
+
+    def pool_status(self) -> dict:
+        pool = self.engine.pool
+        status = {"pool": type(pool).__name__}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(pool, name, None)
+            if callable(fn):
+                status[name] = fn()
+        status["max_overflow"] = self.max_overflow
+        if self.async_engine is not None:
+            status["async_checkedout"] = self.async_engine.pool.checkedout()
+        status.update(self.stats.as_dict())
+        return status
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # one thread per pooled connection; more would only queue on checkout
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, self.pool_size + max(self.max_overflow, 0)),
+                    thread_name_prefix="nextgame-db",
+                )
+            return self._executor
+
+    async def run_in_thread(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        # carry contextvars (per-request metrics) into the worker thread, as asyncio.to_thread does
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(ctx.run, fn, *args, **kwargs))
+
+    async def read(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run fn(session, ...) without blocking the event loop.
+
+        Uses the async engine when enabled, otherwise a sync session on the
+        DB thread pool, so the same query function serves both backends.
+        """
+        if self.AsyncSessionLocal is not None:
+            async with self.AsyncSessionLocal() as s:
+                return await s.run_sync(fn, *args, **kwargs)
+
+        def call():
+            with self.session() as s:
+                return fn(s, *args, **kwargs)
+
+        return await self.run_in_thread(call)
+
+    def dispose(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.engine.dispose()
+
+    async def adispose(self):
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+        self.dispose()
 
     def create_all(self):
         Base.metadata.create_all(self.engine)
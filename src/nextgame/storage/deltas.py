@@ -0,0 +1,120 @@
+from __future__ import annotations
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from .db import DB, CoOwnership, GameStats, Ownership, OwnershipDelta
+from .upsert import IN_CHUNK, chunks, upsert_rows
+
+WRITE_CHUNK = 5000
+
+
+def read_deltas(s: Session, limit: int = 10_000) -> List[OwnershipDelta]:
+    """The oldest committed deltas not folded yet."""
+    return list(
+        s.scalars(
+            select(OwnershipDelta).where(OwnershipDelta.folded.is_(False)).order_by(OwnershipDelta.id).limit(limit)
+        )
+    )
+
+
+def mark_folded(s: Session, ids: List[int]):
+    for chunk in chunks(ids, IN_CHUNK):
+        s.execute(update(OwnershipDelta).where(OwnershipDelta.id.in_(chunk)).values(folded=True))
+
+
+def _library_at(s: Session, user_id: int, upto_id: int) -> Set[int]:
+    """The user's owned appids as they were right after delta ``upto_id``."""
+    owned = set(s.scalars(select(Ownership.appid).where(Ownership.user_id == user_id)))
+    later = s.execute(
+        select(OwnershipDelta.appid, OwnershipDelta.change)
+        .where(OwnershipDelta.user_id == user_id, OwnershipDelta.id > upto_id)
+        .order_by(OwnershipDelta.id.desc())
+    )
+    for appid, change in later:
+        if change == "added":
+            owned.discard(appid)
+        elif change == "removed":
+            owned.add(appid)
+    return owned
+
+
+def _pair(a: int, b: int) -> Tuple[int, int]:
+    return (a, b) if a < b else (b, a)
+
+
+def fold_deltas(s: Session, deltas: List[OwnershipDelta]) -> dict:
+    stats: Dict[int, List[int]] = defaultdict(lambda: [0, 0, 0])
+    # (user, appid) -> [owned before the batch, owned after the batch]
+    membership: Dict[Tuple[int, int], List[bool]] = {}
+    for d in deltas:
+        row = stats[d.appid]
+        row[1] += d.new_playtime_forever - d.old_playtime_forever
+        row[2] += d.new_playtime_2weeks - d.old_playtime_2weeks
+        key = (d.user_id, d.appid)
+        if key not in membership:
+            membership[key] = [d.change != "added", True]
+        membership[key][1] = d.change != "removed"
+
+    added: Dict[int, Set[int]] = defaultdict(set)
+    removed: Dict[int, Set[int]] = defaultdict(set)
+    for (user_id, appid), (before, after) in membership.items():
+        if after and not before:
+            added[user_id].add(appid)
+            stats[appid][0] += 1
+        elif before and not after:
+            removed[user_id].add(appid)
+            stats[appid][0] -= 1
+
+    upto_id = deltas[-1].id
+    pairs: Dict[Tuple[int, int], int] = defaultdict(int)
+    for user_id in set(added) | set(removed):
+        after = _library_at(s, user_id, upto_id)
+        before = (after - added[user_id]) | removed[user_id]
+        new_pairs = {_pair(a, h) for a in added[user_id] for h in after if h != a}
+        old_pairs = {_pair(r, h) for r in removed[user_id] for h in before if h != r}
+        for p in new_pairs:
+            pairs[p] += 1
+        for p in old_pairs:
+            pairs[p] -= 1
+
+    stat_rows = [
+        {"appid": appid, "owners": o, "total_playtime": t, "recent_playtime": r}
+        for appid, (o, t, r) in stats.items()
+        if o or t or r
+    ]
+    pair_rows = [{"appid_a": a, "appid_b": b, "owners": n} for (a, b), n in pairs.items() if n]
+    for rows in chunks(stat_rows, WRITE_CHUNK):
+        upsert_rows(s, GameStats, rows, ["appid"], {
+            "owners": lambda new, t: t.c.owners + new.owners,
+            "total_playtime": lambda new, t: t.c.total_playtime + new.total_playtime,
+            "recent_playtime": lambda new, t: t.c.recent_playtime + new.recent_playtime,
+        })
+    for rows in chunks(pair_rows, WRITE_CHUNK):
+        upsert_rows(s, CoOwnership, rows, ["appid_a", "appid_b"], {
+            "owners": lambda new, t: t.c.owners + new.owners,
+        })
+    return {"deltas": len(deltas), "games": len(stat_rows), "pairs": len(pair_rows)}
+
+
+def compact_deltas(db: DB, batch: int = 10_000, prune: bool = True) -> dict:
+    """Fold pending deltas into game_stats/co_ownership, then drop the folded ones."""
+    totals = {"deltas": 0, "games": 0, "pairs": 0, "pruned": 0}
+    while True:
+        with db.session() as s:
+            deltas = read_deltas(s, batch)
+            if not deltas:
+                break
+            result = fold_deltas(s, deltas)
+            mark_folded(s, [d.id for d in deltas])
+            s.commit()
+        for key in ("deltas", "games", "pairs"):
+            totals[key] += result[key]
+
+    if prune:
+        with db.session() as s:
+            totals["pruned"] = s.execute(delete(OwnershipDelta).where(OwnershipDelta.folded.is_(True))).rowcount
+            s.commit()
+    return totals
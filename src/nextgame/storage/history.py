@@ -0,0 +1,165 @@
+"""Playtime history: one compact row of ``playtime_forever`` samples per owned game.
+
+A sample is only appended when the value changes, so a series is a step
+function. Each row keeps its first and last sample in columns and every
+sample in between as varint (seconds, zigzag minutes) deltas in ``data``, a
+few bytes per sync that saw play. ``last_at`` is indexed with the user so a
+window query reads only the games played since its start.
+"""
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .db import PlaytimeSeries
+from .upsert import IN_CHUNK, chunks, upsert_rows
+
+Point = Tuple[datetime, int]
+
+
+def _varint(value: int, out: bytearray):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _varints(data: bytes) -> Iterator[int]:
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+def encode_step(previous: Point, sample: Point) -> bytes:
+    out = bytearray()
+    _varint(max(0, int((sample[0] - previous[0]).total_seconds())), out)
+    _varint(_zigzag(sample[1] - previous[1]), out)
+    return bytes(out)
+
+
+def decode_points(first_at: datetime, first_minutes: int, data: bytes) -> List[Point]:
+    points = [(first_at, first_minutes)]
+    at, minutes = first_at, first_minutes
+    values = _varints(data)
+    for seconds in values:
+        at += timedelta(seconds=seconds)
+        minutes += _unzigzag(next(values))
+        points.append((at, minutes))
+    return points
+
+
+def series_row(user_id: int, appid: int, points: List[Point]) -> dict:
+    """A playtime_series row for time-ordered points, dropping ones that repeat the previous value."""
+    kept = [points[0]]
+    for point in points[1:]:
+        if point[1] != kept[-1][1] and point[0] > kept[-1][0]:
+            kept.append(point)
+    data = b"".join(encode_step(a, b) for a, b in zip(kept, kept[1:]))
+    return {
+        "user_id": user_id, "appid": appid,
+        "first_at": kept[0][0], "first_minutes": kept[0][1],
+        "last_at": kept[-1][0], "last_minutes": kept[-1][1],
+        "samples": len(kept), "data": data,
+    }
+
+
+def append_samples(s: Session, user_id: int, samples: Iterable[Tuple[int, int]], at: datetime) -> int:
+    """Append (appid, playtime_forever) samples taken at ``at``; unchanged values are skipped.
+
+    Returns the number of samples written.
+    """
+    incoming = dict(samples)
+    if not incoming:
+        return 0
+    known = {}
+    for chunk in chunks(list(incoming), IN_CHUNK):
+        for row in s.execute(
+            select(
+                PlaytimeSeries.appid, PlaytimeSeries.first_at, PlaytimeSeries.first_minutes,
+                PlaytimeSeries.last_at, PlaytimeSeries.last_minutes, PlaytimeSeries.samples, PlaytimeSeries.data,
+            ).where(PlaytimeSeries.user_id == user_id, PlaytimeSeries.appid.in_(chunk))
+        ):
+            known[row.appid] = row
+
+    rows: List[dict] = []
+    for appid, minutes in incoming.items():
+        row = known.get(appid)
+        if row is None:
+            rows.append(series_row(user_id, appid, [(at, minutes)]))
+        elif row.last_minutes != minutes and at > row.last_at:
+            rows.append({
+                "user_id": user_id, "appid": appid,
+                "first_at": row.first_at, "first_minutes": row.first_minutes,
+                "last_at": at, "last_minutes": minutes,
+                "samples": row.samples + 1,
+                "data": (row.data or b"") + encode_step((row.last_at, row.last_minutes), (at, minutes)),
+            })
+    upsert_rows(s, PlaytimeSeries, rows, ["user_id", "appid"], {
+        col: (lambda new, t, col=col: getattr(new, col))
+        for col in ("last_at", "last_minutes", "samples", "data")
+    })
+    return len(rows)
+
+
+def load_points(
+    s: Session, user_id: int, since: Optional[datetime] = None, appids: Optional[Sequence[int]] = None
+) -> Dict[int, List[Point]]:
+    """Decoded series of the user's games, limited to those that changed at or after ``since``."""
+    query = select(
+        PlaytimeSeries.appid, PlaytimeSeries.first_at, PlaytimeSeries.first_minutes, PlaytimeSeries.data
+    ).where(PlaytimeSeries.user_id == user_id)
+    if since is not None:
+        query = query.where(PlaytimeSeries.last_at >= since)
+    if appids is not None:
+        query = query.where(PlaytimeSeries.appid.in_(list(appids)))
+    return {
+        appid: decode_points(first_at, first_minutes, data or b"")
+        for appid, first_at, first_minutes, data in s.execute(query)
+    }
+
+
+def value_at(points: List[Point], at: datetime) -> Optional[int]:
+    """playtime_forever as of ``at``; None before the first sample."""
+    value = None
+    for sampled_at, minutes in points:
+        if sampled_at > at:
+            break
+        value = minutes
+    return value
+
+
+def played_between(points: List[Point], since: datetime, until: datetime) -> int:
+    # playtime from before a game was first synced is not attributed to the window
+    start = value_at(points, since)
+    if start is None:
+        start = points[0][1]
+    end = value_at(points, until)
+    return max(0, end - start) if end is not None else 0
+
+
+def minutes_played(
+    s: Session, user_id: int, since: datetime, until: Optional[datetime] = None
+) -> Dict[int, int]:
+    """Minutes played per appid in [since, until]; games without play are left out."""
+    until = until or datetime.utcnow()
+    played = {}
+    for appid, points in load_points(s, user_id, since).items():
+        minutes = played_between(points, since, until)
+        if minutes:
+            played[appid] = minutes
+    return played
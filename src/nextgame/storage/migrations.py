@@ -0,0 +1,236 @@
+"""Idempotent upgrades for databases created by an older ``create_all``.
+
+``create_all`` only adds missing tables; new columns and indexes on existing
+tables, and backfills of derived tables, are applied here by ``nextgame migrate``.
+"""
+from __future__ import annotations
+import logging
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import Column, Table, delete, func, insert, inspect, select, text, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .db import (
+    DB, CoOwnership, GameStats, LibraryRanking, Ownership, OwnershipDelta, PlaytimeSeries, Snapshot, SyncJob, SyncState,
+    User,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _column_ddl(conn: Connection, column: Column) -> str:
+    ddl = f"{column.name} {column.type.compile(dialect=conn.dialect)}"
+    if not column.nullable:
+        default = column.default.arg if column.default is not None else None
+        ddl += f" NOT NULL DEFAULT {default!r}" if default is not None else " NOT NULL"
+    return ddl
+
+
+def _add_missing_columns(conn: Connection, table: Table) -> bool:
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing]
+    for column in missing:
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(conn, column)}"))
+    return bool(missing)
+
+
+def snapshot_delta_columns(conn: Connection) -> bool:
+    """Compressed-delta columns on snapshots, with the legacy JSON payload made nullable."""
+    if not _add_missing_columns(conn, Snapshot.__table__):
+        return False
+    if conn.dialect.name == "mysql":
+        conn.execute(text("ALTER TABLE snapshots MODIFY payload JSON NULL"))
+    elif conn.dialect.name == "sqlite":
+        # sqlite cannot drop NOT NULL in place, so copy into a freshly created table
+        columns = ", ".join(c.name for c in Snapshot.__table__.columns)
+        conn.execute(text("ALTER TABLE snapshots RENAME TO snapshots_old"))
+        for index in inspect(conn).get_indexes("snapshots_old"):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        Snapshot.__table__.create(conn)
+        conn.execute(text(f"INSERT INTO snapshots ({columns}) SELECT {columns} FROM snapshots_old"))
+        conn.execute(text("DROP TABLE snapshots_old"))
+    return True
+
+
+def snapshot_latest_index(conn: Connection) -> bool:
+    existing = {ix["name"] for ix in inspect(conn).get_indexes("snapshots")}
+    created = False
+    for index in Snapshot.__table__.indexes:
+        if index.name not in existing:
+            index.create(conn)
+            created = True
+    return created
+
+
+def sync_state_content_hash(conn: Connection) -> bool:
+    return _add_missing_columns(conn, SyncState.__table__)
+
+
+def backfill_sync_state(conn: Connection) -> bool:
+    """Seed sync_state from the newest snapshot of every user and kind."""
+    if conn.scalar(select(func.count()).select_from(SyncState)):
+        return False
+    latest = select(func.max(Snapshot.id)).group_by(Snapshot.user_id, Snapshot.kind)
+    result = conn.execute(
+        insert(SyncState).from_select(
+            ["user_id", "kind", "etag", "last_modified", "synced_at"],
+            select(Snapshot.user_id, Snapshot.kind, Snapshot.etag, Snapshot.last_modified, Snapshot.created_at)
+            .where(Snapshot.id.in_(latest)),
+        )
+    )
+    return bool(result.rowcount)
+
+
+def backfill_library_rankings(conn: Connection) -> bool:
+    """Build the top-games projection for users synced before it existed."""
+    from ..recommend.rankings import refresh_ranking
+
+    missing = select(Ownership.user_id).distinct().where(
+        Ownership.user_id.not_in(select(LibraryRanking.user_id))
+    )
+    user_ids = list(conn.scalars(missing))
+    with Session(bind=conn) as s:
+        for user_id in user_ids:
+            refresh_ranking(s, user_id)
+        # the session joins the step's transaction, so this commits nothing on its own
+        s.commit()
+    return bool(user_ids)
+
+
+def backfill_playtime_history(conn: Connection) -> bool:
+    """Seed playtime_series from the unpruned delta log, or the current playtime where there is none."""
+    from .history import series_row
+
+    if conn.scalar(select(func.count()).select_from(PlaytimeSeries)):
+        return False
+    user_ids = list(conn.scalars(select(Ownership.user_id).distinct()))
+    for user_id in user_ids:
+        points: Dict[int, list] = {}
+        for appid, minutes, at in conn.execute(
+            select(OwnershipDelta.appid, OwnershipDelta.new_playtime_forever, OwnershipDelta.created_at)
+            .where(OwnershipDelta.user_id == user_id, OwnershipDelta.change != "removed")
+            .order_by(OwnershipDelta.id)
+        ):
+            points.setdefault(appid, []).append((at, minutes))
+        for appid, minutes, at in conn.execute(
+            select(Ownership.appid, Ownership.playtime_forever, Ownership.last_updated)
+            .where(Ownership.user_id == user_id)
+        ):
+            points.setdefault(appid, [(at, minutes)])
+        rows = [series_row(user_id, appid, series) for appid, series in points.items()]
+        if rows:
+            conn.execute(insert(PlaytimeSeries), rows)
+    return bool(user_ids)
+
+
+def ownership_delta_folded(conn: Connection) -> bool:
+    """Per-delta folded flag replacing the id cursor; aggregates folded through the cursor are dropped for reseeding."""
+    if not _add_missing_columns(conn, OwnershipDelta.__table__):
+        return False
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(OwnershipDelta.__tablename__)}
+    for index in OwnershipDelta.__table__.indexes:
+        if index.name not in existing:
+            index.create(conn)
+    # they only counted changes logged since the deltas table existed
+    conn.execute(delete(GameStats))
+    conn.execute(delete(CoOwnership))
+    return True
+
+
+def seed_ownership_aggregates(conn: Connection) -> bool:
+    """Build game_stats/co_ownership from the current ownerships and mark every logged delta folded.
+
+    Deltas only record changes, so games owned before the log existed are
+    counted here. Run it with syncs stopped: a delta committed while it runs
+    could be counted twice.
+    """
+    if conn.scalar(select(func.count()).select_from(GameStats)):
+        return False
+    if not conn.scalar(select(func.count()).select_from(Ownership)):
+        return False
+    conn.execute(update(OwnershipDelta).where(OwnershipDelta.folded.is_(False)).values(folded=True))
+    conn.execute(
+        insert(GameStats).from_select(
+            ["appid", "owners", "total_playtime", "recent_playtime"],
+            select(
+                Ownership.appid, func.count(), func.sum(Ownership.playtime_forever), func.sum(Ownership.playtime_2weeks)
+            ).group_by(Ownership.appid),
+        )
+    )
+    a = Ownership.__table__.alias("a")
+    b = Ownership.__table__.alias("b")
+    conn.execute(
+        insert(CoOwnership).from_select(
+            ["appid_a", "appid_b", "owners"],
+            select(a.c.appid, b.c.appid, func.count())
+            .join(b, (b.c.user_id == a.c.user_id) & (a.c.appid < b.c.appid))
+            .group_by(a.c.appid, b.c.appid),
+        )
+    )
+    return True
+
+
+def sync_job_last_synced(conn: Connection) -> bool:
+    """Order the queue by each user's last sync time instead of the staleness priority frozen at enqueue."""
+    if "priority" not in {c["name"] for c in inspect(conn).get_columns(SyncJob.__tablename__)}:
+        return False
+    _add_missing_columns(conn, SyncJob.__table__)
+    # the claim index covers priority, so it has to go before the column can be dropped
+    if conn.dialect.name == "mysql":
+        conn.execute(text("DROP INDEX ix_sync_jobs_claim ON sync_jobs"))
+    else:
+        conn.execute(text("DROP INDEX ix_sync_jobs_claim"))
+    conn.execute(text("ALTER TABLE sync_jobs DROP COLUMN priority"))
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(SyncJob.__tablename__)}
+    for index in SyncJob.__table__.indexes:
+        if index.name not in existing:
+            index.create(conn)
+    conn.execute(
+        update(SyncJob)
+        .where(SyncJob.status == "queued")
+        .values(
+            last_synced_at=select(SyncState.synced_at)
+            .join(User, User.id == SyncState.user_id)
+            .where(User.steamid == SyncJob.steamid, SyncState.kind == "owned_games")
+            .scalar_subquery()
+        )
+    )
+    return True
+
+
+def sync_job_heartbeat(conn: Connection) -> bool:
+    """Worker heartbeats on sync jobs; jobs already running count from their start."""
+    added = _add_missing_columns(conn, SyncJob.__table__)
+    backfilled = conn.execute(
+        update(SyncJob)
+        .where(SyncJob.status == "running", SyncJob.heartbeat_at.is_(None))
+        .values(heartbeat_at=SyncJob.started_at)
+    ).rowcount
+    return added or bool(backfilled)
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], bool]]] = [
+    ("snapshot_delta_columns", snapshot_delta_columns),
+    ("snapshot_latest_index", snapshot_latest_index),
+    ("sync_state_content_hash", sync_state_content_hash),
+    ("backfill_sync_state", backfill_sync_state),
+    ("backfill_library_rankings", backfill_library_rankings),
+    ("backfill_playtime_history", backfill_playtime_history),
+    ("ownership_delta_folded", ownership_delta_folded),
+    ("seed_ownership_aggregates", seed_ownership_aggregates),
+    ("sync_job_last_synced", sync_job_last_synced),
+    ("sync_job_heartbeat", sync_job_heartbeat),
+]
+
+
+def migrate(db: DB) -> List[str]:
+    """Create missing tables, then run every step that still has work to do; returns the steps applied."""
+    db.create_all()
+    applied = []
+    for name, step in MIGRATIONS:
+        with db.engine.begin() as conn:
+            if step(conn):
+                applied.append(name)
+                logger.info("Applied migration %s", name)
+    return applied
@@ -0,0 +1,226 @@
+from __future__ import annotations
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+if TYPE_CHECKING:
+    from ..config import Settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIX = "nextgame:read:"
+PENDING_KEY = "read_cache_invalidate"
+
+
+def _discard_pending(s: Session):
+    s.info[PENDING_KEY].clear()
+
+
+@dataclass
+class CachedBody:
+    etag: str
+    body: bytes
+
+    @classmethod
+    def for_body(cls, body: bytes) -> "CachedBody":
+        return cls(etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', body=body)
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags
+
+
+class MemoryBackend:
+    """TTL LRU of steamid -> {field: body}; invalidating a user drops every variant at once."""
+
+    blocking = False
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, bytes]]]" = OrderedDict()
+
+    def get(self, steamid: str, field: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(steamid)
+            if entry is None:
+                return None
+            expires, fields = entry
+            if expires < time.monotonic():
+                del self._entries[steamid]
+                return None
+            self._entries.move_to_end(steamid)
+            return fields.get(field)
+
+    def set(self, steamid: str, field: str, value: bytes, ttl: float):
+        with self._lock:
+            entry = self._entries.get(steamid)
+            if entry is None or entry[0] < time.monotonic():
+                entry = self._entries[steamid] = (time.monotonic() + ttl, {})
+            entry[1][field] = value
+            self._entries.move_to_end(steamid)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, steamid: str):
+        with self._lock:
+            self._entries.pop(steamid, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """One Redis hash per user, so invalidation is a single DEL shared by every process."""
+
+    # every call is a network round trip; async callers must not make it on the event loop
+    blocking = True
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as exc:  # pragma: no cover - optional dependency
+            raise RuntimeError("READ_CACHE_BACKEND=redis needs the redis package installed") from exc
+        self.client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
+    def get(self, steamid: str, field: str) -> Optional[bytes]:
+        return self.client.hget(REDIS_PREFIX + steamid, field)
+
+    def set(self, steamid: str, field: str, value: bytes, ttl: float):
+        key = REDIS_PREFIX + steamid
+        pipe = self.client.pipeline()
+        pipe.hset(key, field, value)
+        pipe.expire(key, max(1, int(ttl)))
+        pipe.execute()
+
+    def delete(self, steamid: str):
+        self.client.delete(REDIS_PREFIX + steamid)
+
+
+class ReadCache:
+    """Read-through cache of serialized API responses, keyed by steamid and response variant.
+
+    Backend errors are logged and treated as misses so a Redis outage only costs DB reads.
+    """
+
+    def __init__(self, backend=None, ttl: float = 60.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @property
+    def blocking(self) -> bool:
+        return getattr(self.backend, "blocking", False)
+
+    @classmethod
+    def from_settings(cls, settings: "Settings") -> "ReadCache":
+        if settings.read_cache_backend == "redis":
+            backend = RedisBackend(settings.redis_url)
+        elif settings.read_cache_backend == "memory":
+            backend = MemoryBackend(settings.read_cache_size)
+        else:
+            backend = None
+        return cls(backend, ttl=settings.read_cache_ttl)
+
+    def get(self, steamid: str, field: str) -> Optional[CachedBody]:
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(steamid, field)
+        except Exception:
+            self.errors += 1
+            logger.warning("Read cache get failed", exc_info=True)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, _, body = value.partition(b"\n")
+        return CachedBody(etag=etag.decode(), body=body)
+
+    def generation(self) -> int:
+        """Token to pass to put(); taken before the DB read it caches."""
+        return self.invalidations
+
+    def put(self, steamid: str, field: str, body: bytes, generation: Optional[int] = None) -> CachedBody:
+        cached = CachedBody.for_body(body)
+        # an invalidation landed while the caller was reading, so its rows may predate the sync
+        stale = generation is not None and generation != self.invalidations
+        if self.backend is not None and not stale:
+            try:
+                self.backend.set(steamid, field, cached.etag.encode() + b"\n" + body, self.ttl)
+            except Exception:
+                self.errors += 1
+                logger.warning("Read cache set failed", exc_info=True)
+        return cached
+
+    def invalidate(self, steamid: str):
+        if self.backend is None:
+            return
+        self.invalidations += 1
+        try:
+            self.backend.delete(steamid)
+        except Exception:
+            self.errors += 1
+            logger.warning("Read cache invalidation for %s failed", steamid, exc_info=True)
+
+    def invalidate_after_commit(self, s: Session, steamid: str):
+        """Drop steamid once ``s`` commits, so a concurrent read cannot re-cache the old rows."""
+        if self.backend is None:
+            return
+        if PENDING_KEY not in s.info:
+            s.info[PENDING_KEY] = set()
+            event.listen(s, "after_commit", self._flush_pending)
+            event.listen(s, "after_rollback", _discard_pending)
+        s.info[PENDING_KEY].add(steamid)
+
+    def _flush_pending(self, s: Session):
+        pending = s.info[PENDING_KEY]
+        for steamid in pending:
+            self.invalidate(steamid)
+        pending.clear()
+
+    def stats(self) -> dict:
+        entries: Optional[int] = 0
+        if self.backend is not None:
+            # counting Redis keys takes a SCAN of the shared keyspace, so only local backends report a size
+            entries = len(self.backend) if hasattr(self.backend, "__len__") else None
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+
+_shared: Optional[ReadCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_read_cache(settings: Optional["Settings"] = None) -> ReadCache:
+    """The process-wide cache, built from ``settings`` (or the environment's) on first use.
+
+    Every process that syncs must share the API's backend, or its
+    invalidations never reach the entries the API serves.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            from ..config import get_settings
+
+            _shared = ReadCache.from_settings(settings or get_settings())
+        return _shared
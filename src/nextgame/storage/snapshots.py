@@ -0,0 +1,348 @@
+from __future__ import annotations
+import difflib
+import json
+import logging
+import re
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from .. import fastjson
+from .db import DB, Snapshot, SyncState
+from .upsert import upsert_rows
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+if TYPE_CHECKING:
+    from ..config import Settings
+
+logger = logging.getLogger(__name__)
+
+# every Nth snapshot of a (user, kind) is stored whole so a read never walks a long chain
+KEYFRAME_INTERVAL = 32
+# small payloads (profiles, recommendations) compress fine on their own
+MIN_DELTA_BYTES = 4096
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+# split after each "}," / "]," so list elements (games, players) become diff tokens
+_TOKEN_END = re.compile(rb"(?<=[}\]],)")
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def dumps(payload) -> bytes:
+    # json round-trips dict order, ints and floats exactly, which is what reconstruction relies on
+    return fastjson.dumps(payload)
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("snapshot was written with zstd; install the zstandard package to read it")
+
+
+def _zlib_diff(base: bytes, raw: bytes) -> bytes:
+    a = _TOKEN_END.split(base)
+    b = _TOKEN_END.split(raw)
+    offsets = [0]
+    for token in a:
+        offsets.append(offsets[-1] + len(token))
+    ops: List[int] = []
+    literals: List[bytes] = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops += [offsets[i1], offsets[i2]]
+        elif j2 > j1:
+            literal = b"".join(b[j1:j2])
+            ops += [-1, len(literal)]
+            literals.append(literal)
+    return json.dumps(ops, separators=(",", ":")).encode() + b"\n" + b"".join(literals)
+
+
+def _zlib_patch(base: bytes, delta: bytes) -> bytes:
+    header, _, literals = delta.partition(b"\n")
+    ops = json.loads(header)
+    out: List[bytes] = []
+    pos = 0
+    for start, end in zip(ops[::2], ops[1::2]):
+        if start < 0:
+            out.append(literals[pos:pos + end])
+            pos += end
+        else:
+            out.append(base[start:end])
+    return b"".join(out)
+
+
+def compress(codec: str, raw: bytes, base: Optional[bytes] = None) -> bytes:
+    if codec == "zstd":
+        _require_zstd()
+        if base is None:
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+        # the previous payload as a raw-content dictionary turns unchanged runs into back-references
+        dictionary = zstandard.ZstdCompressionDict(base, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary).compress(raw)
+    if codec == "zlib":
+        return zlib.compress(raw if base is None else _zlib_diff(base, raw), ZLIB_LEVEL)
+    raise ValueError(f"unknown snapshot codec {codec!r}")
+
+
+def decompress(codec: str, data: bytes, base: Optional[bytes] = None) -> bytes:
+    if codec == "zstd":
+        _require_zstd()
+        if base is None:
+            return zstandard.ZstdDecompressor().decompress(data)
+        dictionary = zstandard.ZstdCompressionDict(base, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data)
+    if codec == "zlib":
+        raw = zlib.decompress(data)
+        return raw if base is None else _zlib_patch(base, raw)
+    raise ValueError(f"unknown snapshot codec {codec!r}")
+
+
+def _latest(s: Session, user_id: int, kind: str) -> Optional[Snapshot]:
+    return s.scalars(
+        select(Snapshot)
+        .where(Snapshot.user_id == user_id, Snapshot.kind == kind)
+        .order_by(Snapshot.id.desc())
+        .limit(1)
+    ).first()
+
+
+def load_raw(s: Session, snap: Snapshot) -> bytes:
+    """Serialized payload of ``snap``, replaying its delta chain from the keyframe."""
+    if snap.data is None:
+        return dumps(snap.payload)
+    chain = {snap.id: snap}
+    if snap.base_id is not None:
+        lower = snap.keyframe_id if snap.keyframe_id is not None else snap.base_id
+        for row in s.scalars(
+            select(Snapshot).where(
+                Snapshot.user_id == snap.user_id,
+                Snapshot.kind == snap.kind,
+                Snapshot.id >= lower,
+                Snapshot.id < snap.id,
+            )
+        ):
+            chain[row.id] = row
+
+    path = [snap]
+    while path[-1].base_id is not None:
+        base_id = path[-1].base_id
+        base = chain.get(base_id) or s.get(Snapshot, base_id)
+        if base is None:
+            raise RuntimeError(f"snapshot {snap.id} depends on missing snapshot {base_id}")
+        path.append(base)
+        if base.data is None:
+            break
+
+    raw: Optional[bytes] = None
+    for row in reversed(path):
+        raw = dumps(row.payload) if row.data is None else decompress(row.codec, row.data, raw)
+    return raw
+
+
+def load_payload(s: Session, snap: Snapshot):
+    return fastjson.loads(load_raw(s, snap))
+
+
+def snapshot_row(
+    s: Session,
+    user_id: int,
+    kind: str,
+    payload,
+    *,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    codec: Optional[str] = None,
+) -> dict:
+    """Column values for a new snapshot, delta-encoded against the previous one of the same kind."""
+    codec = codec or default_codec()
+    raw = dumps(payload)
+    row = {
+        "user_id": user_id,
+        "kind": kind,
+        "etag": etag,
+        "last_modified": last_modified,
+        "codec": codec,
+        "raw_size": len(raw),
+        "created_at": datetime.utcnow(),
+    }
+    previous = _latest(s, user_id, kind) if len(raw) >= MIN_DELTA_BYTES else None
+    if previous is not None and previous.depth + 1 < KEYFRAME_INTERVAL:
+        base = load_raw(s, previous)
+        row.update(
+            base_id=previous.id,
+            keyframe_id=previous.keyframe_id if previous.base_id is not None else previous.id,
+            depth=previous.depth + 1,
+            data=compress(codec, raw, base),
+        )
+    else:
+        row.update(base_id=None, keyframe_id=None, depth=0, data=compress(codec, raw))
+    return row
+
+
+def record_sync_state(s: Session, rows: List[dict], content_hash: Optional[str] = None):
+    upsert_rows(s, SyncState, [
+        {
+            "user_id": row["user_id"],
+            "kind": row["kind"],
+            "etag": row.get("etag"),
+            "last_modified": row.get("last_modified"),
+            "content_hash": content_hash,
+            "synced_at": row["created_at"],
+        }
+        for row in rows
+    ], ["user_id", "kind"], {
+        "etag": lambda new, t: new.etag,
+        "last_modified": lambda new, t: new.last_modified,
+        "content_hash": lambda new, t: new.content_hash,
+        "synced_at": lambda new, t: new.synced_at,
+    })
+
+
+def add_snapshot(
+    s: Session, user_id: int, kind: str, payload, *, content_hash: Optional[str] = None, **kwargs
+) -> Snapshot:
+    row = snapshot_row(s, user_id, kind, payload, **kwargs)
+    snap = Snapshot(**row)
+    s.add(snap)
+    record_sync_state(s, [row], content_hash)
+    return snap
+
+
+def add_snapshots(s: Session, rows: List[dict]):
+    """Bulk insert rows built by snapshot_row."""
+    if not rows:
+        return
+    s.execute(insert(Snapshot), rows)
+    record_sync_state(s, rows)
+
+
+@dataclass
+class SnapshotRetention:
+    """Keep every snapshot for ``keep_all``, the last one per day until ``keep_daily``,
+    then the last one per ISO week until ``max_age`` (forever when unset).
+    The newest snapshot of each user and kind is always kept."""
+
+    keep_all: timedelta = timedelta(days=7)
+    keep_daily: timedelta = timedelta(days=90)
+    max_age: Optional[timedelta] = None
+
+    @classmethod
+    def from_settings(cls, settings: "Settings") -> "SnapshotRetention":
+        return cls(
+            keep_all=timedelta(days=settings.snapshot_keep_all_days),
+            keep_daily=timedelta(days=settings.snapshot_keep_daily_days),
+            max_age=timedelta(days=settings.snapshot_max_age_days) if settings.snapshot_max_age_days else None,
+        )
+
+    def retained(self, rows: List[Tuple[int, datetime]], now: datetime) -> Set[int]:
+        keep = {rows[-1][0]} if rows else set()
+        buckets: Dict[tuple, int] = {}
+        for snap_id, created_at in rows:
+            age = now - created_at
+            if age < self.keep_all:
+                keep.add(snap_id)
+            elif self.max_age is not None and age >= self.max_age:
+                continue
+            elif age < self.keep_daily:
+                buckets[("day", created_at.date())] = snap_id
+            else:
+                buckets[("week",) + tuple(created_at.isocalendar()[:2])] = snap_id
+        return keep | set(buckets.values())
+
+
+def _rewrite_group(s: Session, rows: List[Snapshot], keep: Set[int], codec: str):
+    # decode with the stored encoding and re-encode kept rows against the previous kept row, in one pass
+    raws: Dict[int, bytes] = {}
+    previous: Optional[Snapshot] = None
+    previous_raw = b""
+    for row in rows:
+        if row.data is None:
+            raw = dumps(row.payload)
+        elif row.base_id is None:
+            raw = decompress(row.codec, row.data)
+            raws.clear()
+        else:
+            base = raws.get(row.base_id)
+            if base is None:
+                base = load_raw(s, s.get(Snapshot, row.base_id))
+            raw = decompress(row.codec, row.data, base)
+        raws[row.id] = raw
+        if row.id not in keep:
+            continue
+
+        if previous is not None and previous.depth + 1 < KEYFRAME_INTERVAL and len(raw) >= MIN_DELTA_BYTES:
+            row.data = compress(codec, raw, previous_raw)
+            row.keyframe_id = previous.keyframe_id if previous.base_id is not None else previous.id
+            row.base_id = previous.id
+            row.depth = previous.depth + 1
+        else:
+            row.data = compress(codec, raw)
+            row.base_id = row.keyframe_id = None
+            row.depth = 0
+        row.codec = codec
+        row.raw_size = len(raw)
+        row.payload = None
+        previous, previous_raw = row, raw
+
+
+def compact_snapshots(
+    db: DB,
+    retention: SnapshotRetention,
+    *,
+    now: Optional[datetime] = None,
+    dry_run: bool = False,
+) -> dict:
+    """Apply ``retention`` and re-encode what is left (including legacy JSON rows) as delta chains."""
+    now = now or datetime.utcnow()
+    codec = default_codec()
+    totals = {"groups": 0, "kept": 0, "deleted": 0, "rewritten": 0}
+    with db.session() as s:
+        groups = s.execute(select(Snapshot.user_id, Snapshot.kind).distinct()).all()
+
+    for user_id, kind in groups:
+        with db.session() as s:
+            meta = s.execute(
+                select(Snapshot.id, Snapshot.created_at, Snapshot.data.is_(None))
+                .where(Snapshot.user_id == user_id, Snapshot.kind == kind)
+                .order_by(Snapshot.id)
+            ).all()
+            keep = retention.retained([(i, c) for i, c, _ in meta], now)
+            doomed = [i for i, _, _ in meta if i not in keep]
+            legacy = any(is_legacy for _, _, is_legacy in meta)
+            totals["groups"] += 1
+            totals["kept"] += len(keep)
+            totals["deleted"] += len(doomed)
+            if dry_run or not (doomed or legacy):
+                continue
+
+            rows = list(s.scalars(
+                select(Snapshot)
+                .where(Snapshot.user_id == user_id, Snapshot.kind == kind, Snapshot.id <= meta[-1][0])
+                .order_by(Snapshot.id)
+            ))
+            _rewrite_group(s, rows, keep, codec)
+            s.flush()
+            s.execute(delete(Snapshot).where(Snapshot.id.in_(doomed)))
+            s.commit()
+            totals["rewritten"] += len(keep)
+    logger.info("Snapshot compaction: %s", totals)
+    return totals
+
+
+def snapshot_storage_stats(db: DB) -> dict:
+    with db.session() as s:
+        count, raw, stored = s.execute(
+            select(func.count(Snapshot.id), func.sum(Snapshot.raw_size), func.sum(func.length(Snapshot.data)))
+        ).one()
+    return {"snapshots": count, "raw_bytes": raw or 0, "stored_bytes": stored or 0}
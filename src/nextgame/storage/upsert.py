@@ -0,0 +1,207 @@
+from __future__ import annotations
+import hashlib
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .. import fastjson
+from .db import Game, Ownership, OwnershipDelta
+
+IN_CHUNK = 1000
+
+
+def chunks(seq: Sequence, size: int) -> Iterable[Sequence]:
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _normalize_games(games: List[dict]) -> Dict[int, Tuple[str | None, int, int]]:
+    rows: Dict[int, Tuple[str | None, int, int]] = {}
+    for g in games:
+        appid = int(g.get("appid"))
+        rows[appid] = (
+            g.get("name"),
+            int(g.get("playtime_forever", 0) or 0),
+            int(g.get("playtime_2weeks", 0) or 0),
+        )
+    return rows
+
+
+def games_content_hash(games: List[dict], complete: bool) -> str:
+    """Order-independent hash of the fields upsert_owned_games stores."""
+    rows = sorted(_normalize_games(games).items())
+    digest = hashlib.sha256(b"complete" if complete else b"partial")
+    digest.update(fastjson.canonical(rows))
+    return digest.hexdigest()
+
+
+def upsert_rows(s: Session, model, rows: List[dict], conflict_cols: List[str], update_cols: Dict[str, object]):
+    """Insert ``rows``, updating ``update_cols`` where ``conflict_cols`` already exist.
+
+    Each update_cols value is ``fn(new, table)`` returning the SET expression,
+    where ``new`` exposes the incoming row's columns.
+    """
+    if not rows:
+        return
+    dialect = s.get_bind().dialect.name
+    table = model.__table__
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        stmt = stmt.on_duplicate_key_update(
+            **{col: expr(stmt.inserted, table) for col, expr in update_cols.items()}
+        )
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_cols,
+            set_={col: expr(stmt.excluded, table) for col, expr in update_cols.items()},
+        )
+    else:
+        _upsert_generic(s, table, rows, conflict_cols, update_cols)
+        return
+    s.execute(stmt, rows)
+
+
+def _upsert_generic(s: Session, table, rows: List[dict], conflict_cols: List[str], update_cols: Dict[str, object]):
+    """Select the existing keys, then insert the new rows and update the rest; for dialects without an upsert."""
+    def key(row) -> tuple:
+        return tuple(row[col] for col in conflict_cols)
+
+    # the first key column narrows the lookup; the rest are compared here
+    first = table.c[conflict_cols[0]]
+    wanted = {key(row) for row in rows}
+    existing = set()
+    for chunk in chunks(list({k[0] for k in wanted}), IN_CHUNK):
+        for found in s.execute(select(*(table.c[col] for col in conflict_cols)).where(first.in_(chunk))):
+            if tuple(found) in wanted:
+                existing.add(tuple(found))
+
+    inserts: List[dict] = []
+    updates: List[dict] = []
+    for row in rows:
+        k = key(row)
+        if k in existing:
+            updates.append({**{f"new_{col}": value for col, value in row.items()},
+                            **{f"key_{col}": value for col, value in zip(conflict_cols, k)}})
+        else:
+            # a key repeated within rows updates the row inserted for it
+            existing.add(k)
+            inserts.append(row)
+    if inserts:
+        s.execute(insert(table), inserts)
+    if updates and update_cols:
+        # bind names must differ from the column names update() binds itself
+        new = SimpleNamespace(**{col.name: bindparam(f"new_{col.name}", type_=col.type) for col in table.c})
+        stmt = (
+            update(table)
+            .where(*(table.c[col] == bindparam(f"key_{col}") for col in conflict_cols))
+            .values({col: expr(new, table) for col, expr in update_cols.items()})
+        )
+        s.execute(stmt, updates)
+
+
+def upsert_owned_games(s: Session, user_id: int, games: List[dict], *, complete: bool = False) -> dict:
+    """Write new/changed games and ownerships, log each change as an OwnershipDelta and
+    append changed playtimes to the playtime history.
+
+    With ``complete=True`` the payload is treated as the whole library and
+    ownerships missing from it are removed.
+    """
+    incoming = _normalize_games(games)
+    summary = {
+        "games": len(games),
+        "upserted_games": 0,
+        "upserted_ownerships": 0,
+        "renamed_games": 0,
+        "changed_ownerships": 0,
+        "removed_ownerships": 0,
+    }
+    if not incoming and not complete:
+        return summary
+
+    appids = list(incoming)
+    known_names: Dict[int, str | None] = {}
+    for chunk in chunks(appids, IN_CHUNK):
+        for appid, name in s.execute(select(Game.appid, Game.name).where(Game.appid.in_(chunk))):
+            known_names[appid] = name
+
+    known_owns: Dict[int, Tuple[int, int]] = {
+        appid: (pf, p2w)
+        for appid, pf, p2w in s.execute(
+            select(Ownership.appid, Ownership.playtime_forever, Ownership.playtime_2weeks)
+            .where(Ownership.user_id == user_id)
+        )
+    }
+
+    now = datetime.utcnow()
+    game_rows: List[dict] = []
+    own_rows: List[dict] = []
+    delta_rows: List[dict] = []
+    for appid, (name, pf, p2w) in incoming.items():
+        if appid not in known_names:
+            game_rows.append({"appid": appid, "name": name, "last_updated": now})
+            summary["upserted_games"] += 1
+        elif name and known_names[appid] != name:
+            game_rows.append({"appid": appid, "name": name, "last_updated": now})
+            summary["renamed_games"] += 1
+
+        previous = known_owns.get(appid)
+        if previous is None:
+            summary["upserted_ownerships"] += 1
+            change, previous = "added", (0, 0)
+        elif previous == (pf, p2w):
+            continue
+        else:
+            summary["changed_ownerships"] += 1
+            change = "changed"
+        own_rows.append({
+            "user_id": user_id,
+            "appid": appid,
+            "playtime_forever": pf,
+            "playtime_2weeks": p2w,
+            "last_updated": now,
+        })
+        delta_rows.append(_delta(user_id, appid, change, previous, (pf, p2w), now))
+
+    removed = [appid for appid in known_owns if appid not in incoming] if complete else []
+    for appid in removed:
+        delta_rows.append(_delta(user_id, appid, "removed", known_owns[appid], (0, 0), now))
+    summary["removed_ownerships"] = len(removed)
+
+    # keep a known name when Steam omits it on a concurrent insert
+    upsert_rows(s, Game, game_rows, ["appid"], {
+        "name": lambda new, t: func.coalesce(new.name, t.c.name),
+        "last_updated": lambda new, t: new.last_updated,
+    })
+    upsert_rows(s, Ownership, own_rows, ["user_id", "appid"], {
+        "playtime_forever": lambda new, t: new.playtime_forever,
+        "playtime_2weeks": lambda new, t: new.playtime_2weeks,
+        "last_updated": lambda new, t: new.last_updated,
+    })
+    for chunk in chunks(removed, IN_CHUNK):
+        s.execute(delete(Ownership).where(Ownership.user_id == user_id, Ownership.appid.in_(chunk)))
+    if delta_rows:
+        s.execute(insert(OwnershipDelta), delta_rows)
+        from .history import append_samples
+
+        append_samples(s, user_id, (
+            (d["appid"], d["new_playtime_forever"]) for d in delta_rows if d["change"] != "removed"
+        ), now)
+    return summary
+
+
+def _delta(user_id: int, appid: int, change: str, old: Tuple[int, int], new: Tuple[int, int], now: datetime) -> dict:
+    return {
+        "user_id": user_id,
+        "appid": appid,
+        "change": change,
+        "old_playtime_forever": old[0],
+        "new_playtime_forever": new[0],
+        "old_playtime_2weeks": old[1],
+        "new_playtime_2weeks": new[1],
+        "created_at": now,
+    }
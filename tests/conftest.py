@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from nextgame.storage.db import DB  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DB(f"sqlite:///{tmp_path / 'nextgame.db'}")
+    db.create_all()
+    yield db
+    db.dispose()
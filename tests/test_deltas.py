@@ -0,0 +1,121 @@
+from collections import Counter
+from itertools import combinations
+
+from sqlalchemy import select
+
+from nextgame.storage.db import CoOwnership, GameStats, Ownership, OwnershipDelta, User
+from nextgame.storage.deltas import _library_at, compact_deltas
+from nextgame.storage.upsert import upsert_owned_games
+
+
+def add_user(db, steamid):
+    with db.session() as s:
+        user = User(steamid=steamid)
+        s.add(user)
+        s.commit()
+        return user.id
+
+
+def sync(db, user_id, library):
+    """Replace the user's library with ``library``: {appid: playtime_forever}."""
+    games = [{"appid": appid, "name": f"Game {appid}", "playtime_forever": pf} for appid, pf in library.items()]
+    with db.session() as s:
+        upsert_owned_games(s, user_id, games, complete=True)
+        s.commit()
+
+
+def aggregates(db):
+    with db.session() as s:
+        stats = {
+            appid: (owners, total)
+            for appid, owners, total in s.execute(
+                select(GameStats.appid, GameStats.owners, GameStats.total_playtime)
+            )
+            if owners or total
+        }
+        pairs = {
+            (a, b): n
+            for a, b, n in s.execute(select(CoOwnership.appid_a, CoOwnership.appid_b, CoOwnership.owners))
+            if n
+        }
+    return stats, pairs
+
+
+def expected(db):
+    """The aggregates recomputed from scratch over the current ownerships."""
+    with db.session() as s:
+        libraries = {}
+        for user_id, appid, pf in s.execute(select(Ownership.user_id, Ownership.appid, Ownership.playtime_forever)):
+            libraries.setdefault(user_id, {})[appid] = pf
+    owners, totals, pairs = Counter(), Counter(), Counter()
+    for library in libraries.values():
+        for appid, pf in library.items():
+            owners[appid] += 1
+            totals[appid] += pf
+        pairs.update(combinations(sorted(library), 2))
+    return {appid: (owners[appid], totals[appid]) for appid in owners}, dict(pairs)
+
+
+def test_fold_matches_recomputed_aggregates(db):
+    alice, bob = add_user(db, "alice"), add_user(db, "bob")
+    sync(db, alice, {1: 10, 2: 20, 3: 30})
+    sync(db, bob, {2: 5, 3: 0})
+    compact_deltas(db)
+    assert aggregates(db) == expected(db)
+    assert aggregates(db)[1] == {(1, 2): 1, (1, 3): 1, (2, 3): 2}
+
+    sync(db, alice, {2: 25, 3: 30, 4: 1})
+    sync(db, bob, {3: 7, 4: 2, 5: 0})
+    compact_deltas(db)
+    assert aggregates(db) == expected(db)
+
+
+def test_add_then_remove_in_one_batch_cancels_out(db):
+    alice, bob = add_user(db, "alice"), add_user(db, "bob")
+    sync(db, alice, {1: 0, 2: 0})
+    sync(db, bob, {1: 0})
+    compact_deltas(db)
+    sync(db, alice, {1: 0, 2: 0, 3: 0})
+    sync(db, bob, {1: 0, 3: 0})
+    sync(db, alice, {1: 0, 2: 0})
+    compact_deltas(db, batch=100)
+    assert aggregates(db) == expected(db)
+    assert aggregates(db)[1] == {(1, 2): 1, (1, 3): 1}
+
+
+def test_small_batches_fold_like_one(db):
+    alice = add_user(db, "alice")
+    for library in ({1: 0, 2: 0}, {2: 0, 3: 0}, {1: 0, 3: 0, 4: 0}, {4: 0}):
+        sync(db, alice, library)
+    result = compact_deltas(db, batch=1)
+    assert result["deltas"] == 9
+    assert aggregates(db) == expected(db)
+
+
+def test_library_at_undoes_later_deltas(db):
+    alice = add_user(db, "alice")
+    history = [{1: 0, 2: 0}, {2: 0, 3: 0}, {3: 0, 4: 0, 5: 0}]
+    marks = []
+    for library in history:
+        sync(db, alice, library)
+        with db.session() as s:
+            marks.append(s.scalar(select(OwnershipDelta.id).order_by(OwnershipDelta.id.desc()).limit(1)))
+    with db.session() as s:
+        for library, upto_id in zip(history, marks):
+            assert _library_at(s, alice, upto_id) == set(library)
+        assert _library_at(s, alice, 0) == set()
+
+
+def test_prune_deletes_only_folded_deltas(db):
+    alice = add_user(db, "alice")
+    sync(db, alice, {1: 0, 2: 0})
+    assert compact_deltas(db, prune=False)["pruned"] == 0
+    with db.session() as s:
+        assert s.scalars(select(OwnershipDelta.folded)).all() == [True, True]
+
+    sync(db, alice, {1: 0})
+    result = compact_deltas(db)
+    assert (result["deltas"], result["pruned"]) == (1, 3)
+    with db.session() as s:
+        assert s.scalars(select(OwnershipDelta.id)).all() == []
+    assert aggregates(db) == expected(db)
@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from nextgame.recommend.names import NameIndex, build_name_index, resolve_appids  # noqa: E402
+from nextgame.storage.db import DB, Game  # noqa: E402
+
+CATALOG = {
+    400: "Portal",
+    620: "Portal 2",
+    570: "Dota 2",
+    1091500: "Cyberpunk 2077",
+    292030: "The Witcher® 3: Wild Hunt",
+    20900: "The Witcher: Enhanced Edition",
+}
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("names")
+    db = DB(f"sqlite:///{tmp / 'catalog.db'}")
+    db.create_all()
+    with db.session() as s:
+        s.add_all(Game(appid=appid, name=name) for appid, name in CATALOG.items())
+        s.commit()
+    build_name_index(db, str(tmp / "index"))
+    db.dispose()
+    return NameIndex(str(tmp / "index"))
+
+
+def test_resolve(index):
+    assert index.resolve("portal 2") == 620
+    assert index.resolve("Cyberpunk") == 1091500
+    assert index.resolve("Cyberpunk 2O77") == 1091500
+    assert index.resolve("Half-Life") is None
+
+
+def test_keeps_matching_appid(index):
+    items = [
+        {"appid": 620, "title": "Portal 2"},
+        {"appid": 292030, "title": "The Witcher 3: Wild Hunt"},
+        {"appid": 1091500, "title": "Cyberpunk"},
+    ]
+    assert resolve_appids(items, index) == 0
+    assert [it["appid"] for it in items] == [620, 292030, 1091500]
+
+
+def test_corrects_mismatched_unknown_or_missing_appid(index):
+    items = [
+        {"appid": 620, "title": "Portal"},
+        {"appid": 999999, "title": "Dota 2"},
+        {"title": "Cyberpunk 2077"},
+        {"appid": 570, "title": "Cyberpunk 2077"},
+    ]
+    assert resolve_appids(items, index) == 4
+    assert [it["appid"] for it in items] == [400, 570, 1091500, 1091500]
+
+
+def test_ambiguous_prefix_keeps_given_appid(index):
+    # "the witcher" starts two catalog names, so it cannot be resolved by name
+    assert index.resolve("The Witcher") is None
+    items = [{"appid": 20900, "title": "The Witcher"}, {"appid": 42, "title": "The Witcher"}]
+    assert resolve_appids(items, index) == 0
+    assert [it["appid"] for it in items] == [20900, 42]
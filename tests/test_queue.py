@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+from nextgame.jobs.queue import (
+    claim_next, enqueue_sync, finish_job, get_job, requeue_stale_running, touch_job,
+)
+from nextgame.storage.db import SyncJob, SyncState, User
+
+
+def synced(db, steamid, ago):
+    with db.session() as s:
+        user = User(steamid=steamid)
+        s.add(user)
+        s.flush()
+        s.add(SyncState(user_id=user.id, kind="owned_games", synced_at=datetime.utcnow() - ago))
+        s.commit()
+
+
+def test_enqueue_dedupes_active_jobs(db):
+    job, created = enqueue_sync(db, "1")
+    again, created_again = enqueue_sync(db, "1")
+    assert created and not created_again
+    assert again.id == job.id
+
+    claimed = claim_next(db, "w")
+    assert enqueue_sync(db, "1")[0].id == job.id
+    assert finish_job(db, claimed.id, "w", result={})
+    follow_up, created = enqueue_sync(db, "1")
+    assert created and follow_up.id != job.id
+
+
+def test_claim_never_synced_then_stalest_first(db):
+    synced(db, "recent", timedelta(hours=1))
+    synced(db, "stale", timedelta(days=3))
+    for steamid in ("recent", "stale", "new"):
+        enqueue_sync(db, steamid)
+    order = [claim_next(db, "w").steamid for _ in range(3)]
+    assert order == ["new", "stale", "recent"]
+    assert claim_next(db, "w") is None
+
+
+def test_claim_is_exclusive(db):
+    enqueue_sync(db, "1")
+    job = claim_next(db, "a")
+    assert (job.status, job.worker, job.attempts) == ("running", "a", 1)
+    assert job.heartbeat_at is not None
+    assert claim_next(db, "b") is None
+
+
+def test_finish_requires_owning_worker(db):
+    enqueue_sync(db, "1")
+    job = claim_next(db, "a")
+    assert not finish_job(db, job.id, "b", error="boom")
+    assert finish_job(db, job.id, "a", result={"ok": True})
+    assert get_job(db, job.id).status == "done"
+    assert not finish_job(db, job.id, "a", result={})
+
+
+def test_requeue_only_stale_heartbeats(db):
+    enqueue_sync(db, "live")
+    enqueue_sync(db, "dead")
+    live = claim_next(db, "a")
+    dead = claim_next(db, "b")
+    with db.session() as s:
+        s.get(SyncJob, dead.id).heartbeat_at = datetime.utcnow() - timedelta(minutes=10)
+        s.get(SyncJob, live.id).started_at = datetime.utcnow() - timedelta(hours=1)
+        s.commit()
+    assert touch_job(db, live.id, "a")
+
+    assert requeue_stale_running(db, timedelta(minutes=2)) == 1
+    assert get_job(db, live.id).status == "running"
+    assert get_job(db, dead.id).status == "queued"
+    # the dead worker lost the job and cannot finish or touch it any more
+    assert not touch_job(db, dead.id, "b")
+    assert not finish_job(db, dead.id, "b", result={})
+    assert claim_next(db, "c").id == dead.id
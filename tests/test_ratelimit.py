@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from nextgame.steam.ratelimit import RateLimiter, SQLiteRateLimiter
+
+
+class FakeClockLimiter(RateLimiter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.now = 0.0
+
+    def _clock(self) -> float:
+        return self.now
+
+
+def reserve(limiter) -> float:
+    """Release time (on the fake clock) of a token reserved now."""
+    return limiter.now + limiter._with_state(limiter._reserve)
+
+
+def test_burst_then_rate():
+    limiter = FakeClockLimiter(rate=2.0, burst=3.0)
+    releases = [reserve(limiter) for _ in range(5)]
+    assert releases == pytest.approx([0.0, 0.0, 0.0, 0.5, 1.0])
+
+
+def test_block_spaces_callers_after_retry_after():
+    limiter = FakeClockLimiter(rate=5.0, burst=5.0)
+    delay = asyncio.run(limiter.record_response(429, "60"))
+    assert delay == 60.0
+
+    releases = []
+    for i in range(100):
+        limiter.now = i * 0.1
+        releases.append(reserve(limiter))
+
+    assert min(releases) >= 60.0
+    gaps = [b - a for a, b in zip(releases, releases[1:])]
+    assert min(gaps) == pytest.approx(1 / limiter.rate)
+
+
+def test_block_does_not_refill_burst():
+    limiter = FakeClockLimiter(rate=1.0, burst=10.0)
+    asyncio.run(limiter.record_response(503, "5"))
+    limiter.now = 4.0
+    assert [reserve(limiter) for _ in range(3)] == pytest.approx([6.0, 7.0, 8.0])
+
+
+def test_success_resets_failures():
+    limiter = FakeClockLimiter(backoff_base=1.0)
+    asyncio.run(limiter.record_response(500))
+    asyncio.run(limiter.record_response(500))
+    assert limiter._failures == 2
+    assert asyncio.run(limiter.record_response(200)) == 0.0
+    assert limiter._failures == 0
+
+
+def test_sqlite_limiter_shares_block(tmp_path):
+    path = str(tmp_path / "limiter.db")
+    first = SQLiteRateLimiter(path, rate=5.0, burst=5.0)
+    second = SQLiteRateLimiter(path, rate=5.0, burst=5.0)
+    asyncio.run(first.record_response(429, "30"))
+    assert second._with_state(second._reserve) >= 29.0
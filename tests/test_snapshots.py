@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from nextgame.storage import snapshots
+from nextgame.storage.db import Snapshot, User
+from nextgame.storage.snapshots import SnapshotRetention, add_snapshot, compact_snapshots, load_payload
+
+NOW = datetime(2026, 6, 1, 12, 0)
+
+
+@pytest.fixture
+def user_id(db):
+    with db.session() as s:
+        user = User(steamid="1")
+        s.add(user)
+        s.commit()
+        return user.id
+
+
+def library(version, games=200):
+    """An owned_games payload above MIN_DELTA_BYTES whose playtimes change with ``version``."""
+    return {"response": {"game_count": games, "games": [
+        {"appid": appid, "playtime_forever": appid * 10 + (version if appid % 7 == 0 else 0)}
+        for appid in range(games)
+    ]}}
+
+
+def add(db, user_id, payload, created_at=None):
+    with db.session() as s:
+        snap = add_snapshot(s, user_id, "owned_games", payload)
+        if created_at is not None:
+            snap.created_at = created_at
+        s.commit()
+        return snap.id
+
+
+def rows(db, user_id):
+    with db.session() as s:
+        return list(s.scalars(select(Snapshot).where(Snapshot.user_id == user_id).order_by(Snapshot.id)))
+
+
+def test_delta_chain_replays_every_version(db, user_id, monkeypatch):
+    monkeypatch.setattr(snapshots, "KEYFRAME_INTERVAL", 4)
+    ids = [add(db, user_id, library(v)) for v in range(10)]
+    stored = rows(db, user_id)
+    assert [r.depth for r in stored] == [0, 1, 2, 3, 0, 1, 2, 3, 0, 1]
+    assert [r.keyframe_id for r in stored[:4]] == [None, ids[0], ids[0], ids[0]]
+    assert all(r.base_id == prev.id for prev, r in zip(stored, stored[1:]) if r.depth)
+    assert all(len(r.data) < len(stored[0].data) for r in stored[1:4])
+    with db.session() as s:
+        for version, snap_id in enumerate(ids):
+            assert load_payload(s, s.get(Snapshot, snap_id)) == library(version)
+
+
+def test_small_payloads_are_keyframes(db, user_id):
+    for version in range(3):
+        add(db, user_id, {"response": {"players": [{"steamid": "1", "version": version}]}})
+    assert [(r.base_id, r.depth) for r in rows(db, user_id)] == [(None, 0)] * 3
+
+
+def test_retention():
+    retention = SnapshotRetention(keep_all=timedelta(days=2), keep_daily=timedelta(days=10))
+    snaps = [
+        (1, NOW - timedelta(days=20, hours=1)),
+        (2, NOW - timedelta(days=20)),  # same ISO week as 1
+        (3, NOW - timedelta(days=5, hours=3)),
+        (4, NOW - timedelta(days=5, hours=1)),  # same day as 3
+        (5, NOW - timedelta(days=1)),
+        (6, NOW - timedelta(hours=1)),
+    ]
+    assert retention.retained(snaps, NOW) == {2, 4, 5, 6}
+    expiring = SnapshotRetention(keep_all=timedelta(days=2), max_age=timedelta(days=10))
+    assert expiring.retained(snaps, NOW) == {4, 5, 6}
+    # the newest snapshot survives even past max_age
+    assert SnapshotRetention(max_age=timedelta(days=1)).retained(snaps[:2], NOW) == {2}
+
+
+def test_compaction_drops_expired_and_rechains_the_rest(db, user_id, monkeypatch):
+    monkeypatch.setattr(snapshots, "KEYFRAME_INTERVAL", 4)
+    created = [NOW - timedelta(days=12 - day, hours=hour) for day in range(12) for hour in (6, 1)]
+    ids = [add(db, user_id, library(v), at) for v, at in enumerate(created)]
+    # a legacy row written before compression existed
+    with db.session() as s:
+        legacy = Snapshot(user_id=user_id, kind="owned_games", payload=library(99), created_at=NOW)
+        s.add(legacy)
+        s.commit()
+        ids.append(legacy.id)
+    versions = dict(zip(ids, list(range(len(created))) + [99]))
+
+    retention = SnapshotRetention(keep_all=timedelta(days=2), keep_daily=timedelta(days=30))
+    keep = retention.retained([(r.id, r.created_at) for r in rows(db, user_id)], NOW)
+    totals = compact_snapshots(db, retention, now=NOW)
+    assert (totals["kept"], totals["deleted"]) == (len(keep), len(ids) - len(keep))
+
+    stored = rows(db, user_id)
+    assert {r.id for r in stored} == keep
+    assert all(r.data is not None and r.payload is None for r in stored)
+    assert max(r.depth for r in stored) < 4
+    with db.session() as s:
+        for snap in stored:
+            assert load_payload(s, s.get(Snapshot, snap.id)) == library(versions[snap.id])
+
+    assert compact_snapshots(db, retention, now=NOW)["rewritten"] == 0